@@ -0,0 +1,476 @@
+"""
+Bayesian optimization implementation
+
+A Gaussian process models the metric as a function of the hyperparameters, and every new trial is the combination with
+the highest expected improvement over the best metric so far. Trials run on the asynchronous trial runner of
+*trial_scheduler*, so a new combination is proposed as soon as an executor is free. The combinations of the trials that
+are still running are added to the model with a "constant liar" metric, the mean of the finished trials, which keeps
+concurrent proposals apart from each other.
+
+Hyperparameters in *boundary_dict* are given as
+    - [lower, upper] with two ints for an int parameter, or two floats for a float parameter.
+    - [lower, upper, 'log'] for a parameter searched on a log scale, e.g. a learning rate.
+    - any other list, e.g. ['relu', 'tanh'] or [32, 64, 128], for a categorical parameter.
+
+>>> from hops import experiment
+>>> boundary_dict = {'learning_rate': [0.0001, 0.1, 'log'], 'layers': [2, 8], 'activation': ['relu', 'tanh']}
+>>> def train_nn(learning_rate, layers, activation):
+>>>    return network.evaluate(learning_rate, layers, activation)
+>>> experiment.bayesian_optimization(train_nn, boundary_dict, direction='max', samples=30)
+
+The proposals can be checked without Spark or GPUs by answering the trials of the driver with a synthetic objective,
+e.g. *lambda x, y: -(x - 0.3) ** 2 - (y - 0.7) ** 2*, as tests/test_bayesian_optimization.py does.
+"""
+
+from __future__ import absolute_import
+
+from hops import util
+from hops import hdfs as hopshdfs
+from hops import trial_scheduler
+from hops import trial_store
+from hops.distribute import codec
+
+import numpy as np
+import datetime
+import math
+import six
+
+run_id = 0
+
+# number of random candidates the expected improvement is maximized over
+CANDIDATES = 1000
+# number of candidates sampled around each of the best finished trials
+LOCAL_CANDIDATES = 100
+LOCAL_BEST = 5
+
+
+class _Space(object):
+    """
+    Maps hyperparameter combinations to and from points in the unit hypercube, categorical parameters are one-hot encoded
+    """
+
+    def __init__(self, boundary_dict, names):
+        """
+        Args:
+            :boundary_dict: dict of hyperparameter name to its boundaries or categories
+            :names: names of the hyperparameters in the order of the function arguments
+        """
+        self.names = names
+        self.params = []
+        self.dims = 0
+        for name in names:
+            spec = list(boundary_dict[name])
+            numeric = all(isinstance(val, six.integer_types + (float,)) and not isinstance(val, bool) for val in spec[:2])
+            if len(spec) == 3 and spec[2] == 'log' and numeric:
+                kind = 'log'
+            elif len(spec) == 2 and numeric:
+                kind = 'range'
+            else:
+                kind = 'cat'
+
+            if kind == 'cat':
+                if len(spec) < 2:
+                    raise ValueError('Categorical hyperparameter ' + name + ' needs at least two categories')
+                self.params.append({'name': name, 'kind': kind, 'categories': spec, 'dim': self.dims})
+                self.dims += len(spec)
+                continue
+
+            lower, upper = spec[0], spec[1]
+            if not lower < upper:
+                raise ValueError('lower bound: ' + str(lower) + ' must be less than upper bound: ' + str(upper) + ' for ' + name)
+            if kind == 'log' and lower <= 0:
+                raise ValueError('lower bound of log scaled hyperparameter ' + name + ' must be positive')
+            is_int = isinstance(lower, six.integer_types) and isinstance(upper, six.integer_types)
+            self.params.append({'name': name, 'kind': kind, 'int': is_int, 'lower': lower, 'upper': upper, 'dim': self.dims})
+            self.dims += 1
+
+    def encode(self, args):
+        """
+
+        Args:
+            :args: values of the hyperparameters
+
+        Returns:
+            the point in the unit hypercube
+        """
+        x = np.zeros(self.dims)
+        for param, val in zip(self.params, args):
+            if param['kind'] == 'cat':
+                x[param['dim'] + param['categories'].index(val)] = 1.0
+            elif param['kind'] == 'log':
+                x[param['dim']] = (math.log(val) - math.log(param['lower'])) / (math.log(param['upper']) - math.log(param['lower']))
+            elif param['int']:
+                x[param['dim']] = (val - param['lower'] + 0.5) / (param['upper'] - param['lower'] + 1)
+            else:
+                x[param['dim']] = float(val - param['lower']) / (param['upper'] - param['lower'])
+        return x
+
+    def decode(self, x):
+        """
+
+        Args:
+            :x: point in the unit hypercube
+
+        Returns:
+            the values of the hyperparameters, as python types
+        """
+        args = []
+        for param in self.params:
+            if param['kind'] == 'cat':
+                block = x[param['dim']:param['dim'] + len(param['categories'])]
+                args.append(param['categories'][int(np.argmax(block))])
+                continue
+            v = min(max(float(x[param['dim']]), 0.0), 1.0)
+            if param['kind'] == 'log':
+                val = math.exp(math.log(param['lower']) + v * (math.log(param['upper']) - math.log(param['lower'])))
+                if param['int']:
+                    val = int(round(val))
+            elif param['int']:
+                val = param['lower'] + int(math.floor(v * (param['upper'] - param['lower'] + 1)))
+            else:
+                val = param['lower'] + v * (param['upper'] - param['lower'])
+            # exp and rounding can step just outside of the bounds
+            args.append(min(max(val, param['lower']), param['upper']))
+        return args
+
+    def sample(self, n):
+        """
+
+        Args:
+            :n: number of combinations
+
+        Returns:
+            list of n uniformly sampled hyperparameter combinations
+        """
+        return [self.decode(x) for x in np.random.rand(n, self.dims)]
+
+
+def _matern52(A, B, lengthscales):
+    """
+
+    Args:
+        :A: matrix of points
+        :B: matrix of points
+        :lengthscales: lengthscale of every dimension
+
+    Returns:
+        Matern 5/2 kernel matrix between the rows of A and B
+    """
+    A = A / lengthscales
+    B = B / lengthscales
+    sq_dist = np.sum(A ** 2, axis=1)[:, np.newaxis] + np.sum(B ** 2, axis=1)[np.newaxis, :] - 2 * np.dot(A, B.T)
+    d = np.sqrt(np.maximum(sq_dist, 0)) * math.sqrt(5)
+    return (1 + d + d ** 2 / 3) * np.exp(-d)
+
+
+class _GaussianProcess(object):
+    """
+    Gaussian process regression with a Matern 5/2 kernel. Every dimension has its own lengthscale, picked from a grid
+    by coordinate ascent on the marginal likelihood, so hyperparameters that barely matter are smoothed over.
+    """
+
+    lengthscales = [0.05, 0.1, 0.2, 0.3, 0.5, 0.8, 1.2, 2.0]
+
+    def __init__(self, noise=1e-4, sweeps=2):
+        """
+        Args:
+            :noise: variance of the observation noise, relative to the variance of the metrics
+            :sweeps: number of passes over the dimensions when fitting the lengthscales
+        """
+        self.noise = noise
+        self.sweeps = sweeps
+
+    def _log_likelihood(self, lengthscales, y):
+        """
+
+        Args:
+            :lengthscales: lengthscale of every dimension
+            :y: normalized observed metrics
+
+        Returns:
+            the log marginal likelihood, the cholesky factor and the weights, None if the kernel matrix is singular
+        """
+        K = _matern52(self.X, self.X, lengthscales) + self.noise * np.eye(len(self.X))
+        try:
+            L = np.linalg.cholesky(K)
+        except np.linalg.LinAlgError:
+            return None
+        alpha = np.linalg.solve(L.T, np.linalg.solve(L, y))
+        return -0.5 * np.dot(y, alpha) - np.sum(np.log(np.diag(L))), L, alpha
+
+    def fit(self, X, y):
+        """
+
+        Args:
+            :X: matrix of observed points
+            :y: observed metrics
+        """
+        self.X = X
+        self.y_mean = np.mean(y)
+        self.y_std = np.std(y) if np.std(y) > 0 else 1.0
+        y = (y - self.y_mean) / self.y_std
+
+        lengthscales = np.full(X.shape[1], 0.5)
+        best = self._log_likelihood(lengthscales, y)
+        for _ in range(self.sweeps):
+            for dim in range(X.shape[1]):
+                for lengthscale in self.lengthscales:
+                    candidate = lengthscales.copy()
+                    candidate[dim] = lengthscale
+                    fitted = self._log_likelihood(candidate, y)
+                    if fitted is not None and (best is None or fitted[0] > best[0]):
+                        best, lengthscales = fitted, candidate
+
+        if best is None:
+            raise ValueError('Could not fit the Gaussian process, the observed points are degenerate')
+        self.lengthscale = lengthscales
+        _, self.L, self.alpha = best
+
+    def predict(self, Xs):
+        """
+
+        Args:
+            :Xs: matrix of points
+
+        Returns:
+            predicted mean and standard deviation of the metric at every point
+        """
+        Ks = _matern52(Xs, self.X, self.lengthscale)
+        mu = np.dot(Ks, self.alpha)
+        v = np.linalg.solve(self.L, Ks.T)
+        var = np.maximum(1.0 - np.sum(v ** 2, axis=0), 1e-12)
+        return mu * self.y_std + self.y_mean, np.sqrt(var) * self.y_std
+
+
+_erf = np.vectorize(math.erf)
+
+
+def _expected_improvement(mu, sigma, best, xi=0.01):
+    """
+
+    Args:
+        :mu: predicted means
+        :sigma: predicted standard deviations
+        :best: best observed metric, larger is better
+        :xi: minimum improvement, trades exploitation for exploration
+
+    Returns:
+        the expected improvement over best at every point
+    """
+    improvement = mu - best - xi
+    z = improvement / sigma
+    cdf = 0.5 * (1 + _erf(z / math.sqrt(2)))
+    pdf = np.exp(-0.5 * z ** 2) / math.sqrt(2 * math.pi)
+    return improvement * cdf + sigma * pdf
+
+
+class _BayesianServer(trial_scheduler.Server):
+    """
+    Trial server that proposes the next combination to run whenever an executor asks for a trial
+    """
+
+    def __init__(self, space, samples, initial_samples, direction, map_fun, store=None, dataset_version=None):
+        """
+        Args:
+            :space: the _Space of the hyperparameters
+            :samples: the number of trials to run
+            :initial_samples: the number of random trials before the Gaussian process is used
+            :direction: 'max' or 'min'
+            :map_fun: the function of the experiment
+            :store: the TrialStore to look up previously evaluated combinations in
+            :dataset_version: version of the training data
+        """
+        super(_BayesianServer, self).__init__([], trial_scheduler.FIFOScheduler(), secret=codec.new_secret())
+        self.space = space
+        self.samples = samples
+        self.initial_samples = initial_samples
+        self.sign = 1.0 if direction == 'max' else -1.0
+        self.store = store
+        self.dataset_version = dataset_version
+        self.dispatched = 0
+        self.running = {}
+        self.observed = []
+        self.failed = []
+        self.seen = set()
+        self.trials = []
+        if store is not None:
+            self.function_key = trial_store._function_key(map_fun)
+
+    def _next_trial(self):
+        """
+        Proposes the next combination, combinations with a stored result are observed right away
+
+        Returns:
+            the trial or None when all trials were handed out
+        """
+        while self.dispatched < self.samples:
+            args = self._propose()
+            param_string = trial_store._param_string(self.space.names, args)
+            self.seen.add(param_string)
+            trial_id = self.dispatched
+            self.dispatched += 1
+
+            if self.store is not None:
+                key = trial_store._trial_key(self.function_key, self.space.names, args, self.dataset_version)[0]
+                stored = self.store.get_many([key])
+                if key in stored:
+                    print('Reusing the stored metric of ' + param_string)
+                    self.observed.append((args, param_string, stored[key]))
+                    continue
+
+            self.running[trial_id] = (args, param_string)
+            self.trials.append(args)
+            return {'id': trial_id, 'args': args, 'param_string': param_string}
+        return None
+
+    def _on_trial_complete(self, result):
+        """
+
+        Args:
+            :result: dict with the 'id' and 'metric' of the trial and if it 'failed'
+        """
+        args, param_string = self.running.pop(result['id'])
+        # failed trials are left out of the Gaussian process, the combination is not proposed again
+        if result.get('failed'):
+            self.failed.append(param_string)
+        else:
+            self.observed.append((args, param_string, result['metric']))
+
+    def _propose(self):
+        """
+
+        Returns:
+            the unseen combination with the highest expected improvement, a random one while there are fewer than
+            initial_samples finished trials
+        """
+        if len(self.observed) < self.initial_samples:
+            return self._random()
+
+        X = np.array([self.space.encode(args) for args, _, _ in self.observed])
+        y = self.sign * np.array([metric for _, _, metric in self.observed], dtype=float)
+        best = np.max(y)
+
+        # constant liar, the running trials are assumed to end with the mean metric
+        if len(self.running) > 0:
+            X = np.vstack([X] + [self.space.encode(args) for args, _ in self.running.values()])
+            y = np.concatenate([y, np.full(len(self.running), np.mean(y))])
+
+        gp = _GaussianProcess()
+        try:
+            gp.fit(X, y)
+        except ValueError:
+            return self._random()
+
+        top = X[np.argsort(-y)[:LOCAL_BEST]]
+        local = np.repeat(top, LOCAL_CANDIDATES, axis=0) + 0.05 * np.random.randn(len(top) * LOCAL_CANDIDATES, self.space.dims)
+        candidates = []
+        for x in np.vstack([np.random.rand(CANDIDATES, self.space.dims), np.clip(local, 0, 1)]):
+            args = self.space.decode(x)
+            if trial_store._param_string(self.space.names, args) not in self.seen:
+                candidates.append(args)
+        if len(candidates) == 0:
+            return self._random()
+
+        mu, sigma = gp.predict(np.array([self.space.encode(args) for args in candidates]))
+        return candidates[int(np.argmax(_expected_improvement(mu, sigma, best)))]
+
+    def _random(self):
+        """
+
+        Returns:
+            a random combination, unseen if one is found
+        """
+        for args in self.space.sample(100):
+            if trial_store._param_string(self.space.names, args) not in self.seen:
+                return args
+        return args
+
+
+def _launch(sc, map_fun, args_dict, samples, direction='max', initial_samples=None, local_logdir=False, name="no-name", dataset_version=None, retries=0):
+    """
+
+    Args:
+        sc:
+        map_fun:
+        args_dict:
+        samples:
+        direction:
+        initial_samples:
+        local_logdir:
+        name:
+        dataset_version:
+        retries:
+
+    Returns:
+
+    """
+    global run_id
+
+    app_id = str(sc.applicationId)
+
+    if direction != 'max' and direction != 'min':
+        raise ValueError('Invalid direction ' + direction +  ', must be max or min')
+
+    space = _Space(args_dict, trial_store._arg_names(map_fun))
+    if initial_samples is None:
+        initial_samples = max(4, len(space.params) + 1)
+    initial_samples = min(initial_samples, samples)
+
+    sc.setJobGroup("Bayesian Optimization", "{} | Hyperparameter Optimization".format(name))
+
+    store = trial_store._open(dataset_version)
+    server = _BayesianServer(space, samples, initial_samples, direction, map_fun, store=store, dataset_version=dataset_version)
+
+    job_start = datetime.datetime.now()
+    try:
+        trial_store._run_and_save(store, map_fun,
+                                  lambda: trial_scheduler._run(sc, server, map_fun, samples, app_id, run_id, 'bayesian_optimization', local_logdir=local_logdir, retries=retries),
+                                  server.trials, server.table.results, dataset_version)
+    finally:
+        if store is not None:
+            store.close()
+    job_end = datetime.datetime.now()
+
+    job_time_str = util._time_diff(job_start, job_end)
+
+    hdfs_runid_dir = _get_logdir(app_id)
+
+    results = [(param_string, metric) for _, param_string, metric in server.observed]
+    max_val, max_hp, min_val, min_hp, avg = util._get_best(results)
+    failed_str = ''
+    if len(server.failed) > 0:
+        failed_str = 'FAILED combinations ' + ', '.join(server.failed) + '\n'
+
+    if direction == 'max':
+        param_combination = max_hp
+        best_val = str(max_val)
+        worst_hp, worst_val = min_hp, min_val
+    else:
+        param_combination = min_hp
+        best_val = str(min_val)
+        worst_hp, worst_val = max_hp, max_val
+
+    results = '\n------ Bayesian Optimization results ------ direction(' + direction + ') \n' \
+    'BEST combination ' + param_combination + ' -- metric ' + best_val + '\n' \
+    'WORST combination ' + worst_hp + ' -- metric ' + str(worst_val) + '\n' \
+    'AVERAGE metric -- ' + str(avg) + '\n' \
+    + failed_str + \
+    'Total job time ' + job_time_str + '\n'
+    util._write_result(hdfs_runid_dir, results)
+    print(results)
+
+    print('Finished Experiment \n')
+
+    return hdfs_runid_dir, param_combination, best_val
+
+def _get_logdir(app_id):
+    """
+
+    Args:
+        app_id:
+
+    Returns:
+
+    """
+    global run_id
+    return hopshdfs._get_experiments_dir() + '/' + app_id + '/bayesian_optimization/run.' +  str(run_id)
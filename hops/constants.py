@@ -33,6 +33,7 @@ class ENV_VARIABLES:
     PATH_ENV_VAR = "PATH"
     PYTHONPATH_ENV_VAR = "PYTHONPATH"
     JOB_NAME_ENV_VAR = "HOPSWORKS_JOB_NAME"
+    LOCALIZATION_CACHE_SIZE_ENV_VAR = "HOPS_LOCALIZATION_CACHE_SIZE"
 
 
 class KAFKA_SSL_CONFIG:
@@ -2,11 +2,14 @@
 
 Utility functions to retrieve information about available devices in the environment.
 
+The devices are read with *telemetry*, through NVML if the pynvml bindings are installed, and only once per process.
+
 """
-import subprocess
 import time
 import threading
 
+from hops import telemetry
+
 def _get_gpu_info():
     """
     Get the gpu information
@@ -14,24 +17,19 @@ def _get_gpu_info():
     Returns:
 
     """
-    gpu_str = ''
-    try:
-        gpu_info = subprocess.check_output(["nvidia-smi", "--format=csv,noheader,nounits", "--query-gpu=name,memory.total,memory.used,utilization.gpu"]).decode()
-        gpu_info = gpu_info.split('\n')
-    except:
-        gpu_str = '\nCould not find any GPUs accessible for the container\n'
-        return gpu_str
+    devices = telemetry.devices()
+    if len(devices) == 0:
+        return '\nCould not find any GPUs accessible for the container\n'
 
     # Check each gpu
     gpu_str = ''
-    for line in gpu_info:
-        if len(line) > 0:
-            name, total_memory, memory_used, gpu_util = line.split(',')
-            gpu_str += '\nName: ' + name + '\n'
-            gpu_str += 'Total memory: ' + total_memory + '\n'
-            gpu_str += 'Currently allocated memory: ' + memory_used + '\n'
-            gpu_str += 'Current utilization: ' + gpu_util + '\n'
-            gpu_str += '\n'
+    samples = telemetry.sample()
+    for device, current in zip(devices, samples):
+        gpu_str += '\nName: ' + device['name'] + '\n'
+        gpu_str += 'Total memory: ' + str(device['memory_total']) + '\n'
+        gpu_str += 'Currently allocated memory: ' + str(current['memory_used']) + '\n'
+        gpu_str += 'Current utilization: ' + str(current['utilization']) + '\n'
+        gpu_str += '\n'
 
     return gpu_str
 
@@ -41,20 +39,10 @@ def _get_gpu_util():
     Returns:
 
     """
-    gpu_str = ''
-    try:
-        gpu_info = subprocess.check_output(["nvidia-smi", "--format=csv,noheader,nounits", "--query-gpu=name,memory.total,memory.used,utilization.gpu"]).decode()
-        gpu_info = gpu_info.split('\n')
-    except:
-        return gpu_str
-
-    gpu_str = '\n------------------------------ GPU usage information ------------------------------\n'
-    for line in gpu_info:
-        if len(line) > 0:
-            name, total_memory, memory_used, gpu_util = line.split(',')
-            gpu_str += '[Type: ' + name + ', Memory Usage: ' + memory_used + ' /' + total_memory + ' (MB), Current utilization: ' + gpu_util + '%]\n'
-    gpu_str += '-----------------------------------------------------------------------------------\n'
-    return gpu_str
+    samples = telemetry.sample()
+    if len(samples) == 0:
+        return ''
+    return telemetry._format_utilization(samples)
 
 def _print_periodic_gpu_utilization():
     """
@@ -68,7 +56,8 @@ def _print_periodic_gpu_utilization():
         time.sleep(10)
 
 def get_num_gpus():
-    """ Get the number of GPUs available in the environment and consequently by the application
+    """ Get the number of GPUs available in the environment and consequently by the application. The GPUs are only
+    looked up on the first call in a process.
 
     Assuming there is one GPU in the environment
 
@@ -79,38 +68,12 @@ def get_num_gpus():
     Returns:
         Number of GPUs available in the environment
     """
-    try:
-        gpu_info = subprocess.check_output(["nvidia-smi", "--format=csv,noheader,nounits", "--query-gpu=name"]).decode()
-        gpu_info = gpu_info.split('\n')
-    except:
-        return 0
-
-    count = 0
-    for line in gpu_info:
-        if len(line) > 0:
-            count += 1
-    return count
+    return telemetry.num_gpus()
 
 def _get_minor_gpu_device_numbers():
     """
 
     Returns:
-
+        list of the minor numbers of the GPUs, the N of their /dev/nvidiaN device
     """
-    gpu_info = []
-    try:
-        gpu_info = subprocess.check_output(["nvidia-smi", "--format=csv,noheader,nounits", "--query-gpu=pci.bus_id"]).decode()
-    except:
-        return gpu_info
-
-    gpu_info = gpu_info.split('\n')
-    device_id_list = []
-    for line in gpu_info:
-        if len(line) > 0:
-            pci_bus_id = line.split(',')
-            device_id_list.append(pci_bus_id)
-
-
-
-
-
+    return [device['minor_number'] for device in telemetry.devices()]
@@ -2,21 +2,23 @@
 Differential evolution implementation
 """
 
+from __future__ import absolute_import
 
-import random
 from collections import OrderedDict
-import os
 
 from hops import hdfs as hopshdfs
-from hops import tensorboard
-from hops import devices
-from hops import util
+from hops import metrics as hopsmetrics
+from hops import runtime
+from hops import trial_scheduler
+from hops import trial_store
+from hops.distribute import codec
 
 import pydoop.hdfs
-import threading
 import six
-import datetime
-import copy
+import math
+import time
+
+import numpy as np
 
 objective_function=None
 spark_session=None
@@ -25,43 +27,39 @@ cleanup=None
 summary_file=None
 fs_handle=None
 local_logdir_bool=False
+metric_server_addr=None
+metric_server_secret=None
+store_dataset_version=None
+packed_trials=1
+trial_retries=0
 
 generation_id = 0
 run_id = 0
+evaluated = {}
 
-def _get_all_accuracies(tensorboard_hdfs_logdir, args_dict, number_params):
+def _get_all_accuracies(results, args_dict, number_params):
     """
-    Retrieves all accuracies from the parallel executions (each one is in a
-    different file, one per combination of wrapper function parameter)
+    Looks up the metric of every individual in the results returned by the parallel executions (one per combination of
+    wrapper function parameters)
 
     Args:
-        :tensorboard_hdfs_logdir:
+        :results: dict of param_string to the metric returned for it
         :args_dict:
         :number_params:
 
     Returns:
-
+        list of metrics in the same order as args_dict
     """
 
-    results=[]
-
     #Important, this must be ordered equally than _parse_to_dict function
     population_dict = diff_evo.get_dict()
-    global run_id
-    for i in range(number_params):
-        path_to_log= tensorboard_hdfs_logdir + "differential_evolution/run." + str(run_id) + "/generation." + str(generation_id - 1) + "/"
-        for k in population_dict:
-            path_to_log+=k+"="+str(args_dict[k][i])+"."
-        path_to_log = path_to_log[:(len(path_to_log) -1)]
-        path_to_log = path_to_log + '/metric'
-
-        with pydoop.hdfs.open(path_to_log, "r") as fi:
-            metric = fi.read()
-            fi.close()
 
-        results.append(metric)
+    metrics = []
+    for i in range(number_params):
+        param_string = '.'.join([k + "=" + str(args_dict[k][i]) for k in population_dict])
+        metrics.append(float(results[param_string]))
 
-    return [float(res) for res in results]
+    return metrics
 
 def _execute_all(population_dict, name="no-name"):
     """
@@ -76,70 +74,29 @@ def _execute_all(population_dict, name="no-name"):
     Returns:
 
     """
-    initial_pop = copy.deepcopy(population_dict)
-
-    number_hp_combinations=[len(v) for v in population_dict.values()][0]
-    # directory for current generation
-
-
-    # Do not run hyperparameter combinations that are duplicated
-    # Find all duplicates and delete them
-    keys = population_dict.keys()
-    i=0
-    while i < number_hp_combinations:
-        duplicate_entries = _duplicate_entry(i, keys, population_dict, number_hp_combinations)
-        if len(duplicate_entries) > 0:
-            # sort entries, delete descending
-            for index in duplicate_entries:
-                for key in keys:
-                    population_dict[key].pop(index)
-            i=0
-            number_hp_combinations = [len(v) for v in population_dict.values()][0]
-        else:
-            i+=1
-
-    tensorboard_hdfs_logdir = _evolutionary_launch(spark_session, objective_function, population_dict, name=name)
+    keys = list(population_dict.keys())
+    number_hp_combinations = len(population_dict[keys[0]])
 
-    return _get_all_accuracies(tensorboard_hdfs_logdir, initial_pop, [len(v) for v in initial_pop.values()][0])
+    # Do not run hyperparameter combinations that are duplicated, keep the first occurrence of each
+    seen = set()
+    unique = []
+    for i, combination in enumerate(zip(*[population_dict[key] for key in keys])):
+        if combination not in seen:
+            seen.add(combination)
+            unique.append(i)
 
+    unique_population_dict = OrderedDict((key, [population_dict[key][i] for i in unique]) for key in keys)
 
-def _duplicate_entry(i, keys, population, len):
-    """
+    results = _evolutionary_launch(spark_session, objective_function, unique_population_dict, name=name)
 
-    Args:
-        :i:
-        :keys:
-        :population:
-        :len:
+    return _get_all_accuracies(results, population_dict, number_hp_combinations)
 
-    Returns:
-
-    """
-    hp_combinations = []
-    duplicate_indices = []
-
-    for val in range(len):
-        entry=''
-        for key in keys:
-            entry += str(population[key][val]) + '='
-        hp_combinations.append(entry)
-
-    to_find = hp_combinations[i]
-    #get the duplicate indices
-    for y in range(len):
-        if hp_combinations[y] == to_find and y != i:
-            duplicate_indices.insert(0, y)
-
-    return duplicate_indices
 
 class DifferentialEvolution:
     _types = ['float', 'int', 'cat']
-    _generation = 0
-    _scores = []
-    _ordered_population_dict = []
-    _param_names = []
+    _strategies = ['rand/1/bin', 'best/1/bin', 'current-to-best/1/bin']
 
-    def __init__(self, objective_function, parbounds, types, ordered_dict, direction = 'max', generations=10, popsize=10, mutation=0.5, crossover=0.7, name="no-name"):
+    def __init__(self, objective_function, parbounds, types, ordered_dict, direction = 'max', generations=10, popsize=10, mutation=0.5, crossover=0.7, name="no-name", strategy='rand/1/bin'):
         """
 
         Args:
@@ -149,11 +106,21 @@ class DifferentialEvolution:
             :ordered_dict:
             :direction:
             :generations:
-            :popsize:
+            :popsize: number of individuals, at least 4
             :mutation:
             :crossover:
             :name:
+            :strategy: how donor vectors are created, 'rand/1/bin', 'best/1/bin' or 'current-to-best/1/bin'
         """
+        if direction != 'max' and direction != 'min':
+            raise ValueError('invalid direction: ' + direction)
+        if strategy not in self._strategies:
+            raise ValueError('invalid strategy: ' + strategy + ', must be one of ' + str(self._strategies))
+        if popsize < 4:
+            # the mutation picks three individuals other than the target
+            print('Warning: a population of ' + str(popsize) + ' is too small for differential evolution, using 4')
+            popsize = 4
+
         self.objective_function = objective_function
         self.parbounds = parbounds
         self.direction = direction
@@ -164,15 +131,19 @@ class DifferentialEvolution:
         self.CR = crossover
         self._ordered_population_dict = ordered_dict
         self.name = name
+        self.strategy = strategy
 
         global generation_id
         generation_id = 0
 
-        self._param_names = []
-        for entry in ordered_dict:
-            self._param_names.append(entry)
+        self._generation = 0
+        self._scores = None
+        self._param_names = list(ordered_dict.keys())
 
-        #self.m = -1 if maximize else 1
+        bounds = np.array(self._individual_representation(), dtype=float)
+        self._lower = bounds[:, 0]
+        self._upper = bounds[:, 1]
+        self._rounded = np.array([t != 'float' for t in self.types])
 
     # run differential evolution algorithms
     def _solve(self, root_dir):
@@ -184,92 +155,150 @@ class DifferentialEvolution:
         Returns:
 
         """
-        # initialise generation based on individual representation
-        population, bounds = self._population_initialisation()
-        global fs_handle
-        fs_handle = hopshdfs.get_fs()
-        global run_id
+        global summary_file
+        summary_file = root_dir + "/summary"
+
+        contents = "Differential evolution summary\n\n"
+        self._write_summary(contents)
+
+        population = self._population_initialisation()
+        contents += self._generation_summary(population) + "\n"
+        self._write_summary(contents)
+
+        for _ in range(self.generations):
+
+            population = self._step(population)
+
+            contents += self._generation_summary(population) + "\n"
+            self._write_summary(contents)
 
-        contents = ''
-        generation_summary = ''
-        new_gen_best_param = None
-        new_gen_best = None
+            if cleanup:
+                pydoop.hdfs.rmr(root_dir + '/generation.' + str(self._generation-1))
+
+        best_param, best = self._best(population)
+
+        self._write_summary(contents + "\nBest parameter combination found " + str(best_param) + " with metric " + str(best))
+
+        return best_param, best
+
+    def _solve_steady_state(self, root_dir):
+        """
+        Runs as many evaluations as _solve, but without a barrier between generations. A trial vector is created as
+        soon as an executor is free, and replaces its target as soon as its metric arrives if it is better.
+
+        Args:
+            :root_dir:
+
+        Returns:
+
+        """
         global summary_file
         summary_file = root_dir + "/summary"
 
-        global fd
+        self._summary = "Differential evolution summary (steady state)\n\n"
+        self._write_summary(self._summary)
+
+        population = self._lower + np.random.rand(self.n, len(self.parbounds)) * (self._upper - self._lower)
+        population = self._ensure_bounds(population)
+        self._scores = np.full(self.n, np.nan)
+
+        store = trial_store._open(store_dataset_version)
+        server = _SteadyStateServer(self, population, root_dir, store=store)
         try:
-            fd = fs_handle.open_file(summary_file, mode='w')
-        except:
-            fd = fs_handle.open_file(summary_file, flags='w')
-        fd.write(("Differential evolution summary\n\n").encode())
+            trial_store._run_and_save(store, objective_function,
+                                      lambda: _steady_state_launch(spark_session, objective_function, server, name=self.name),
+                                      server.trials, server.table.results, store_dataset_version)
+        finally:
+            if store is not None:
+                store.close()
 
-        for _ in range(self.generations):
+        best_param, best = self._best(server.population)
 
-            donor_population = self._mutation(population, bounds)
-            trial_population = self._recombination(population, donor_population)
+        self._write_summary(self._summary + "\nBest parameter combination found " + str(best_param) + " with metric " + str(best))
 
-            population = self._selection(population, trial_population)
+        return best_param, best
 
-            new_gen_avg = sum(self._scores)/self.n
+    def _on_generation(self, population):
+        """
+        Adds the summary of a generation finished in steady state mode to the summary file
 
-            if self.direction == 'max':
-                new_gen_best = max(self._scores)
-            elif self.direction == 'min':
-                new_gen_best = min(self._scores)
-            else:
-                raise ValueError('invalid direction: ' + self.direction)
+        Args:
+            :population: matrix of individuals
+        """
+        self._summary += self._generation_summary(population) + "\n"
+        self._write_summary(self._summary)
+
+    def _step(self, population):
+        """
+        Evolves the population by one generation
 
-            new_gen_best_param = self._parse_back(population[self._scores.index(new_gen_best)])
+        Args:
+            :population: matrix of individuals
 
-            index = 0
-            for name in self._param_names:
-                new_gen_best_param[index] = name + "=" + str(new_gen_best_param[index])
-                index += 1
+        Returns:
+            the population of the next generation
+        """
+        donor_population = self._mutation(population)
+        trial_population = self._recombination(population, donor_population)
+        return self._selection(population, trial_population)
 
-            contents = ''
-            try:
-                with pydoop.hdfs.open(summary_file, encoding='utf-8') as f:
-                    for line in f:
-                        contents += line.decode('utf-8')
-            except:
-                with pydoop.hdfs.open(summary_file) as f:
-                    for line in f:
-                        contents += line.decode('utf-8')
-
-            generation_summary = "Generation " + str(self._generation) + " || " + "average metric: " + str(new_gen_avg) \
-                             + ", best metric: " + str(new_gen_best) + ", best parameter combination: " + str(new_gen_best_param) + "\n"
-            print(generation_summary)
+    def _best(self, population):
+        """
 
-            try:
-                fd = fs_handle.open_file(summary_file, mode='w')
-            except:
-                fd = fs_handle.open_file(summary_file, flags='w')
+        Args:
+            :population: matrix of individuals
 
-            fd.write((contents + generation_summary + "\n").encode())
+        Returns:
+            the best parameter combination as a list of name=value strings, and its metric
+        """
+        best_index = self._best_index()
+        best_param = self._parse_back(population[best_index])
+        best_param = [name + "=" + str(value) for name, value in zip(self._param_names, best_param)]
+        return best_param, float(self._scores[best_index])
 
-            fd.flush()
-            fd.close()
+    def _best_index(self):
+        """
 
-            if cleanup:
-                pydoop.hdfs.rmr(root_dir + '/generation.' + str(self._generation-1))
+        Returns:
+            index of the individual with the best score
+        """
+        # individuals that are still being evaluated in steady state mode have a NaN score
+        if np.all(np.isnan(self._scores)):
+            raise Exception('All trials failed, see the error file in the directory of each trial')
+        if self.direction == 'max':
+            return int(np.nanargmax(self._scores))
+        return int(np.nanargmin(self._scores))
+
+    def _generation_summary(self, population):
+        """
 
+        Args:
+            :population: matrix of individuals
+
+        Returns:
+            summary line of the current generation, which is also printed
+        """
+        best_param, best = self._best(population)
+        generation_summary = "Generation " + str(self._generation) + " || " + "average metric: " + str(float(np.nanmean(self._scores))) \
+                             + ", best metric: " + str(best) + ", best parameter combination: " + str(best_param) + "\n"
+        print(generation_summary)
+        return generation_summary
+
+    def _write_summary(self, contents):
+        """
+
+        Args:
+            :contents: the whole summary file
+        """
+        fs_handle = hopshdfs.get_fs()
         try:
             fd = fs_handle.open_file(summary_file, mode='w')
         except:
             fd = fs_handle.open_file(summary_file, flags='w')
-
-        fd.write((contents + generation_summary + "\n\nBest parameter combination found " + str(new_gen_best_param) + " with metric " + str(new_gen_best)).encode())
-
+        fd.write(contents.encode())
         fd.flush()
         fd.close()
 
-        parsed_back_population = []
-        for indiv in population:
-            parsed_back_population.append(self._parse_back(indiv))
-
-        return new_gen_best_param, new_gen_best
-
     # define bounds of each individual depending on type
     def _individual_representation(self):
         """
@@ -290,193 +319,151 @@ class DifferentialEvolution:
             bounds.append(b)
         return bounds
 
-    # initialise population
+    # initialise and evaluate population
     def _population_initialisation(self):
         """
 
         Returns:
-
+            matrix with one individual per row
         """
-        population = []
-        num_parameters = len(self.parbounds)
-        for i in range(self.n):
-            indiv = []
-            bounds = self._individual_representation()
-
-            for i in range(num_parameters):
-                indiv.append(random.uniform(bounds[i][0], bounds[i][1]))
-            indiv = self._ensure_bounds(indiv, bounds)
-            population.append(indiv)
-        return population, bounds
+        population = self._lower + np.random.rand(self.n, len(self.parbounds)) * (self._upper - self._lower)
+        population = self._ensure_bounds(population)
+        self._scores = self._evaluate(population)
+        return population
 
-    # ensure that any mutated individual is within bounds
-    def _ensure_bounds(self, indiv, bounds):
+    # ensure that mutated individuals are within bounds
+    def _ensure_bounds(self, population):
         """
 
         Args:
-            :indiv:
-            :bounds:
+            :population: matrix of individuals
 
         Returns:
-
+            the population clipped to the bounds, with int and categorical parameters rounded
         """
-        indiv_correct = []
+        population = np.clip(population, self._lower, self._upper)
+        population[:, self._rounded] = np.round(population[:, self._rounded])
+        return population
 
-        for i in range(len(indiv)):
-            par = indiv[i]
+    def _random_indices(self, count):
+        """
+        Picks count distinct individuals for every individual, all different from the individual itself
 
-            # check if param is within bounds
-            lowerbound = bounds[i][0]
-            upperbound = bounds[i][1]
-            if par < lowerbound:
-                par = lowerbound
-            elif par > upperbound:
-                par = upperbound
+        Args:
+            :count: number of indices per individual
 
-            # check if param needs rounding
-            if self.types[i] != 'float':
-                par = int(round(par))
-            indiv_correct.append(par)
-        return indiv_correct
+        Returns:
+            matrix of indices with shape (n, count)
+        """
+        keys = np.random.rand(self.n, self.n)
+        np.fill_diagonal(keys, np.inf)
+        return np.argsort(keys, axis=1)[:, :count]
 
-    # create donor population based on mutation of three vectors
-    def _mutation(self, population, bounds):
+    # create donor population according to the strategy
+    def _mutation(self, population):
         """
 
         Args:
-            :population:
-            :bounds:
+            :population: matrix of individuals
 
         Returns:
-
+            matrix of donor vectors
         """
-        donor_population = []
-        for i in range(self.n):
-
-            indiv_indices = list(range(0, self.n))
-            indiv_indices.remove(i)
+        return self._donors(population, population, self._random_indices(3))
 
-            candidates = random.sample(indiv_indices, 3)
-            x_1 = population[candidates[0]]
-            x_2 = population[candidates[1]]
-            x_3 = population[candidates[2]]
+    def _donors(self, population, current, r):
+        """
 
-            # substracting the second from the third candidate
-            x_diff = [x_2_i - x_3_i for x_2_i, x_3_i in zip(x_2, x_3)]
-            donor_vec = [x_1_i + self.F*x_diff_i for x_1_i, x_diff_i in zip (x_1, x_diff)]
-            donor_vec = self._ensure_bounds(donor_vec, bounds)
-            donor_population.append(donor_vec)
+        Args:
+            :population: matrix of individuals
+            :current: matrix of the individuals to create donor vectors for
+            :r: matrix with three distinct indices of other individuals in population for every row of current
 
-        return donor_population
+        Returns:
+            matrix of donor vectors
+        """
+        if self.strategy == 'rand/1/bin':
+            donor_population = population[r[:, 0]] + self.F * (population[r[:, 1]] - population[r[:, 2]])
+        elif self.strategy == 'best/1/bin':
+            best = population[self._best_index()]
+            donor_population = best + self.F * (population[r[:, 0]] - population[r[:, 1]])
+        else:
+            best = population[self._best_index()]
+            donor_population = current + self.F * (best - current) + self.F * (population[r[:, 0]] - population[r[:, 1]])
+        return self._ensure_bounds(donor_population)
 
     # recombine donor vectors according to crossover probability
     def _recombination(self, population, donor_population):
         """
 
         Args:
-            :population:
-            :donor_population:
+            :population: matrix of individuals
+            :donor_population: matrix of donor vectors
 
         Returns:
-
+            matrix of trial vectors
         """
-        trial_population = []
-        for k in range(self.n):
-            target_vec = population[k]
-            donor_vec = donor_population[k]
-            trial_vec = []
-            for p in range(len(self.parbounds)):
-                crossover = random.random()
-
-                # if random number is below set crossover probability do recombination
-                if crossover <= self.CR:
-                    trial_vec.append(donor_vec[p])
-                else:
-                    trial_vec.append(target_vec[p])
-            trial_population.append(trial_vec)
-        return trial_population
+        crossover = np.random.rand(*population.shape) <= self.CR
+        # every trial vector takes at least one parameter from its donor vector
+        crossover[np.arange(population.shape[0]), np.random.randint(population.shape[1], size=population.shape[0])] = True
+        return np.where(crossover, donor_population, population)
 
     # select the best individuals from each generation
     def _selection(self, population, trial_population):
         """
 
         Args:
-            :population:
-            :trial_population:
+            :population: matrix of individuals
+            :trial_population: matrix of trial vectors
 
         Returns:
-
+            the population of the next generation
         """
-        # Calculate trial vectors and target vectors and select next generation
+        trial_population_scores = self._evaluate(trial_population)
 
-        if self._generation == 0:
-            parsed_population = []
-            for target_vec in population:
-                parsed_target_vec = self._parse_back(target_vec)
-                parsed_population.append(parsed_target_vec)
+        if self.direction == 'max':
+            improved = trial_population_scores > self._scores
+        else:
+            improved = trial_population_scores < self._scores
+        # an individual whose trial failed is replaced by any trial vector that did not
+        improved |= np.isnan(self._scores) & ~np.isnan(trial_population_scores)
 
-            parsed_population = self._parse_to_dict(parsed_population)
-            self._scores = self.objective_function(parsed_population, name=self.name)
+        population = np.where(improved[:, np.newaxis], trial_population, population)
+        self._scores = np.where(improved, trial_population_scores, self._scores)
 
-            new_gen_avg = sum(self._scores)/self.n
+        self._generation += 1
 
-            if self.direction == 'max':
-                new_gen_best = max(self._scores)
-            elif self.direction == 'min':
-                new_gen_best = min(self._scores)
-            else:
-                raise ValueError('invalid direction: ' + self.direction)
+        return population
 
-            new_gen_best_param = self._parse_back(population[self._scores.index(new_gen_best)])
+    def _trial_vector(self, population, target, candidates):
+        """
+        Creates the trial vector of a single individual for steady state mode
 
-            index = 0
-            for name in self._param_names:
-                new_gen_best_param[index] = name + "=" + str(new_gen_best_param[index])
-                index += 1
+        Args:
+            :population: matrix of individuals
+            :target: index of the individual
+            :candidates: indices of the evaluated individuals to create the donor vector from
 
-            contents = ''
-            try:
-                with pydoop.hdfs.open(summary_file, encoding='utf-8') as f:
-                    for line in f:
-                        contents += line.decode('utf-8')
-            except:
-                with pydoop.hdfs.open(summary_file) as f:
-                    for line in f:
-                        contents += line.decode('utf-8')
-
-            generation_summary = "Generation " + str(self._generation) + " || " + "average metric: " + str(new_gen_avg) \
-                                 + ", best metric: " + str(new_gen_best) + ", best parameter combination: " + str(new_gen_best_param) + "\n"
-
-            print(generation_summary)
-
-            fd.write((contents + generation_summary + "\n").encode())
-
-            fd.flush()
-            fd.close()
-
-        parsed_trial_population = []
-        for index, trial_vec in enumerate(trial_population):
-            parsed_trial_vec = self._parse_back(trial_vec)
-            parsed_trial_population.append(parsed_trial_vec)
-
-        parsed_trial_population =  self._parse_to_dict(parsed_trial_population)
-        trial_population_scores = self.objective_function(parsed_trial_population, name=self.name)
-
-        for i in range(self.n):
-            trial_vec_score_i = trial_population_scores[i]
-            target_vec_score_i = self._scores[i]
-            if self.direction == 'max':
-                if trial_vec_score_i > target_vec_score_i:
-                    self._scores[i] = trial_vec_score_i
-                    population[i] = trial_population[i]
-            elif self.direction == 'min':
-                if trial_vec_score_i < target_vec_score_i:
-                    self._scores[i] = trial_vec_score_i
-                    population[i] = trial_population[i]
+        Returns:
+            the trial vector
+        """
+        r = np.random.permutation(candidates[candidates != target])[:3]
+        current = population[target:target+1]
+        return self._recombination(current, self._donors(population, current, r[np.newaxis]))[0]
 
-        self._generation += 1
+    def _evaluate(self, population):
+        """
+        Runs the objective function on every individual
+
+        Args:
+            :population: matrix of individuals
+
+        Returns:
+            array of scores
+        """
+        parsed_population = self._parse_to_dict([self._parse_back(indiv) for indiv in population])
+        return np.array(self.objective_function(parsed_population, name=self.name), dtype=float)
 
-        return population
     # parse the converted values back to original
     def _parse_back(self, individual):
         """
@@ -490,10 +477,11 @@ class DifferentialEvolution:
         original_representation = []
         for index, parameter in enumerate(individual):
             if self.types[index] == self._types[2]:
-                original_representation.append(self.parbounds[index][parameter])
+                original_representation.append(self.parbounds[index][int(parameter)])
+            elif self.types[index] == self._types[1]:
+                original_representation.append(int(parameter))
             else:
-
-                original_representation.append(parameter)
+                original_representation.append(float(parameter))
 
         return original_representation
 
@@ -525,7 +513,192 @@ class DifferentialEvolution:
     def get_dict(self):
         return self._ordered_population_dict
 
-def _search(spark, function, search_dict, direction = 'max', generations=10, popsize=10, mutation=0.5, crossover=0.7, cleanup_generations=False, local_logdir=False, name="no-name"):
+
+def _benchmark(popsizes=(10, 100, 500, 1000), dimensions=10, generations=20, strategies=None):
+    """
+    Measures the time the optimizer spends per generation for different population sizes, without Spark or HDFS.
+    The objective is the sphere function evaluated locally, so the timings are the overhead of the optimizer itself.
+
+    Args:
+        :popsizes: population sizes to measure
+        :dimensions: number of float parameters
+        :generations: number of generations to run for every population size
+        :strategies: strategies to measure, all of them if None
+
+    Returns:
+        dict of (strategy, popsize) to seconds per generation
+    """
+    if strategies is None:
+        strategies = DifferentialEvolution._strategies
+
+    param_names = ['x' + str(i) for i in range(dimensions)]
+
+    def sphere(population_dict, name="no-name"):
+        population = np.array([population_dict[param] for param in param_names], dtype=float)
+        return list(np.sum(population ** 2, axis=0))
+
+    timings = {}
+    for strategy in strategies:
+        for popsize in popsizes:
+            de = DifferentialEvolution(sphere,
+                                       [(-5.0, 5.0)] * dimensions,
+                                       ['float'] * dimensions,
+                                       OrderedDict((param, []) for param in param_names),
+                                       direction='min',
+                                       popsize=popsize,
+                                       strategy=strategy)
+            population = de._population_initialisation()
+            start = time.time()
+            for _ in range(generations):
+                population = de._step(population)
+            timings[(strategy, popsize)] = (time.time() - start) / generations
+            print(strategy + " || population " + str(popsize) + ": " + str(round(timings[(strategy, popsize)] * 1000, 3)) +
+                  " ms per generation, best metric: " + str(de._best(population)[1]))
+    return timings
+
+class _SteadyStateServer(trial_scheduler.Server):
+    """
+    Trial server of steady state differential evolution. Creates a trial vector whenever an executor asks for a
+    trial, and applies selection to its target individual as soon as the metric of the trial vector is reported.
+    """
+
+    def __init__(self, diff_evo, population, root_dir, store=None):
+        """
+        Args:
+            :diff_evo: the DifferentialEvolution
+            :population: matrix of individuals, all of them are evaluated first
+            :root_dir: directory of the run
+            :store: the TrialStore to look up previously evaluated combinations in
+        """
+        super(_SteadyStateServer, self).__init__([], trial_scheduler.FIFOScheduler(), secret=codec.new_secret())
+        self.diff_evo = diff_evo
+        self.population = population
+        self.root_dir = root_dir
+        self.budget = diff_evo.n * (diff_evo.generations + 1)
+        self.dispatched = 0
+        self.completed = 0
+        self.cleaned = 0
+        self.running = {}
+        self.evaluated = {}
+        self.trials = []
+        self.store = store
+        self._target = 0
+        if store is not None:
+            self.function_key = trial_store._function_key(objective_function)
+
+    def _next_trial(self):
+        """
+        Creates the next trial vector, combinations that were evaluated before are selected on right away
+
+        Returns:
+            the trial, WAIT if fewer than four individuals are evaluated, or None when all evaluations were handed out
+        """
+        de = self.diff_evo
+        while self.dispatched < self.budget:
+            generation = self.dispatched // de.n
+            if self.dispatched < de.n:
+                target = self.dispatched
+                vector = self.population[target]
+            else:
+                candidates = np.flatnonzero(~np.isnan(de._scores))
+                if len(candidates) < 4:
+                    # with nothing running, too many trials of the initial population failed to ever mutate
+                    if len(self.running) == 0:
+                        print('Fewer than four individuals of the population could be evaluated, stopping the search')
+                        return None
+                    return trial_scheduler.WAIT
+                target = candidates[self._target % len(candidates)]
+                self._target += 1
+                vector = de._trial_vector(self.population, target, candidates)
+
+            args = de._parse_back(vector)
+            param_string = '.'.join([name + '=' + str(val) for name, val in zip(de._param_names, args)])
+            trial_id = self.dispatched
+            self.dispatched += 1
+            self.running[trial_id] = (target, vector, generation, param_string)
+
+            if param_string not in self.evaluated and self.store is not None:
+                key = trial_store._trial_key(self.function_key, de._param_names, args, store_dataset_version)[0]
+                stored = self.store.get_many([key])
+                if key in stored:
+                    print('Reusing the stored metric of ' + param_string)
+                    self.evaluated[param_string] = stored[key]
+
+            if param_string in self.evaluated:
+                self._select(trial_id, self.evaluated[param_string])
+                continue
+
+            self.trials.append(args)
+
+            return {'id': trial_id, 'args': args, 'param_string': param_string,
+                    'sub_type': 'generation.' + str(generation), 'name': 'generation.' + str(generation) + '/' + param_string}
+        return None
+
+    def _on_trial_complete(self, result):
+        """
+
+        Args:
+            :result: dict with the 'id' and 'metric' of the trial
+        """
+        self._select(result['id'], result['metric'])
+
+    def _select(self, trial_id, metric):
+        """
+        Replaces the target individual of a trial vector if the trial vector is better
+
+        Args:
+            :trial_id: id of the trial
+            :metric: metric of the trial vector
+        """
+        de = self.diff_evo
+        target, vector, generation, param_string = self.running.pop(trial_id)
+        if not np.isnan(metric):
+            self.evaluated[param_string] = metric
+
+        score = de._scores[target]
+        if np.isnan(score) or (de.direction == 'max' and metric > score) or (de.direction == 'min' and metric < score):
+            self.population[target] = vector
+            de._scores[target] = metric
+
+        self.completed += 1
+        if self.completed % de.n == 0:
+            de._generation = self.completed // de.n - 1
+            de._on_generation(self.population)
+            if cleanup:
+                self._cleanup_generations()
+
+    def _cleanup_generations(self):
+        """
+        Removes the directories of previous generations that have no running trials left
+        """
+        running_generations = set(generation for _, _, generation, _ in self.running.values())
+        while self.cleaned < self.diff_evo._generation and self.cleaned not in running_generations:
+            try:
+                pydoop.hdfs.rmr(self.root_dir + '/generation.' + str(self.cleaned))
+            except IOError:
+                # all combinations of the generation were evaluated before, nothing was logged
+                pass
+            self.cleaned += 1
+
+
+def _steady_state_launch(spark_session, map_fun, server, name="no-name"):
+    """ Run the wrapper function on every executor, pulling trial vectors from the steady state server
+
+    Args:
+        :spark_session: SparkSession object
+        :map_fun: The TensorFlow function to run
+        :server: the _SteadyStateServer
+        :name: name of the experiment
+    """
+    sc = spark_session.sparkContext
+    app_id = str(sc.applicationId)
+
+    #Make SparkUI intuitive by grouping jobs
+    sc.setJobGroup("Differential Evolution ", "{} | Hyperparameter Optimization, steady state".format(name))
+    trial_scheduler._run(sc, server, map_fun, server.budget, app_id, run_id, 'differential_evolution', local_logdir=local_logdir_bool, retries=trial_retries)
+
+
+def _search(spark, function, search_dict, direction = 'max', generations=10, popsize=10, mutation=0.5, crossover=0.7, cleanup_generations=False, local_logdir=False, name="no-name", strategy='rand/1/bin', asynchronous=False, dataset_version=None, trials_per_task=1, retries=0):
     """
 
     Args:
@@ -540,6 +713,11 @@ def _search(spark, function, search_dict, direction = 'max', generations=10, pop
         :cleanup_generations:
         :local_logdir:
         :name:
+        :strategy:
+        :asynchronous:
+        :dataset_version:
+        :trials_per_task:
+        :retries:
 
     Returns:
 
@@ -558,6 +736,18 @@ def _search(spark, function, search_dict, direction = 'max', generations=10, pop
     global cleanup
     cleanup = cleanup_generations
 
+    global evaluated
+    evaluated = {}
+
+    global store_dataset_version
+    store_dataset_version = dataset_version
+
+    global packed_trials
+    packed_trials = trials_per_task
+
+    global trial_retries
+    trial_retries = retries
+
     argcount = six.get_function_code(function).co_argcount
     arg_names = six.get_function_code(function).co_varnames
 
@@ -602,11 +792,23 @@ def _search(spark, function, search_dict, direction = 'max', generations=10, pop
                                      popsize=popsize,
                                      crossover=crossover,
                                      mutation=mutation,
-                                     name=name)
+                                     name=name,
+                                     strategy=strategy)
 
     root_dir = hopshdfs._get_experiments_dir() + "/" + str(app_id) + "/differential_evolution/run." + str(run_id)
 
-    best_param, best_metric = diff_evo._solve(root_dir)
+    global metric_server_addr
+    global metric_server_secret
+    if asynchronous:
+        best_param, best_metric = diff_evo._solve_steady_state(root_dir)
+    else:
+        # executors get the secret along with the server address in the closure of the task
+        metric_server_secret = codec.new_secret()
+        metric_server, metric_server_addr = hopsmetrics._start(secret=metric_server_secret)
+        try:
+            best_param, best_metric = diff_evo._solve(root_dir)
+        finally:
+            metric_server.stop()
 
     print('Finished Experiment \n')
 
@@ -632,33 +834,41 @@ def _evolutionary_launch(spark_session, map_fun, args_dict, name="no-name"):
         :spark_session: SparkSession object
         :map_fun: The TensorFlow function to run
         :args_dict: (optional) A dictionary containing hyperparameter values to insert as arguments for each TensorFlow job
+
+    Returns:
+        dict of param_string to the metric returned for it
     """
 
     sc = spark_session.sparkContext
     app_id = str(sc.applicationId)
 
 
-    arg_lists = list(args_dict.values())
-    num_executions = len(arg_lists[0])
-
-    #Each TF task should be run on 1 executor
-    nodeRDD = sc.parallelize(range(num_executions), num_executions)
-
-    #Force execution on executor, since GPU is located on executor
     global generation_id
     global run_id
 
+    def _run(args_dict):
+        num_executions = len(list(args_dict.values())[0])
+
+        #Each TF task should be run on 1 executor, running trials_per_task trials after each other
+        num_tasks = int(math.ceil(num_executions / float(packed_trials)))
+        nodeRDD = sc.parallelize(range(num_executions), num_tasks)
+
+        #Force execution on executor, since GPU is located on executor
+        return nodeRDD.mapPartitions(_prepare_func(app_id, generation_id, map_fun, args_dict, run_id, metric_server_addr, dict(evaluated), trial_retries, metric_server_secret)).collect()
+
     #Make SparkUI intuitive by grouping jobs
     sc.setJobGroup("Differential Evolution ", "{} | Hyperparameter Optimization, generation: {}".format(name, generation_id))
-    nodeRDD.foreachPartition(_prepare_func(app_id, generation_id, map_fun, args_dict, run_id))
+    results = dict(trial_store._memoize(map_fun, args_dict, _run, dataset_version=store_dataset_version))
+    # failed trials are run again if the combination comes up in a later generation
+    evaluated.update((param_string, metric) for param_string, metric in results.items() if not np.isnan(metric))
 
     generation_id += 1
 
-    return hopshdfs._get_experiments_dir() + '/' + app_id + "/"
+    return results
 
 
 #Helper to put Spark required parameter iter in function signature
-def _prepare_func(app_id, generation_id, map_fun, args_dict, run_id):
+def _prepare_func(app_id, generation_id, map_fun, args_dict, run_id, metric_server_addr, evaluated, retries, secret=None):
     """
 
     Args:
@@ -667,6 +877,10 @@ def _prepare_func(app_id, generation_id, map_fun, args_dict, run_id):
         :map_fun:
         :args_dict:
         :run_id:
+        :metric_server_addr:
+        :evaluated: dict of param_string to metric of the combinations evaluated in previous generations
+        :retries: number of times a trial is run again after it raised
+        :secret: the secret the metric server was started with
 
     Returns:
 
@@ -679,137 +893,23 @@ def _prepare_func(app_id, generation_id, map_fun, args_dict, run_id):
             :iter:
 
         Returns:
-
+            list with the parameter string and metric of the individual
         """
 
-        for i in iter:
-            executor_num = i
-
-        tb_pid = 0
-        tb_hdfs_path = ''
-        hdfs_exec_logdir = ''
-
-        t = threading.Thread(target=devices._print_periodic_gpu_utilization)
-        if devices.get_num_gpus() > 0:
-            t.start()
+        trials = list(iter)
+        if not trials:
+            return []
 
         global local_logdir_bool
 
-        try:
+        with runtime.Task(app_id, run_id, 'differential_evolution', trials[0], local_logdir=local_logdir_bool) as task:
+            results = []
             #Arguments
             if args_dict:
-                argcount = six.get_function_code(map_fun).co_argcount
-                names = six.get_function_code(map_fun).co_varnames
-
-                args = []
-                argIndex = 0
-                param_string = ''
-                while argcount > 0:
-                    #Get args for executor and run function
-                    param_name = names[argIndex]
-                    param_val = args_dict[param_name][executor_num]
-                    param_string += str(param_name) + '=' + str(param_val) + '.'
-                    args.append(param_val)
-                    argcount -= 1
-                    argIndex += 1
-                param_string = param_string[:-1]
-
-                val = _get_metric(param_string, app_id, generation_id, run_id)
-                hdfs_exec_logdir, hdfs_appid_logdir = hopshdfs._create_directories(app_id, run_id, param_string, 'differential_evolution', sub_type='generation.' + str(generation_id))
-                pydoop.hdfs.dump('', os.environ['EXEC_LOGFILE'], user=hopshdfs.project_user())
-                hopshdfs._init_logger()
-                tb_hdfs_path, tb_pid = tensorboard._register(hdfs_exec_logdir, hdfs_appid_logdir, executor_num, local_logdir=local_logdir_bool)
-                gpu_str = '\nChecking for GPUs in the environment' + devices._get_gpu_info()
-                hopshdfs.log(gpu_str)
-                print(gpu_str)
-                print('-------------------------------------------------------')
-                print('Started running task ' + param_string + '\n')
-                if val:
-                    print('Reading returned metric from previous run: ' + str(val))
-                hopshdfs.log('Started running task ' + param_string)
-                task_start = datetime.datetime.now()
-                if not val:
-                    val = map_fun(*args)
-                task_end = datetime.datetime.now()
-                time_str = 'Finished task ' + param_string + ' - took ' + util._time_diff(task_start, task_end)
-                print('\n' + time_str)
-                hopshdfs.log(time_str)
-                try:
-                    castval = int(val)
-                except:
-                   raise ValueError('Your function needs to return a metric (number) which should be maximized or minimized')
-
-
-                metric_file = hdfs_exec_logdir + '/metric'
-                fs_handle = hopshdfs.get_fs()
-                try:
-                    fd = fs_handle.open_file(metric_file, mode='w')
-                except:
-                    fd = fs_handle.open_file(metric_file, flags='w')
-
-                fd.write(str(float(val)).encode())
-                fd.flush()
-                fd.close()
-                print('Returning metric ' + str(val))
-                print('-------------------------------------------------------')
-        except:
-            #Always do cleanup
-            if tb_hdfs_path:
-                _cleanup(tb_hdfs_path)
-            if devices.get_num_gpus() > 0:
-                t.do_run = False
-                t.join()
-            raise
-        finally:
-            if local_logdir_bool:
-                local_tb = tensorboard.local_logdir_path
-                util._store_local_tensorboard(local_tb, hdfs_exec_logdir)
-
-        hopshdfs.log('Finished running')
-        if tb_hdfs_path:
-            _cleanup(tb_hdfs_path)
-        if devices.get_num_gpus() > 0:
-            t.do_run = False
-            t.join()
+                results = runtime._run_trials(task, map_fun, args_dict, trials, metric_server_addr, retries,
+                                              sub_type='generation.' + str(generation_id), evaluated=evaluated,
+                                              secret=secret)
+            task.log('Finished running')
+            return results
 
     return _wrapper_fun
-
-def _get_metric(param_string, app_id, generation_id, run_id):
-    """
-
-    Args:
-        :param_string:
-        :app_id:
-        :generation_id:
-        :run_id:
-
-    Returns:
-
-    """
-    project_path = hopshdfs.project_path()
-    handle = hopshdfs.get()
-    for i in range(generation_id):
-        possible_result_path = hopshdfs._get_experiments_dir() + '/' + app_id + '/differential_evolution/run.' \
-                               + str(run_id) + '/generation.' + str(i) + '/' + param_string + '/metric'
-        if handle.exists(possible_result_path):
-            with pydoop.hdfs.open(possible_result_path, "r") as fi:
-                metric = float(fi.read())
-                fi.close()
-                return metric
-
-    return None
-
-
-def _cleanup(tb_hdfs_path):
-    """
-
-    Args:
-        :tb_hdfs_path:
-
-    Returns:
-
-    """
-    handle = hopshdfs.get()
-    if not tb_hdfs_path == None and not tb_hdfs_path == '' and handle.exists(tb_hdfs_path):
-        handle.delete(tb_hdfs_path)
-    hopshdfs._kill_logger()
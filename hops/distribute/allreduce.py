@@ -6,21 +6,20 @@ These utils facilitates development by hiding complexity for programs interactin
 
 import os
 from hops import hdfs as hopshdfs
-from hops import tensorboard
-from hops import devices
+from hops import metrics as hopsmetrics
+from hops import runtime
 from hops import util
 
 import pydoop.hdfs
-import threading
-import datetime
-import socket
 import json
 
 from . import allreduce_reservation
+from . import codec
 
 run_id = 0
 
-def _launch(sc, map_fun, local_logdir=False, name="no-name"):
+def _launch(sc, map_fun, local_logdir=False, name="no-name", elastic=False, heartbeat_timeout=allreduce_reservation.HEARTBEAT_TIMEOUT,
+            abort_grace=allreduce_reservation.ABORT_GRACE):
     """
 
     Args:
@@ -28,6 +27,9 @@ def _launch(sc, map_fun, local_logdir=False, name="no-name"):
         map_fun:
         local_logdir:
         name:
+        elastic:
+        heartbeat_timeout:
+        abort_grace: seconds an aborted task has to return before its python worker exits, None to never exit
 
     Returns:
 
@@ -43,11 +45,21 @@ def _launch(sc, map_fun, local_logdir=False, name="no-name"):
     #Make SparkUI intuitive by grouping jobs
     sc.setJobGroup("CollectiveAllReduceStrategy", "{} | Distributed Training".format(name))
 
-    server = allreduce_reservation.Server(num_executions)
+    # executors get the secret along with the server address in the closure of the task
+    secret = codec.new_secret()
+    # a failed cluster cancels the job right away instead of leaving the other executors blocked
+    server = allreduce_reservation.Server(num_executions, secret=secret, heartbeat_timeout=heartbeat_timeout, elastic=elastic,
+                                          on_failure=lambda reason: sc.cancelJobGroup("CollectiveAllReduceStrategy"))
     server_addr = server.start()
 
     #Force execution on executor, since GPU is located on executor
-    nodeRDD.foreachPartition(_prepare_func(app_id, run_id, map_fun, local_logdir, server_addr))
+    metric_server, metric_server_addr = hopsmetrics._start(secret=secret)
+    try:
+        nodeRDD.foreachPartition(_prepare_func(app_id, run_id, map_fun, local_logdir, server_addr, metric_server_addr, secret,
+                                               abort_grace=abort_grace))
+    finally:
+        metric_server.stop()
+        server.stop()
 
     logdir = _get_logdir(app_id)
 
@@ -74,7 +86,8 @@ def _get_logdir(app_id):
     global run_id
     return hopshdfs._get_experiments_dir() + '/' + app_id + '/collective_all_reduce/run.' + str(run_id)
 
-def _prepare_func(app_id, run_id, map_fun, local_logdir, server_addr):
+def _prepare_func(app_id, run_id, map_fun, local_logdir, server_addr, metric_server_addr, secret,
+                  abort_grace=allreduce_reservation.ABORT_GRACE):
     """
 
     Args:
@@ -83,6 +96,9 @@ def _prepare_func(app_id, run_id, map_fun, local_logdir, server_addr):
         map_fun:
         local_logdir:
         server_addr:
+        metric_server_addr:
+        secret:
+        abort_grace:
 
     Returns:
 
@@ -100,120 +116,54 @@ def _prepare_func(app_id, run_id, map_fun, local_logdir, server_addr):
         for i in iter:
             executor_num = i
 
-        tb_hdfs_path = ''
-        hdfs_exec_logdir = ''
-
-        t = threading.Thread(target=devices._print_periodic_gpu_utilization)
-        if devices.get_num_gpus() > 0:
-            t.start()
-
-        task_index = None
-
-        try:
-            host = util._get_ip_address()
-
-            tmp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            tmp_socket.bind(('', 0))
-            port = tmp_socket.getsockname()[1]
-
-            client = allreduce_reservation.Client(server_addr)
-            host_port = host + ":" + str(port)
-
-            client.register({"worker": host_port, "index": executor_num})
-            cluster = client.await_reservations()
-            tmp_socket.close()
-            client.close()
-
-            task_index = _find_index(host_port, cluster)
-
-            cluster["task"] = {"type": "worker", "index": task_index}
-
-            os.environ["TF_CONFIG"] = json.dumps(cluster)
-
-            if task_index == 0:
-                hdfs_exec_logdir, hdfs_appid_logdir = hopshdfs._create_directories(app_id, run_id, None, 'collective_all_reduce')
-                pydoop.hdfs.dump('', os.environ['EXEC_LOGFILE'], user=hopshdfs.project_user())
-                hopshdfs._init_logger()
-                tb_hdfs_path, tb_pid = tensorboard._register(hdfs_exec_logdir, hdfs_appid_logdir, executor_num, local_logdir=local_logdir)
-            gpu_str = '\nChecking for GPUs in the environment' + devices._get_gpu_info()
-            if task_index == 0:
-                hopshdfs.log(gpu_str)
-            print(gpu_str)
-            print('-------------------------------------------------------')
-            print('Started running task \n')
-            if task_index == 0:
-                hopshdfs.log('Started running task')
-            task_start = datetime.datetime.now()
-
-            retval = map_fun()
-            if task_index == 0:
-                if retval:
-                    _handle_return(retval, hdfs_exec_logdir)
-            task_end = datetime.datetime.now()
-            time_str = 'Finished task - took ' + util._time_diff(task_start, task_end)
-            print('\n' + time_str)
-            print('-------------------------------------------------------')
-            if task_index == 0:
-                hopshdfs.log(time_str)
-        except:
-            #Always do cleanup
-            _cleanup(tb_hdfs_path)
-            if devices.get_num_gpus() > 0:
-                t.do_run = False
-                t.join()
-            raise
-        finally:
-            if task_index == 0:
-                if local_logdir:
-                    local_tb = tensorboard.local_logdir_path
-                    util._store_local_tensorboard(local_tb, hdfs_exec_logdir)
-
-
-        _cleanup(tb_hdfs_path)
-        if devices.get_num_gpus() > 0:
-            t.do_run = False
-            t.join()
+        heartbeat = None
+        tmp_socket = None
 
-    return _wrapper_fun
+        with runtime.Task(app_id, run_id, 'collective_all_reduce', executor_num, local_logdir=local_logdir) as task:
+            try:
+                host = util._get_ip_address()
 
-def _cleanup(tb_hdfs_path):
-    """
+                # the port stays reserved until the task ends, TensorFlow binds it with SO_REUSEPORT
+                tmp_socket, port = util._reserve_port()
 
-    Args:
-        tb_hdfs_path:
+                client = allreduce_reservation.Client(server_addr, secret=secret)
+                host_port = host + ":" + str(port)
 
-    Returns:
+                # the heartbeat aborts this task when another executor fails
+                heartbeat = allreduce_reservation.Heartbeat(server_addr, host_port, secret=secret, abort_grace=abort_grace,
+                                                            before_exit=lambda: task.close(failed=True))
+                epoch = heartbeat.start()
 
-    """
-    handle = hopshdfs.get()
-    if not tb_hdfs_path == None and not tb_hdfs_path == '' and handle.exists(tb_hdfs_path):
-        handle.delete(tb_hdfs_path)
-    hopshdfs._kill_logger()
+                client.register({"worker": host_port, "index": executor_num})
+                cluster = client.await_reservations()
+                util._hand_off_port(tmp_socket)
+                client.close()
 
-def _handle_return(val, hdfs_exec_logdir):
-    """
+                task_index = _find_index(host_port, cluster)
 
-    Args:
-        val:
-        hdfs_exec_logdir:
+                cluster["task"] = {"type": "worker", "index": task_index}
 
-    Returns:
+                os.environ["TF_CONFIG"] = json.dumps(cluster)
 
-    """
-    try:
-        test = int(val)
-    except:
-        raise ValueError('Your function needs to return a metric (number) which should be maximized or minimized')
+                if task_index == 0:
+                    # a cluster re-formed after a failure resumes from the checkpoints in the logdir
+                    task.setup(keep=epoch > 0)
+                hopsmetrics._connect(metric_server_addr, executor_num, 'worker' + str(task_index), secret=secret)
 
-    metric_file = hdfs_exec_logdir + '/metric'
-    fs_handle = hopshdfs.get_fs()
-    try:
-        fd = fs_handle.open_file(metric_file, mode='w')
-    except:
-        fd = fs_handle.open_file(metric_file, flags='w')
-    fd.write(str(float(val)).encode())
-    fd.flush()
-    fd.close()
+                retval = task.run(map_fun)
+                if task_index == 0 and retval:
+                    task.handle_return(retval)
+            except:
+                if heartbeat is not None:
+                    heartbeat.stop(failed=True)
+                raise
+            finally:
+                if tmp_socket is not None:
+                    tmp_socket.close()
+
+            heartbeat.stop()
+
+    return _wrapper_fun
 
 def _find_index(host_port, cluster_spec):
     """
@@ -4,17 +4,31 @@ from __future__ import nested_scopes
 from __future__ import print_function
 
 import logging
-import pickle
-import select
+import os
 import socket
-import struct
 import threading
 import time
 
+from six.moves import _thread
+
+try:
+  import selectors
+except ImportError:
+  # backport of the python 3 selectors module
+  import selectors34 as selectors
+
 from hops import util
+from . import codec
+from . import placement
 
 MAX_RETRIES = 3
-BUFSIZE = 1024*2
+
+# seconds between the heartbeats of an executor
+HEARTBEAT_INTERVAL = 1
+# seconds without a heartbeat after which the server declares an executor failed
+HEARTBEAT_TIMEOUT = 10
+# seconds an aborted task gets to return to python before its worker process exits
+ABORT_GRACE = 10
 
 class Reservations:
   """
@@ -25,7 +39,9 @@ class Reservations:
     self.required = required
     self.lock = threading.RLock()
     self.reservations = {"cluster": {"worker": [None] * required}}
+    self.metas = [None] * required
     self.check_done = False
+    self.event = threading.Event()
 
   def add(self, meta):
     """
@@ -36,16 +52,30 @@ class Reservations:
     """
     with self.lock:
       self.reservations["cluster"]["worker"][meta["index"]] = meta["worker"]
+      self.metas[meta["index"]] = {"host_port": meta["worker"], "rack": meta.get("rack")}
       if self.remaining() == 0:
-        #Sort the cluster_spec based on ip so adjacent workers end up on same machine
-        self.reservations["cluster"]["worker"].sort(key=lambda x:str(x.split(':')[0]))
+        # adjacent workers of the ring end up on the same machine and rack
+        self.reservations["cluster"]["worker"] = placement.ring_order(self.metas)
         self.check_done = True
+        self.event.set()
 
   def done(self):
     """Returns True if the ``required`` number of reservations have been fulfilled."""
     with self.lock:
       return self.check_done
 
+  def wait(self, timeout=None):
+    """
+    Block until the ``required`` number of reservations have been fulfilled.
+
+    Args:
+        :timeout: seconds to wait at most
+
+    Returns:
+        True if the reservations are done, False on timeout
+    """
+    return self.event.wait(timeout)
+
   def get(self):
     """Get the list of current reservations."""
     with self.lock:
@@ -61,8 +91,175 @@ class Reservations:
           num_registered = num_registered + 1
       return self.required - num_registered
 
+class Members:
+  """
+  Thread-safe store of the executors sending heartbeats, the failure detector of the Server.
+  """
+
+  def __init__(self, timeout):
+    """
+
+    Args:
+        :timeout: seconds without a heartbeat after which an executor is failed
+    """
+    self.timeout = timeout
+    self.lock = threading.RLock()
+    self.last_seen = {}
+    self.left = 0
+
+  def beat(self, member_id):
+    """
+    Record a heartbeat.
+
+    Args:
+        :member_id: the 'host:port' of the executor
+    """
+    with self.lock:
+      self.last_seen[member_id] = time.time()
+
+  def leave(self, member_id):
+    """
+    Stop monitoring an executor that finished its task.
+
+    Args:
+        :member_id: the 'host:port' of the executor
+    """
+    with self.lock:
+      if self.last_seen.pop(member_id, None) is not None:
+        self.left += 1
+
+  def remove(self, member_id):
+    """
+    Stop monitoring an executor whose task failed.
+
+    Args:
+        :member_id: the 'host:port' of the executor
+    """
+    with self.lock:
+      self.last_seen.pop(member_id, None)
+
+  def expired(self):
+    """
+    Remove the executors that missed their heartbeats.
+
+    Returns:
+        list of the ids of the removed executors
+    """
+    with self.lock:
+      now = time.time()
+      failed = [member_id for member_id, seen in self.last_seen.items() if now - seen > self.timeout]
+      for member_id in failed:
+        del self.last_seen[member_id]
+      return failed
+
+  def clear(self):
+    """Forget all executors, they belong to an old epoch."""
+    with self.lock:
+      self.last_seen = {}
+
+
+def _checked(resp):
+  """
+  Raise the error the server answered a request with.
+
+  Args:
+      :resp: the answer of the server
+
+  Returns:
+      the answer
+  """
+  if isinstance(resp, dict) and 'error' in resp:
+    raise Exception(resp['error'])
+  return resp
+
+
+def _fail(server, failed):
+  """
+  Handle the failure of executors. An elastic server that no executor left yet starts a new epoch and waits for the
+  surviving and replacement executors to register again, otherwise the cluster is failed for good. Clients blocked on a
+  barrier get the error either way.
+
+  Args:
+      :server: the Server
+      :failed: list of the ids of the failed executors
+  """
+  reason = 'executors ' + ', '.join(sorted(failed)) + ' failed'
+  barriers = server._barriers()
+  if server.elastic and server.members.left == 0:
+    server.epoch += 1
+    reason = reason + ', re-forming the cluster in epoch ' + str(server.epoch)
+    server._reset()
+  else:
+    server.failed.extend(failed)
+  print(reason)
+  for waiting in barriers:
+    server._release(waiting, {'error': reason})
+  if server.on_failure is not None and server.failed:
+    server.on_failure(reason)
+
+
+def _check_members(server):
+  """
+  Fail the executors that missed their heartbeats, called by the listener about once a second.
+
+  Args:
+      :server: the Server
+  """
+  if server.members is None or server.failed:
+    return
+  failed = server.members.expired()
+  if failed:
+    _fail(server, failed)
+
+
+def _on_membership(server, sock, msg):
+  """
+  Handle HEARTBEAT and LEAVE. Messages of an old epoch are answered but not recorded, their executors are aborting.
+
+  Args:
+      :server: the Server
+      :sock: the client socket
+      :msg: the message, its data has the 'id' and the 'epoch' of the executor, None for the first heartbeat
+  """
+  data = msg['data']
+  current = data.get('epoch') in (None, server.epoch)
+  if current and not server.failed:
+    if msg['type'] == 'HEARTBEAT':
+      server.members.beat(data['id'])
+    elif data.get('failed'):
+      # the task failed, no need to wait for the heartbeat timeout
+      server.members.remove(data['id'])
+      _fail(server, [data['id']])
+    else:
+      server.members.leave(data['id'])
+  MessageSocket.send(server, sock, {'epoch': server.epoch, 'failed': server.failed})
+
+
+def _recv_exact(sock, length):
+  """
+  Receive exactly ``length`` bytes from a blocking socket into a preallocated buffer.
+
+  Args:
+      :sock: the socket
+      :length: number of bytes
+
+  Returns:
+      bytearray with the bytes
+  """
+  buf = bytearray(length)
+  view = memoryview(buf)
+  received = 0
+  while received < length:
+    n = sock.recv_into(view[received:], length - received)
+    if n == 0:
+      raise Exception("socket closed")
+    received += n
+  return buf
+
+
 class MessageSocket(object):
   """Abstract class w/ length-prefixed socket send/receive functions."""
+  codec = codec.Codec()         #: encodes the messages, see the codec module
 
   def receive(self, sock):
     """
@@ -73,25 +270,10 @@ class MessageSocket(object):
     Returns:
 
     """
-    msg = None
-    data = b''
-    recv_done = False
-    recv_len = -1
-    while not recv_done:
-      buf = sock.recv(BUFSIZE)
-      if buf is None or len(buf) == 0:
-        raise Exception("socket closed")
-      if recv_len == -1:
-        recv_len = struct.unpack('>I', buf[:4])[0]
-        data += buf[4:]
-        recv_len -= len(data)
-      else:
-        data += buf
-        recv_len -= len(buf)
-      recv_done = (recv_len == 0)
-
-    msg = pickle.loads(data)
-    return msg
+    length = codec.HEADER.unpack_from(_recv_exact(sock, codec.HEADER.size))[0]
+    if length > codec.MAX_SIZE:
+      raise Exception("message of {0} bytes is too large".format(length))
+    return self.codec.decode(_recv_exact(sock, length))
 
   def send(self, sock, msg):
     """
@@ -103,19 +285,150 @@ class MessageSocket(object):
     Returns:
 
     """
-    data = pickle.dumps(msg)
-    buf = struct.pack('>I', len(data)) + data
-    sock.sendall(buf)
+    sock.sendall(self.codec.frame(msg))
+
+
+class _Connection(object):
+  """
+  Framing state of a client connection of the server, reads a message in as many steps as the client sends it.
+  """
+
+  def __init__(self, sock, msg_codec):
+    """
+    Args:
+        :sock: the client socket
+        :msg_codec: the Codec of the server
+    """
+    self.sock = sock
+    self.codec = msg_codec
+    self.header = bytearray(codec.HEADER.size)
+    self.body = None
+    self.received = 0
+
+  def read(self):
+    """
+    Read what the socket has available, never more than the rest of the current message, so it does not block after
+    the selector reported the socket readable.
+
+    Returns:
+        the message if it is complete, otherwise None
+    """
+    buf = self.header if self.body is None else self.body
+    n = self.sock.recv_into(memoryview(buf)[self.received:], len(buf) - self.received)
+    if n == 0:
+      raise Exception("socket closed")
+    self.received += n
+    if self.received < len(buf):
+      return None
+
+    self.received = 0
+    if self.body is None:
+      length = codec.HEADER.unpack_from(self.header)[0]
+      if length > codec.MAX_SIZE:
+        raise Exception("message of {0} bytes is too large".format(length))
+      self.body = bytearray(length)
+      if length > 0:
+        return None
+    body, self.body = self.body, None
+    msg = self.codec.decode(body)
+    if not isinstance(msg, dict) or 'type' not in msg:
+      raise Exception("malformed request")
+    return msg
+
+
+def _listen(server, server_sock):
+  """
+  Serve the connections of ``server`` until it is done, with one framing state per connection.
+
+  Args:
+      :server: the Server handling the messages
+      :server_sock: the listening socket
+  """
+  sel = selectors.DefaultSelector()
+  sel.register(server_sock, selectors.EVENT_READ, None)
+  last_check = time.time()
+  try:
+    while not server.done:
+      if time.time() - last_check >= 1:
+        last_check = time.time()
+        _check_members(server)
+      for key, _ in sel.select(timeout=1):
+        if key.data is None:
+          client_sock, client_addr = server_sock.accept()
+          client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+          sel.register(client_sock, selectors.EVENT_READ, _Connection(client_sock, server.codec))
+          logging.debug("client connected from {0}".format(client_addr))
+          continue
+        conn = key.data
+        try:
+          msg = conn.read()
+          if msg is not None:
+            server._handle_message(conn.sock, msg)
+        except Exception as e:
+          logging.debug(e)
+          sel.unregister(conn.sock)
+          conn.sock.close()
+  finally:
+    sel.close()
+    server_sock.close()
 
 
 class Server(MessageSocket):
-  """Simple socket server with length prefixed pickle messages"""
+  """Simple socket server with length prefixed messages, see the codec module"""
   reservations = None
+  members = None
   done = False
 
-  def __init__(self, count):
+  def __init__(self, count, secret=None, heartbeat_timeout=HEARTBEAT_TIMEOUT, elastic=False, on_failure=None):
+    """
+
+    Args:
+        :count: expected number of nodes in the cluster.
+        :secret: secret of the application from codec.new_secret, clients without it are rejected
+        :heartbeat_timeout: seconds without a heartbeat after which an executor is failed
+        :elastic: True to re-form the cluster after a failure instead of failing it
+        :on_failure: function called with the reason when the cluster failed for good
+    """
     assert count > 0
+    self.count = count
     self.reservations = Reservations(count)
+    self.codec = codec.Codec(secret)
+    # sockets of the clients blocked in AWAIT, answered when the last reservation arrives
+    self.waiting = []
+    self.members = Members(heartbeat_timeout)
+    self.elastic = elastic
+    self.on_failure = on_failure
+    self.epoch = 0
+    self.failed = []
+
+  def _barriers(self):
+    """
+    Returns:
+        the lists of the clients blocked on a barrier
+    """
+    return [self.waiting]
+
+  def _reset(self):
+    """Start over with a new cluster, the clients of the current one are released by _fail."""
+    self.reservations = Reservations(self.count)
+    self.waiting = []
+    self.members.clear()
+
+  def _release(self, waiting, msg):
+    """
+    Answer all clients blocked on a barrier.
+
+    Args:
+        :waiting: list of the sockets of the blocked clients, emptied
+        :msg: the answer
+    """
+    while waiting:
+      sock = waiting.pop()
+      try:
+        MessageSocket.send(self, sock, msg)
+      except socket.error as e:
+        # the client went away while it was waiting, the listener closes the socket
+        logging.debug(e)
 
   def await_reservations(self, sc, status={}, timeout=600):
     """
@@ -129,17 +442,16 @@ class Server(MessageSocket):
     Returns:
 
     """
-    timespent = 0
-    while not self.reservations.done():
+    start = time.time()
+    # wakes up as soon as the last reservation arrives, the timeout only bounds how often the status is checked
+    while not self.reservations.wait(1):
       logging.info("waiting for {0} reservations".format(self.reservations.remaining()))
       # check status flags for any errors
       if 'error' in status:
         sc.cancelAllJobs()
         #sc.stop()
         #sys.exit(1)
-      time.sleep(1)
-      timespent += 1
-      if (timespent > timeout):
+      if (time.time() - start > timeout):
         raise Exception("timed out waiting for reservations to complete")
     logging.info("all reservations completed")
     return self.reservations.get()
@@ -156,9 +468,21 @@ class Server(MessageSocket):
     """
     logging.debug("received: {0}".format(msg))
     msg_type = msg['type']
-    if msg_type == 'REG':
+    if self.failed and msg_type in ('REG', 'AWAIT'):
+      MessageSocket.send(self, sock, {'error': 'executors ' + ', '.join(self.failed) + ' failed'})
+    elif msg_type in ('HEARTBEAT', 'LEAVE'):
+      _on_membership(self, sock, msg)
+    elif msg_type == 'REG':
       self.reservations.add(msg['data'])
       MessageSocket.send(self, sock, 'OK')
+      if self.reservations.done():
+        self._release(self.waiting, self.reservations.get())
+    elif msg_type == 'AWAIT':
+      # no answer until the cluster is complete, the client blocks on the open connection instead of polling
+      if self.reservations.done():
+        MessageSocket.send(self, sock, self.reservations.get())
+      else:
+        self.waiting.append(sock)
     elif msg_type == 'QUERY':
       logging.info("waiting for {0} reservations".format(self.reservations.remaining()))
       MessageSocket.send(self, sock, self.reservations.done())
@@ -182,44 +506,14 @@ class Server(MessageSocket):
     server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_sock.bind(('', 0))
-    server_sock.listen(10)
+    # all executors connect at the same time when the cluster comes up
+    server_sock.listen(socket.SOMAXCONN)
 
     # hostname may not be resolvable but IP address probably will be
     host = util._get_ip_address()
     port = server_sock.getsockname()[1]
     addr = (host,port)
 
-    def _listen(self, sock):
-      """
-
-      Args:
-          self:
-          sock:
-
-      Returns:
-
-      """
-      CONNECTIONS = []
-      CONNECTIONS.append(sock)
-
-      while not self.done:
-        read_socks, write_socks, err_socks = select.select(CONNECTIONS, [], [], 60)
-        for sock in read_socks:
-          if sock == server_sock:
-            client_sock, client_addr = sock.accept()
-            CONNECTIONS.append(client_sock)
-            logging.debug("client connected from {0}".format(client_addr))
-          else:
-            try:
-              msg = self.receive(sock)
-              self._handle_message(sock, msg)
-            except Exception as e:
-              logging.debug(e)
-              sock.close()
-              CONNECTIONS.remove(sock)
-
-      server_sock.close()
-
     t = threading.Thread(target=_listen, args=(self, server_sock))
     t.daemon = True
     t.start()
@@ -236,12 +530,14 @@ class Client(MessageSocket):
   sock = None                   #: socket to server TCP connection
   server_addr = None            #: address of server
 
-  def __init__(self, server_addr):
+  def __init__(self, server_addr, secret=None):
     """
 
     Args:
         :server_addr: a tuple of (host, port) pointing to the Server.
+        :secret: the secret the Server was started with
     """
+    self.codec = codec.Codec(secret)
     self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     self.sock.connect(server_addr)
     self.server_addr = server_addr
@@ -297,7 +593,7 @@ class Client(MessageSocket):
     Returns:
 
     """
-    resp = self._request('REG', reservation)
+    resp = _checked(self._request('REG', reservation))
     return resp
 
   def get_reservations(self):
@@ -306,15 +602,140 @@ class Client(MessageSocket):
     return cluster_info
 
   def await_reservations(self):
-    """Poll until all reservations completed, then return cluster_info."""
-    done = False
-    while not done:
-      done = self._request('QUERY')
-      time.sleep(1)
-    reservations = self.get_reservations()
-    return reservations
+    """Block until all reservations completed, then return cluster_info."""
+    return _checked(self._request('AWAIT'))
 
   def request_stop(self):
     """Request server stop."""
     resp = self._request('STOP')
     return resp
+
+
+class Heartbeat(MessageSocket):
+  """
+  Executor side of the failure detector. Sends a heartbeat every HEARTBEAT_INTERVAL seconds on its own connection, so
+  that it is not blocked behind a barrier, and calls ``on_failure`` once when the server reports failed executors or a
+  new epoch.
+  """
+
+  def __init__(self, server_addr, member_id, secret=None, on_failure=None, interval=HEARTBEAT_INTERVAL,
+               abort_grace=ABORT_GRACE, before_exit=None):
+    """
+
+    Args:
+        :server_addr: a tuple of (host, port) pointing to the Server.
+        :member_id: the 'host:port' the executor registers with
+        :secret: the secret the Server was started with
+        :on_failure: function called with the reason, by default the Spark task is aborted
+        :interval: seconds between heartbeats
+        :abort_grace: seconds an aborted task has to return before the python worker exits, None to never exit
+        :before_exit: function called before the python worker exits, e.g. closing the task to flush its logfile
+    """
+    self.codec = codec.Codec(secret)
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.sock.connect(server_addr)
+    self.sock.settimeout(HEARTBEAT_TIMEOUT)
+    self.member_id = member_id
+    self.on_failure = on_failure if on_failure is not None else self._abort
+    self.interval = interval
+    self.abort_grace = abort_grace
+    self.before_exit = before_exit
+    self.epoch = None
+    self.stopped = threading.Event()
+    self.thread = None
+
+  def _send(self, msg_type, failed=False):
+    """
+    Send a HEARTBEAT or LEAVE.
+
+    Args:
+        :msg_type: the type
+        :failed: True if the task of the executor failed
+
+    Returns:
+        the answer of the server, dict with the 'epoch' and the 'failed' executors
+    """
+    MessageSocket.send(self, self.sock, {'type': msg_type, 'data': {'id': self.member_id, 'epoch': self.epoch, 'failed': failed}})
+    return MessageSocket.receive(self, self.sock)
+
+  def start(self):
+    """
+    Send the first heartbeat and keep sending them in a background thread.
+
+    Returns:
+        the epoch of the cluster the executor joins, larger than 0 if the cluster was re-formed after a failure
+    """
+    resp = self._send('HEARTBEAT')
+    self.epoch = resp['epoch']
+    if resp['failed']:
+      raise Exception('executors ' + ', '.join(resp['failed']) + ' failed')
+    self.thread = threading.Thread(target=self._run)
+    self.thread.daemon = True
+    self.thread.start()
+    return self.epoch
+
+  def _run(self):
+    """Heartbeat loop."""
+    while not self.stopped.wait(self.interval):
+      try:
+        resp = self._send('HEARTBEAT')
+      except Exception as e:
+        # the driver stopped the server, Spark fails the task if the driver itself went away
+        logging.debug(e)
+        return
+      if resp['failed']:
+        self.on_failure('executors ' + ', '.join(resp['failed']) + ' failed')
+        return
+      if resp['epoch'] != self.epoch:
+        self.on_failure('the cluster is re-formed after a failure in epoch ' + str(resp['epoch']))
+        return
+
+  def _abort(self, reason):
+    """
+    Fail the Spark task. The main thread is interrupted, if it does not return to python, e.g. blocked in a collective
+    operation with a dead executor, the python worker exits after abort_grace seconds unless the task stopped the
+    heartbeat by then. Before it exits, before_exit gets another abort_grace seconds to do what the task would have
+    done on its way out, and the executor leaves the cluster as failed.
+
+    Args:
+        :reason: why the task is aborted
+    """
+    print(reason + ', aborting the task')
+    _thread.interrupt_main()
+    if self.abort_grace is None or self.stopped.wait(self.abort_grace):
+      return
+    print('The task did not return within ' + str(self.abort_grace) + ' seconds, exiting the python worker')
+    if self.before_exit is not None:
+      # the cleanup may itself hang on the failed cluster or on HDFS
+      cleanup = threading.Thread(target=self._before_exit)
+      cleanup.daemon = True
+      cleanup.start()
+      cleanup.join(self.abort_grace)
+    try:
+      self._send('LEAVE', True)
+    except Exception as e:
+      logging.debug(e)
+    os._exit(1)
+
+  def _before_exit(self):
+    """Calls before_exit, reporting its errors."""
+    try:
+      self.before_exit()
+    except Exception as e:
+      print('Could not clean up the aborted task: ' + str(e))
+
+  def stop(self, failed=False):
+    """
+    Stop sending heartbeats and leave the cluster.
+
+    Args:
+        :failed: True if the task failed, the server then fails the executor right away
+    """
+    self.stopped.set()
+    if self.thread is not None and self.thread is not threading.current_thread():
+      self.thread.join()
+    try:
+      self._send('LEAVE', failed)
+    except Exception as e:
+      logging.debug(e)
+    self.sock.close()
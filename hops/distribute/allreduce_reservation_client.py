@@ -5,6 +5,8 @@ if __name__ == "__main__":
   host = sys.argv[1]
   port = int(sys.argv[2])
   addr = (host, port)
-  client = allreduce_reservation.Client(addr)
+  # the secret of the application, if the server was started with one
+  secret = sys.argv[3] if len(sys.argv) > 3 else None
+  client = allreduce_reservation.Client(addr, secret=secret)
   client.request_stop()
   client.close()
@@ -0,0 +1,162 @@
+"""
+Wire format of the messages between the servers on the driver and the clients on the executors.
+
+Every message is a frame of a 4 byte big endian length followed by the body
+
+    version (1 byte) | flags (1 byte) | HMAC-SHA256 of the payload (32 bytes, if flags has AUTHENTICATED) | payload
+
+with the message as compact UTF-8 JSON as payload. Unlike pickle, decoding a message can not run code, and the
+format does not depend on the python version of the driver and the executors.
+
+Requests are dicts with the message 'type' and for some types 'data', the reservation servers answer
+
+    ============  ==============================  ===========================================================
+    type          data                            answer
+    ============  ==============================  ===========================================================
+    REG           the reservation                 'OK'
+    QUERY                                         True if all reservations arrived
+    AWAIT                                         the cluster info, sent when the last reservation arrives
+    QINFO                                         the cluster info
+    REG_DONE                                      'OK'
+    QUERY_DONE                                    True if all workers finished
+    AWAIT_DONE                                    True, sent when the last worker finished
+    STOP                                          'OK'
+    HEARTBEAT     {'id', 'epoch'}                 {'epoch', 'failed'}, the current epoch and failed executors
+    LEAVE         {'id', 'epoch', 'failed'}       {'epoch', 'failed'}
+    ============  ==============================  ===========================================================
+
+where a reservation is {'index': int, 'worker': 'host:port'} for allreduce and {'task_type': 'ps' or 'worker',
+'host_port': 'host:port', 'gpus_present': bool} for parameter servers. Unknown types are answered with 'ERR'. Once
+executors failed, registrations and barriers are answered with {'error': reason}. The metric and trial servers use the
+same format for their own types.
+
+With a secret every message carries an HMAC of its payload, and messages without a valid HMAC are rejected. The
+launchers create a new secret for every application and pass it to the executors along with the server address.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import struct
+
+import six
+
+VERSION = 1
+AUTHENTICATED = 1
+
+# length prefix of a frame
+HEADER = struct.Struct('>I')
+# the largest body accepted, a corrupt or hostile length would otherwise allocate it
+MAX_SIZE = 512 * 1024 * 1024
+
+_PREFIX = struct.Struct('>BB')
+_DIGEST_SIZE = hashlib.sha256().digest_size
+
+
+def new_secret():
+  """
+  Creates a secret for the messages of one application.
+
+  Returns:
+      a random hex string
+  """
+  return binascii.hexlify(os.urandom(32)).decode('ascii')
+
+
+def _default(obj):
+  """
+  Converts the values JSON does not know, e.g. numpy numbers in reported metrics.
+
+  Args:
+      :obj: the value
+
+  Returns:
+      the value as python type
+  """
+  if hasattr(obj, 'tolist'):
+    return obj.tolist()
+  if hasattr(obj, 'item'):
+    return obj.item()
+  raise TypeError(repr(obj) + ' can not be sent to the server')
+
+
+class Codec(object):
+  """Encodes and decodes message bodies, authenticated if it has a secret."""
+
+  def __init__(self, secret=None):
+    """
+    Args:
+        :secret: the secret of the application, None to neither sign nor check messages
+    """
+    if isinstance(secret, six.text_type):
+      secret = secret.encode('utf-8')
+    self.secret = secret
+
+  def _digest(self, payload):
+    """
+    Args:
+        :payload: the JSON bytes
+
+    Returns:
+        HMAC-SHA256 of the payload
+    """
+    return hmac.new(self.secret, payload, hashlib.sha256).digest()
+
+  def encode(self, msg):
+    """
+    Encode a message.
+
+    Args:
+        :msg: the message
+
+    Returns:
+        the body, without the length prefix
+    """
+    payload = json.dumps(msg, separators=(',', ':'), default=_default).encode('utf-8')
+    if self.secret is None:
+      return _PREFIX.pack(VERSION, 0) + payload
+    return _PREFIX.pack(VERSION, AUTHENTICATED) + self._digest(payload) + payload
+
+  def frame(self, msg):
+    """
+    Encode a message with its length prefix.
+
+    Args:
+        :msg: the message
+
+    Returns:
+        the frame to send
+    """
+    body = self.encode(msg)
+    return HEADER.pack(len(body)) + body
+
+  def decode(self, body):
+    """
+    Decode a message.
+
+    Args:
+        :body: the body, bytes or bytearray
+
+    Returns:
+        the message
+    """
+    if len(body) < _PREFIX.size:
+      raise ValueError('Message too short')
+    version, flags = _PREFIX.unpack_from(body)
+    if version != VERSION:
+      raise ValueError('Unsupported message version ' + str(version))
+    offset = _PREFIX.size
+    digest = None
+    if flags & AUTHENTICATED:
+      digest = bytes(body[offset:offset + _DIGEST_SIZE])
+      offset += _DIGEST_SIZE
+    payload = bytes(body[offset:])
+    if self.secret is not None and (digest is None or not hmac.compare_digest(digest, self._digest(payload))):
+      raise ValueError('Message is not authenticated')
+    return json.loads(payload.decode('utf-8'))
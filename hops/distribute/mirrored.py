@@ -1,22 +1,29 @@
 """
 Simple experiment implementation
+
+A single executor mirrors over its local GPUs. With several executors every executor mirrors over its local GPUs and the
+executors all-reduce across each other, the cluster is formed with the allreduce reservation server like for
+*collective_all_reduce*. Create the strategy with *strategy()* and the same model code runs in both modes.
 """
 
 from hops import util
 from hops import hdfs as hopshdfs
-from hops import tensorboard
 from hops import devices
+from hops import metrics as hopsmetrics
+from hops import runtime
 
 import pydoop.hdfs
-import threading
-import six
-import datetime
+import json
 import os
 
+from . import allreduce
+from . import allreduce_reservation
+from . import codec
+
 run_id = 0
 
 
-def _launch(sc, map_fun, args_dict=None, local_logdir=False, name="no-name"):
+def _launch(sc, map_fun, args_dict=None, local_logdir=False, name="no-name", num_executors=1):
     """
 
     Args:
@@ -25,6 +32,7 @@ def _launch(sc, map_fun, args_dict=None, local_logdir=False, name="no-name"):
         args_dict:
         local_logdir:
         name:
+        num_executors:
 
     Returns:
 
@@ -33,13 +41,28 @@ def _launch(sc, map_fun, args_dict=None, local_logdir=False, name="no-name"):
 
     app_id = str(sc.applicationId)
 
-    num_executions=1
+    num_executions = num_executors
     sc.setJobGroup("MirroredStrategy", "{} | Running on multiple devices".format(name))
     #Each TF task should be run on 1 executor
     nodeRDD = sc.parallelize(range(num_executions), num_executions)
 
+    # executors get the secret along with the server addresses in the closure of the task
+    secret = codec.new_secret()
+    server = None
+    server_addr = None
+    if num_executions > 1:
+        server = allreduce_reservation.Server(num_executions, secret=secret,
+                                              on_failure=lambda reason: sc.cancelJobGroup("MirroredStrategy"))
+        server_addr = server.start()
+
     #Force execution on executor, since GPU is located on executor    global run_id
-    nodeRDD.foreachPartition(_prepare_func(app_id, run_id, map_fun, args_dict, local_logdir))
+    metric_server, metric_server_addr = hopsmetrics._start(secret=secret)
+    try:
+        nodeRDD.foreachPartition(_prepare_func(app_id, run_id, map_fun, args_dict, local_logdir, metric_server_addr, server_addr, secret))
+    finally:
+        metric_server.stop()
+        if server is not None:
+            server.stop()
 
     print('Finished Experiment \n')
 
@@ -65,8 +88,64 @@ def _get_logdir(app_id):
     return hopshdfs._get_experiments_dir() + '/' + app_id + '/mirrored/run.' +  str(run_id)
 
 
+def strategy():
+    """
+    Creates the distribution strategy of the executor, call it in the function passed to *experiment.mirrored*.
+
+    Returns:
+        MirroredStrategy over the local GPUs on a single executor, MultiWorkerMirroredStrategy (CollectiveAllReduceStrategy
+        on older TensorFlow) over the local GPUs and across the executors when there are several
+    """
+    import tensorflow as tf
+    cluster = json.loads(os.environ.get('TF_CONFIG', '{}')).get('cluster', {})
+    if len(cluster.get('worker', [])) > 1:
+        if hasattr(tf, 'distribute') and hasattr(tf.distribute, 'experimental') and hasattr(tf.distribute.experimental, 'MultiWorkerMirroredStrategy'):
+            return tf.distribute.experimental.MultiWorkerMirroredStrategy()
+        return tf.contrib.distribute.CollectiveAllReduceStrategy(num_gpus_per_worker=devices.get_num_gpus())
+    if hasattr(tf, 'distribute') and hasattr(tf.distribute, 'MirroredStrategy'):
+        return tf.distribute.MirroredStrategy()
+    return tf.contrib.distribute.MirroredStrategy()
+
+def _join_cluster(server_addr, secret, executor_num, before_exit=None):
+    """
+    Registers the executor with the reservation server and exports the TF_CONFIG of the cluster of executors
+
+    Args:
+        server_addr:
+        secret:
+        executor_num:
+        before_exit: called by the heartbeat before an aborted task exits its python worker
+
+    Returns:
+        the index of the worker, its Heartbeat and the socket reserving the port of its TensorFlow server
+    """
+    tmp_socket, port = util._reserve_port()
+    heartbeat = None
+    try:
+        host_port = util._get_ip_address() + ":" + str(port)
+
+        # the heartbeat aborts this task when another executor fails
+        heartbeat = allreduce_reservation.Heartbeat(server_addr, host_port, secret=secret, before_exit=before_exit)
+        heartbeat.start()
+
+        client = allreduce_reservation.Client(server_addr, secret=secret)
+        client.register({"worker": host_port, "index": executor_num})
+        cluster = client.await_reservations()
+        client.close()
+        util._hand_off_port(tmp_socket)
+
+        task_index = allreduce._find_index(host_port, cluster)
+        cluster["task"] = {"type": "worker", "index": task_index}
+        os.environ["TF_CONFIG"] = json.dumps(cluster)
+    except:
+        if heartbeat is not None:
+            heartbeat.stop(failed=True)
+        tmp_socket.close()
+        raise
+    return task_index, heartbeat, tmp_socket
+
 #Helper to put Spark required parameter iter in function signature
-def _prepare_func(app_id, run_id, map_fun, args_dict, local_logdir):
+def _prepare_func(app_id, run_id, map_fun, args_dict, local_logdir, metric_server_addr, server_addr=None, secret=None):
     """
 
     Args:
@@ -75,6 +154,9 @@ def _prepare_func(app_id, run_id, map_fun, args_dict, local_logdir):
         map_fun:
         args_dict:
         local_logdir:
+        metric_server_addr:
+        server_addr: address of the reservation server, None on a single executor
+        secret:
 
     Returns:
 
@@ -92,92 +174,36 @@ def _prepare_func(app_id, run_id, map_fun, args_dict, local_logdir):
         for i in iter:
             executor_num = i
 
-        tb_pid = 0
-        tb_hdfs_path = ''
-        hdfs_exec_logdir = ''
-
-        t = threading.Thread(target=devices._print_periodic_gpu_utilization)
-        if devices.get_num_gpus() > 0:
-            t.start()
-
-        try:
-            hdfs_exec_logdir, hdfs_appid_logdir = hopshdfs._create_directories(app_id, run_id, None, 'mirrored')
-            pydoop.hdfs.dump('', os.environ['EXEC_LOGFILE'], user=hopshdfs.project_user())
-            hopshdfs._init_logger()
-            tb_hdfs_path, tb_pid = tensorboard._register(hdfs_exec_logdir, hdfs_appid_logdir, executor_num, local_logdir=local_logdir)
-            gpu_str = '\nChecking for GPUs in the environment' + devices._get_gpu_info()
-            hopshdfs.log(gpu_str)
-            print(gpu_str)
-            print('-------------------------------------------------------')
-            print('Started running task\n')
-            hopshdfs.log('Started running task')
-            task_start = datetime.datetime.now()
-            retval = map_fun()
-            task_end = datetime.datetime.now()
-            if retval:
-                _handle_return(retval, hdfs_exec_logdir)
-            time_str = 'Finished task - took ' + util._time_diff(task_start, task_end)
-            print('\n' + time_str)
-            print('-------------------------------------------------------')
-            hopshdfs.log(time_str)
-        except:
-            #Always do cleanup
-            _cleanup(tb_hdfs_path)
-            if devices.get_num_gpus() > 0:
-                t.do_run = False
-                t.join()
-            raise
-        finally:
+        # only the first worker writes the logdir, the metric and runs TensorBoard
+        task_index = 0
+        heartbeat = None
+        tmp_socket = None
+
+        with runtime.Task(app_id, run_id, 'mirrored', executor_num, local_logdir=local_logdir) as task:
             try:
-                if local_logdir:
-                    local_tb = tensorboard.local_logdir_path
-                    util._store_local_tensorboard(local_tb, hdfs_exec_logdir)
+                if server_addr is None:
+                    # a reused python worker may still have the TF_CONFIG of a multi executor run
+                    os.environ.pop("TF_CONFIG", None)
+                else:
+                    task_index, heartbeat, tmp_socket = _join_cluster(server_addr, secret, executor_num,
+                                                                      before_exit=lambda: task.close(failed=True))
+
+                if task_index == 0:
+                    task.setup()
+                hopsmetrics._connect(metric_server_addr, executor_num, 'mirrored' if server_addr is None else 'worker' + str(task_index),
+                                     secret=secret)
+                retval = task.run(map_fun)
+                if task_index == 0 and retval:
+                    task.handle_return(retval)
             except:
-                pass
+                if heartbeat is not None:
+                    heartbeat.stop(failed=True)
+                raise
+            finally:
+                if tmp_socket is not None:
+                    tmp_socket.close()
 
-        _cleanup(tb_hdfs_path)
-        if devices.get_num_gpus() > 0:
-            t.do_run = False
-            t.join()
+            if heartbeat is not None:
+                heartbeat.stop()
 
     return _wrapper_fun
-
-def _cleanup(tb_hdfs_path):
-    """
-
-    Args:
-        tb_hdfs_path:
-
-    Returns:
-
-    """
-    global experiment_json
-    handle = hopshdfs.get()
-    if not tb_hdfs_path == None and not tb_hdfs_path == '' and handle.exists(tb_hdfs_path):
-        handle.delete(tb_hdfs_path)
-    hopshdfs._kill_logger()
-
-def _handle_return(val, hdfs_exec_logdir):
-    """
-
-    Args:
-        val:
-        hdfs_exec_logdir:
-
-    Returns:
-
-    """
-    try:
-        test = int(val)
-    except:
-        raise ValueError('Your function needs to return a metric (number) which should be maximized or minimized')
-
-    metric_file = hdfs_exec_logdir + '/metric'
-    fs_handle = hopshdfs.get_fs()
-    try:
-        fd = fs_handle.open_file(metric_file, mode='w')
-    except:
-        fd = fs_handle.open_file(metric_file, flags='w')
-    fd.write(str(float(val)).encode())
-    fd.flush()
-    fd.close()
@@ -6,21 +6,25 @@ These utils facilitates development by hiding complexity for programs interactin
 
 import os
 from hops import hdfs as hopshdfs
-from hops import tensorboard
-from hops import devices
+from hops import metrics as hopsmetrics
+from hops import runtime
 from hops import util
 
 import pydoop.hdfs
 import threading
-import datetime
-import socket
+import traceback
 import json
 
 from . import parameter_server_reservation
+from . import codec
 
 run_id = 0
 
-def _launch(sc, map_fun, local_logdir=False, name="no-name"):
+# seconds a parameter server gets to return after the workers finished
+PS_SHUTDOWN_TIMEOUT = 2
+
+def _launch(sc, map_fun, local_logdir=False, name="no-name", elastic=False, heartbeat_timeout=parameter_server_reservation.HEARTBEAT_TIMEOUT,
+            abort_grace=parameter_server_reservation.ABORT_GRACE):
     """
 
     Args:
@@ -28,6 +32,9 @@ def _launch(sc, map_fun, local_logdir=False, name="no-name"):
         map_fun:
         local_logdir:
         name:
+        elastic:
+        heartbeat_timeout:
+        abort_grace: seconds an aborted task has to return before its python worker exits, None to never exit
 
     Returns:
 
@@ -43,13 +50,23 @@ def _launch(sc, map_fun, local_logdir=False, name="no-name"):
     #Make SparkUI intuitive by grouping jobs
     sc.setJobGroup("ParameterServerStrategy", "{} | Distributed Training".format(name))
 
-    server = parameter_server_reservation.Server(num_executions)
+    # executors get the secret along with the server address in the closure of the task
+    secret = codec.new_secret()
+    # a failed cluster cancels the job right away instead of leaving the other executors blocked
+    server = parameter_server_reservation.Server(num_executions, secret=secret, heartbeat_timeout=heartbeat_timeout, elastic=elastic,
+                                                 on_failure=lambda reason: sc.cancelJobGroup("ParameterServerStrategy"))
     server_addr = server.start()
 
     num_ps = util.num_param_servers()
 
     #Force execution on executor, since GPU is located on executor
-    nodeRDD.foreachPartition(_prepare_func(app_id, run_id, map_fun, local_logdir, server_addr, num_ps))
+    metric_server, metric_server_addr = hopsmetrics._start(secret=secret)
+    try:
+        nodeRDD.foreachPartition(_prepare_func(app_id, run_id, map_fun, local_logdir, server_addr, num_ps, metric_server_addr, secret,
+                                               abort_grace=abort_grace))
+    finally:
+        metric_server.stop()
+        server.stop()
 
     logdir = _get_logdir(app_id)
 
@@ -76,7 +93,8 @@ def _get_logdir(app_id):
     global run_id
     return hopshdfs._get_experiments_dir() + '/' + app_id + '/parameter_server/run.' + str(run_id)
 
-def _prepare_func(app_id, run_id, map_fun, local_logdir, server_addr, num_ps):
+def _prepare_func(app_id, run_id, map_fun, local_logdir, server_addr, num_ps, metric_server_addr, secret,
+                  abort_grace=parameter_server_reservation.ABORT_GRACE):
     """
 
     Args:
@@ -86,6 +104,9 @@ def _prepare_func(app_id, run_id, map_fun, local_logdir, server_addr, num_ps):
         local_logdir:
         server_addr:
         num_ps:
+        metric_server_addr:
+        secret:
+        abort_grace:
 
     Returns:
 
@@ -104,122 +125,136 @@ def _prepare_func(app_id, run_id, map_fun, local_logdir, server_addr, num_ps):
         for i in iter:
             executor_num = i
 
-        tb_hdfs_path = ''
-        hdfs_exec_logdir = ''
+        heartbeat = None
+        tmp_socket = None
+        ps_server = None
+
+        client = parameter_server_reservation.Client(server_addr, secret=secret)
 
-        t = threading.Thread(target=devices._print_periodic_gpu_utilization)
-        if devices.get_num_gpus() > 0:
-            t.start()
+        with runtime.Task(app_id, run_id, 'parameter_server', executor_num, local_logdir=local_logdir) as task:
+            try:
+                host = util._get_ip_address()
 
-        role = None
+                # the port stays reserved until the task ends, TensorFlow binds it with SO_REUSEPORT
+                tmp_socket, port = util._reserve_port()
+                host_port = host + ":" + str(port)
 
-        client = parameter_server_reservation.Client(server_addr)
+                exec_spec = {}
+                if executor_num < num_ps:
+                    exec_spec["task_type"] = "ps"
+                else:
+                    exec_spec["task_type"] = "worker"
+                exec_spec["host_port"] = host_port
+                exec_spec["gpus_present"] = task.num_gpus() > 0
 
-        try:
-            host = util._get_ip_address()
-
-            tmp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            tmp_socket.bind(('', 0))
-            port = tmp_socket.getsockname()[1]
-            host_port = host + ":" + str(port)
-
-            exec_spec = {}
-            if executor_num < num_ps:
-                exec_spec["task_type"] = "ps"
-            else:
-                exec_spec["task_type"] = "worker"
-            exec_spec["host_port"] = host_port
-            exec_spec["gpus_present"] = devices.get_num_gpus() > 0
-
-            client.register(exec_spec)
-
-            cluster = client.await_reservations()
-
-            tmp_socket.close()
-
-            role, index = _find_task_and_index(host_port, cluster)
-
-            cluster_spec = {}
-            cluster_spec["cluster"] = cluster
-            cluster_spec["task"] = {"type": role, "index": index}
-
-            print(cluster_spec)
-
-            os.environ["TF_CONFIG"] = json.dumps(cluster_spec)
-
-            if role == "chief":
-                hdfs_exec_logdir, hdfs_appid_logdir = hopshdfs._create_directories(app_id, run_id, None, 'parameter_server')
-                pydoop.hdfs.dump('', os.environ['EXEC_LOGFILE'], user=hopshdfs.project_user())
-                hopshdfs._init_logger()
-                tb_hdfs_path, tb_pid = tensorboard._register(hdfs_exec_logdir, hdfs_appid_logdir, executor_num, local_logdir=local_logdir)
-            gpu_str = '\nChecking for GPUs in the environment' + devices._get_gpu_info()
-            if role == "chief":
-                hopshdfs.log(gpu_str)
-            print(gpu_str)
-            print('-------------------------------------------------------')
-            print('Started running task \n')
-            if role == "chief":
-                hopshdfs.log('Started running task')
-            task_start = datetime.datetime.now()
-
-            retval=None
-            if role == "ps":
-                ps_thread = threading.Thread(target=lambda: map_fun())
-                ps_thread.start()
-                print("waiting for workers")
-                client.await_all_workers_finished()
-                print("waiting finished")
-            else:
-                retval = map_fun()
-
-            if role == "chief":
-                if retval:
-                    _handle_return(retval, hdfs_exec_logdir)
-
-            task_end = datetime.datetime.now()
-            time_str = 'Finished task - took ' + util._time_diff(task_start, task_end)
-            print('\n' + time_str)
-            print('-------------------------------------------------------')
-            if role == "chief":
-                hopshdfs.log(time_str)
-        except:
-            _cleanup(tb_hdfs_path)
-            if devices.get_num_gpus() > 0:
-                t.do_run = False
-                t.join()
-            raise
-        finally:
-            if role == "chief":
-                if local_logdir:
-                    local_tb = tensorboard.local_logdir_path
-                    util._store_local_tensorboard(local_tb, hdfs_exec_logdir)
-            try:
-                if role == "worker" or role == "chief":
+                # the heartbeat aborts this task when another executor fails
+                heartbeat = parameter_server_reservation.Heartbeat(server_addr, host_port, secret=secret, abort_grace=abort_grace,
+                                                                   before_exit=lambda: task.close(failed=True))
+                epoch = heartbeat.start()
+
+                client.register(exec_spec)
+
+                cluster = client.await_reservations()
+
+                util._hand_off_port(tmp_socket)
+
+                role, index = _find_task_and_index(host_port, cluster)
+
+                cluster_spec = {}
+                cluster_spec["cluster"] = cluster
+                cluster_spec["task"] = {"type": role, "index": index}
+
+                print(cluster_spec)
+
+                os.environ["TF_CONFIG"] = json.dumps(cluster_spec)
+
+                if role == "chief":
+                    # a cluster re-formed after a failure resumes from the checkpoints in the logdir
+                    task.setup(keep=epoch > 0)
+                hopsmetrics._connect(metric_server_addr, executor_num, role + str(index), secret=secret)
+
+                if role == "ps":
+                    ps_server = _ParameterServer(map_fun, heartbeat)
+
+                    def _serve():
+                        ps_server.start()
+                        print("waiting for workers")
+                        # answered as soon as the last worker finished
+                        client.await_all_workers_finished()
+                        print("waiting finished")
+
+                    task.run(_serve)
+                else:
+                    retval = task.run(map_fun)
+                    if role == "chief" and retval:
+                        task.handle_return(retval)
                     client.register_worker_finished()
-                client.close()
             except:
-                pass
-
-        _cleanup(tb_hdfs_path)
-        if devices.get_num_gpus() > 0:
-            t.do_run = False
-            t.join()
+                if heartbeat is not None:
+                    heartbeat.stop(failed=True)
+                raise
+            finally:
+                if ps_server is not None:
+                    ps_server.stop()
+                if tmp_socket is not None:
+                    tmp_socket.close()
+                try:
+                    client.close()
+                except:
+                    pass
+
+            heartbeat.stop()
 
     return _wrapper_fun
 
-def _cleanup(tb_hdfs_path):
+class _ParameterServer(object):
+    """
+    Lifecycle of the parameter server of a ps task. The function runs in a thread of the task that is joined once all
+    workers finished. A TensorFlow server blocked in join can not be stopped from another thread, a parameter server
+    that does not return within PS_SHUTDOWN_TIMEOUT seconds is left behind as daemon thread and does not keep the
+    python worker from finishing the task.
     """
 
-    Args:
-        tb_hdfs_path:
+    def __init__(self, map_fun, heartbeat):
+        """
 
-    Returns:
+        Args:
+            :map_fun: the function running the parameter server
+            :heartbeat: the Heartbeat of the task, stopped as failed if the parameter server crashes
+        """
+        self.map_fun = map_fun
+        self.heartbeat = heartbeat
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        """Starts the parameter server."""
+        self.thread.start()
+
+    def _run(self):
+        """Runs the parameter server, fails the task if it crashes before the workers finished."""
+        try:
+            self.map_fun()
+        except Exception:
+            if not self.stopping.is_set():
+                traceback.print_exc()
+                print('parameter server failed')
+                self.heartbeat.stop(failed=True)
+
+    def stop(self):
+        """
+        Waits for the parameter server to return after the workers finished.
 
-    """
-    handle = hopshdfs.get()
-    if not tb_hdfs_path == None and not tb_hdfs_path == '' and handle.exists(tb_hdfs_path):
-        handle.delete(tb_hdfs_path)
-    hopshdfs._kill_logger()
+        Returns:
+            True if it returned within PS_SHUTDOWN_TIMEOUT seconds
+        """
+        self.stopping.set()
+        self.thread.join(PS_SHUTDOWN_TIMEOUT)
+        if self.thread.is_alive():
+            print('parameter server did not return within ' + str(PS_SHUTDOWN_TIMEOUT) + ' seconds, leaving it running')
+            return False
+        return True
 
 def _find_task_and_index(host_port, cluster_spec):
     """
@@ -246,29 +281,3 @@ def _find_task_and_index(host_port, cluster_spec):
 
     if cluster_spec["chief"][0] == host_port:
        return "chief", 0
-
-def _handle_return(val, hdfs_exec_logdir):
-    """
-
-    Args:
-        val:
-        hdfs_exec_logdir:
-
-    Returns:
-
-    """
-    try:
-        test = int(val)
-    except:
-        raise ValueError('Your function needs to return a metric (number) which should be maximized or minimized')
-
-    metric_file = hdfs_exec_logdir + '/metric'
-    fs_handle = hopshdfs.get_fs()
-    try:
-        fd = fs_handle.open_file(metric_file, mode='w')
-    except:
-        fd = fs_handle.open_file(metric_file, flags='w')
-    fd.write(str(float(val)).encode())
-    fd.flush()
-    fd.close()
-
@@ -4,17 +4,17 @@ from __future__ import nested_scopes
 from __future__ import print_function
 
 import logging
-import pickle
-import select
 import socket
-import struct
 import threading
 import time
 
 from hops import util
+from . import codec
+from . import placement
+# the framing, the listener loop and the failure detector are shared with the allreduce reservation server
+from .allreduce_reservation import MessageSocket, Members, Heartbeat, HEARTBEAT_TIMEOUT, ABORT_GRACE, _listen, _checked, _on_membership
 
 MAX_RETRIES = 3
-BUFSIZE = 1024*2
 
 class Reservations:
   """Thread-safe store for node reservations."""
@@ -30,6 +30,7 @@ class Reservations:
     self.reservations = []
     self.cluster_spec = {}
     self.check_done = False
+    self.event = threading.Event()
 
   def add(self, meta):
     """Add a reservation.
@@ -41,55 +42,29 @@ class Reservations:
       self.reservations.append(meta)
 
       if self.remaining() == 0:
-        gpus_present = False
-
-        for entry in self.reservations:
-          if entry["gpus_present"] == True:
-            gpus_present = True
-            break
-
-        cluster_spec = {"chief": [], "ps": [], "worker": []}
-        if not gpus_present:
-          added_chief=False
-          for entry in self.reservations:
-            if entry["task_type"] == "ps":
-              cluster_spec["ps"].append(entry["host_port"])
-            elif added_chief == False and entry["task_type"] == "worker":
-              cluster_spec["chief"].append(entry["host_port"])
-              added_chief = True
-            else:
-              cluster_spec["worker"].append(entry["host_port"])
-        else:
-          added_chief=False
-
-          # switch Worker without GPU with PS with GPU
-          for possible_switch in self.reservations:
-            if possible_switch["task_type"] == "worker" and possible_switch["gpus_present"] == False:
-              for candidate in self.reservations:
-                if candidate["task_type"] == "ps" and candidate["gpus_present"] == True:
-                  candidate["task_type"] = "worker"
-                  possible_switch["task_type"] = "ps"
-                  break
-
-          for entry in self.reservations:
-            if entry["task_type"] == "worker" and entry["gpus_present"] == True and added_chief == False:
-              added_chief=True
-              cluster_spec["chief"].append(entry["host_port"])
-            elif entry["task_type"] == "worker" and entry["gpus_present"] == True:
-              cluster_spec["worker"].append(entry["host_port"])
-            elif entry["task_type"] == "ps" and entry["gpus_present"] == False:
-              cluster_spec["ps"].append(entry["host_port"])
-
-
+        cluster_spec = placement.parameter_server_spec(self.reservations)
         self.cluster_spec = cluster_spec
 
         self.check_done = True
+        self.event.set()
 
   def done(self):
     """Returns True if the ``required`` number of reservations have been fulfilled."""
     with self.lock:
       return self.check_done
 
+  def wait(self, timeout=None):
+    """
+    Block until the ``required`` number of reservations have been fulfilled.
+
+    Args:
+        :timeout: seconds to wait at most
+
+    Returns:
+        True if the reservations are done, False on timeout
+    """
+    return self.event.wait(timeout)
+
   def get(self):
     """Get the list of current reservations."""
     with self.lock:
@@ -115,6 +90,7 @@ class WorkerFinished:
     self.lock = threading.RLock()
     self.finished = 0
     self.check_done = False
+    self.event = threading.Event()
 
   def add(self, meta):
     """Add a reservation.
@@ -127,6 +103,7 @@ class WorkerFinished:
 
       if self.remaining() == 0:
         self.check_done = True
+        self.event.set()
 
   def done(self):
     """Returns True if the ``required`` number of reservations have been fulfilled."""
@@ -138,69 +115,66 @@ class WorkerFinished:
     with self.lock:
       return self.required - self.finished
 
-class MessageSocket(object):
-  """Abstract class w/ length-prefixed socket send/receive functions."""
+class Server(MessageSocket):
+  """Simple socket server with length prefixed messages, see the codec module"""
+  reservations = None
+  members = None
+  done = False
 
-  def receive(self, sock):
+  def __init__(self, count, secret=None, heartbeat_timeout=HEARTBEAT_TIMEOUT, elastic=False, on_failure=None):
     """
-    Receive a message on ``sock``
 
     Args:
-        sock:
-
-    Returns:
-
+        count:
+        secret: secret of the application from codec.new_secret, clients without it are rejected
+        heartbeat_timeout: seconds without a heartbeat after which an executor is failed
+        elastic: True to re-form the cluster after a failure instead of failing it
+        on_failure: function called with the reason when the cluster failed for good
     """
-    msg = None
-    data = b''
-    recv_done = False
-    recv_len = -1
-    while not recv_done:
-      buf = sock.recv(BUFSIZE)
-      if buf is None or len(buf) == 0:
-        raise Exception("socket closed")
-      if recv_len == -1:
-        recv_len = struct.unpack('>I', buf[:4])[0]
-        data += buf[4:]
-        recv_len -= len(data)
-      else:
-        data += buf
-        recv_len -= len(buf)
-      recv_done = (recv_len == 0)
-
-    msg = pickle.loads(data)
-    return msg
-
-  def send(self, sock, msg):
+    assert count > 0
+    self.count = count
+    self.reservations = Reservations(count)
+    self.codec = codec.Codec(secret)
+    self.worker_finished = WorkerFinished(util.num_executors() - util.num_param_servers())
+    # sockets of the clients blocked in AWAIT and AWAIT_DONE, answered when the last worker arrives
+    self.waiting = []
+    self.waiting_done = []
+    self.members = Members(heartbeat_timeout)
+    self.elastic = elastic
+    self.on_failure = on_failure
+    self.epoch = 0
+    self.failed = []
+
+  def _barriers(self):
     """
-    Send ``msg`` to destination ``sock``.
-
-    Args:
-        sock:
-        msg:
-
     Returns:
-
+        the lists of the clients blocked on a barrier
     """
-    data = pickle.dumps(msg)
-    buf = struct.pack('>I', len(data)) + data
-    sock.sendall(buf)
-
+    return [self.waiting, self.waiting_done]
 
-class Server(MessageSocket):
-  """Simple socket server with length prefixed pickle messages"""
-  reservations = None
-  done = False
+  def _reset(self):
+    """Start over with a new cluster, the clients of the current one are released by _fail."""
+    self.reservations = Reservations(self.count)
+    self.worker_finished = WorkerFinished(self.worker_finished.required)
+    self.waiting = []
+    self.waiting_done = []
+    self.members.clear()
 
-  def __init__(self, count):
+  def _release(self, waiting, msg):
     """
+    Answer all clients blocked on a barrier.
 
     Args:
-        count:
+        :waiting: list of the sockets of the blocked clients, emptied
+        :msg: the answer
     """
-    assert count > 0
-    self.reservations = Reservations(count)
-    self.worker_finished = WorkerFinished(util.num_executors() - util.num_param_servers())
+    while waiting:
+      sock = waiting.pop()
+      try:
+        MessageSocket.send(self, sock, msg)
+      except socket.error as e:
+        # the client went away while it was waiting, the listener closes the socket
+        logging.debug(e)
 
   def await_reservations(self, sc, status={}, timeout=600):
     """
@@ -214,17 +188,16 @@ class Server(MessageSocket):
     Returns:
 
     """
-    timespent = 0
-    while not self.reservations.done():
+    start = time.time()
+    # wakes up as soon as the last reservation arrives, the timeout only bounds how often the status is checked
+    while not self.reservations.wait(1):
       logging.info("waiting for {0} reservations".format(self.reservations.remaining()))
       # check status flags for any errors
       if 'error' in status:
         sc.cancelAllJobs()
         #sc.stop()
         #sys.exit(1)
-      time.sleep(1)
-      timespent += 1
-      if (timespent > timeout):
+      if (time.time() - start > timeout):
         raise Exception("timed out waiting for reservations to complete")
     logging.info("all reservations completed")
     return self.reservations.get()
@@ -241,12 +214,32 @@ class Server(MessageSocket):
     """
     logging.debug("received: {0}".format(msg))
     msg_type = msg['type']
-    if msg_type == 'REG':
+    if self.failed and msg_type in ('REG', 'AWAIT', 'AWAIT_DONE'):
+      MessageSocket.send(self, sock, {'error': 'executors ' + ', '.join(self.failed) + ' failed'})
+    elif msg_type in ('HEARTBEAT', 'LEAVE'):
+      _on_membership(self, sock, msg)
+    elif msg_type == 'REG':
       self.reservations.add(msg['data'])
       MessageSocket.send(self, sock, 'OK')
+      if self.reservations.done():
+        self._release(self.waiting, self.reservations.get())
     elif msg_type == 'REG_DONE':
-      self.worker_finished.add(msg['data'])
+      # register_worker_finished sends no data
+      self.worker_finished.add(msg.get('data'))
       MessageSocket.send(self, sock, 'OK')
+      if self.worker_finished.done():
+        self._release(self.waiting_done, True)
+    elif msg_type == 'AWAIT':
+      # no answer until the cluster is complete, the client blocks on the open connection instead of polling
+      if self.reservations.done():
+        MessageSocket.send(self, sock, self.reservations.get())
+      else:
+        self.waiting.append(sock)
+    elif msg_type == 'AWAIT_DONE':
+      if self.worker_finished.done():
+        MessageSocket.send(self, sock, True)
+      else:
+        self.waiting_done.append(sock)
     elif msg_type == 'QUERY':
       MessageSocket.send(self, sock, self.reservations.done())
     elif msg_type == 'QUERY_DONE':
@@ -271,35 +264,14 @@ class Server(MessageSocket):
     server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_sock.bind(('', 0))
-    server_sock.listen(10)
+    # all executors connect at the same time when the cluster comes up
+    server_sock.listen(socket.SOMAXCONN)
 
     # hostname may not be resolvable but IP address probably will be
     host = util._get_ip_address()
     port = server_sock.getsockname()[1]
     addr = (host,port)
 
-    def _listen(self, sock):
-      CONNECTIONS = []
-      CONNECTIONS.append(sock)
-
-      while not self.done:
-        read_socks, write_socks, err_socks = select.select(CONNECTIONS, [], [], 60)
-        for sock in read_socks:
-          if sock == server_sock:
-            client_sock, client_addr = sock.accept()
-            CONNECTIONS.append(client_sock)
-            logging.debug("client connected from {0}".format(client_addr))
-          else:
-            try:
-              msg = self.receive(sock)
-              self._handle_message(sock, msg)
-            except Exception as e:
-              logging.debug(e)
-              sock.close()
-              CONNECTIONS.remove(sock)
-
-      server_sock.close()
-
     t = threading.Thread(target=_listen, args=(self, server_sock))
     t.daemon = True
     t.start()
@@ -316,11 +288,13 @@ class Client(MessageSocket):
 
   Args:
       :server_addr: a tuple of (host, port) pointing to the Server.
+      :secret: the secret the Server was started with
   """
   sock = None                   #: socket to server TCP connection
   server_addr = None            #: address of server
 
-  def __init__(self, server_addr):
+  def __init__(self, server_addr, secret=None):
+    self.codec = codec.Codec(secret)
     self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     self.sock.connect(server_addr)
     self.server_addr = server_addr
@@ -367,7 +341,7 @@ class Client(MessageSocket):
       Returns:
 
       """
-      resp = self._request('REG', reservation)
+      resp = _checked(self._request('REG', reservation))
       return resp
 
   def register_worker_finished(self):
@@ -382,16 +356,12 @@ class Client(MessageSocket):
 
   def await_all_workers_finished(self):
       """
-      Poll until all reservations completed, then return cluster_info.
+      Block until all workers registered as finished.
 
       Returns:
-
+          True
       """
-      done = False
-      while not done:
-          done = self._request('QUERY_DONE')
-          time.sleep(5)
-      return True
+      return _checked(self._request('AWAIT_DONE'))
 
   def get_reservations(self):
       """
@@ -404,13 +374,8 @@ class Client(MessageSocket):
       return cluster_info
 
   def await_reservations(self):
-      """Poll until all reservations completed, then return cluster_info."""
-      done = False
-      while not done:
-          done = self._request('QUERY')
-          time.sleep(1)
-      reservations = self.get_reservations()
-      return reservations
+      """Block until all reservations completed, then return cluster_info."""
+      return _checked(self._request('AWAIT'))
 
   def request_stop(self):
       """Request server stop."""
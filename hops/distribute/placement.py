@@ -0,0 +1,216 @@
+"""
+Topology aware construction of the cluster spec from the reservations of the executors.
+
+Executors are grouped by host and hosts by rack. The rack of an executor is the optional 'rack' of its reservation,
+and otherwise the /24 subnet of its IPv4 address. Hosts are ordered by rack and by the numeric value of their
+address, executors of a host by port, so the spec only depends on the set of reservations and not on the order they
+arrived in.
+
+The ring of a ring-allreduce visits all executors of a host one after the other and all hosts of a rack one after the
+other, so it crosses every host boundary and every rack boundary exactly once. Parameter servers are spread over the
+hosts: every host gets one before a host gets a second, and hosts of different racks take turns.
+
+All functions take reservations as dicts with the 'host_port' and optionally the 'rack' and 'gpus_present' of an
+executor, and can be called without a cluster:
+
+>>> from hops.distribute import placement
+>>> placement.ring_order([{'host_port': '10.0.0.10:2222'}, {'host_port': '10.0.0.9:2222'}, {'host_port': '10.0.0.10:2223'}])
+['10.0.0.9:2222', '10.0.0.10:2222', '10.0.0.10:2223']
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import socket
+
+
+def _split(host_port):
+  """
+  Args:
+      :host_port: 'host:port' of an executor
+
+  Returns:
+      the host and the port
+  """
+  host, port = host_port.rsplit(':', 1)
+  return host, port
+
+
+def _host_key(host):
+  """
+  Sort key of a host, IPv4 addresses sort by their numeric value so that 10.0.0.9 comes before 10.0.0.10.
+
+  Args:
+      :host: the host of an executor
+
+  Returns:
+      a sort key
+  """
+  try:
+    return (0, tuple(bytearray(socket.inet_aton(host))), '')
+  except (socket.error, ValueError):
+    return (1, (), host)
+
+
+def _port_key(port):
+  """
+  Args:
+      :port: the port of an executor
+
+  Returns:
+      a sort key
+  """
+  try:
+    return (0, int(port), '')
+  except ValueError:
+    return (1, 0, port)
+
+
+def rack(reservation):
+  """
+  The rack of an executor.
+
+  Args:
+      :reservation: dict with the 'host_port' and optionally the 'rack' of the executor
+
+  Returns:
+      the 'rack' of the reservation, the /24 subnet for IPv4 addresses and '' otherwise
+  """
+  if reservation.get('rack'):
+    return str(reservation['rack'])
+  host = _split(reservation['host_port'])[0]
+  if _host_key(host)[0] == 0:
+    return '.'.join(host.split('.')[:3])
+  return ''
+
+
+def _sort_key(reservation):
+  """
+  Args:
+      :reservation: dict with the 'host_port' and optionally the 'rack' of the executor
+
+  Returns:
+      sort key ordering executors by rack, host and port
+  """
+  host, port = _split(reservation['host_port'])
+  return rack(reservation), _host_key(host), _port_key(port)
+
+
+def group_by_host(reservations):
+  """
+  Groups co-located executors.
+
+  Args:
+      :reservations: list of dicts with the 'host_port' and optionally the 'rack' of every executor
+
+  Returns:
+      list of lists, the reservations of every host, in rack, host and port order
+  """
+  hosts = []
+  last = None
+  for reservation in sorted(reservations, key=_sort_key):
+    key = _sort_key(reservation)[:2]
+    if key != last:
+      hosts.append([])
+      last = key
+    hosts[-1].append(reservation)
+  return hosts
+
+
+def _round_robin(groups):
+  """
+  Interleaves lists, the first element of every list, then the second one and so on.
+
+  Args:
+      :groups: list of lists
+
+  Returns:
+      list of all elements
+  """
+  result = []
+  for i in range(max([len(group) for group in groups] or [0])):
+    for group in groups:
+      if i < len(group):
+        result.append(group[i])
+  return result
+
+
+def _spread(reservations):
+  """
+  Orders executors so that every prefix is spread as evenly as possible over the hosts and racks.
+
+  Args:
+      :reservations: list of dicts with the 'host_port' and optionally the 'rack' of every executor
+
+  Returns:
+      the reservations in spread order
+  """
+  racks = []
+  last = None
+  for host in group_by_host(reservations):
+    if rack(host[0]) != last:
+      racks.append([])
+      last = rack(host[0])
+    racks[-1].append(host)
+  return _round_robin(_round_robin(racks))
+
+
+def ring_order(reservations):
+  """
+  Orders the workers of a ring-allreduce so that the ring crosses as few host and rack boundaries as possible.
+
+  Args:
+      :reservations: list of dicts with the 'host_port' and optionally the 'rack' of every executor
+
+  Returns:
+      list of 'host:port' of the workers in ring order
+  """
+  return [reservation['host_port'] for host in group_by_host(reservations) for reservation in host]
+
+
+def cross_host_hops(ring):
+  """
+  Counts the neighbours of a ring that are on different hosts.
+
+  Args:
+      :ring: list of 'host:port' in ring order
+
+  Returns:
+      number of hops between hosts, including the one from the last worker back to the first one
+  """
+  if len(ring) < 2:
+    return 0
+  hosts = [_split(host_port)[0] for host_port in ring]
+  return sum(1 for i in range(len(hosts)) if hosts[i] != hosts[i - 1])
+
+
+def parameter_server_spec(reservations):
+  """
+  Assigns the roles of a parameter server cluster.
+
+  As many executors as requested the 'ps' task type become parameter servers, executors without GPUs first and spread
+  over the hosts. The first of the other executors with a GPU, in rack, host and port order, is the chief and the rest
+  are workers. Every executor gets a role.
+
+  Args:
+      :reservations: list of dicts with the 'task_type', the 'host_port', 'gpus_present' and optionally the 'rack' of
+                     every executor
+
+  Returns:
+      the cluster spec, dict with the lists 'chief', 'ps' and 'worker' of 'host:port'
+  """
+  num_ps = len([reservation for reservation in reservations if reservation['task_type'] == 'ps'])
+  # sorted is stable, the spread order is kept among executors with and without GPUs
+  candidates = sorted(_spread(reservations), key=lambda reservation: bool(reservation.get('gpus_present')))
+  ps = candidates[:num_ps]
+  ps_set = set(reservation['host_port'] for reservation in ps)
+  workers = sorted([reservation for reservation in reservations if reservation['host_port'] not in ps_set], key=_sort_key)
+  with_gpus = [reservation for reservation in workers if reservation.get('gpus_present')]
+
+  cluster_spec = {"chief": [], "ps": [reservation['host_port'] for reservation in sorted(ps, key=_sort_key)], "worker": []}
+  if workers:
+    chief = (with_gpus or workers)[0]
+    cluster_spec["chief"].append(chief['host_port'])
+    cluster_spec["worker"] = ring_order([reservation for reservation in workers if reservation is not chief])
+  return cluster_spec
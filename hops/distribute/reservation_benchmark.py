@@ -0,0 +1,292 @@
+"""
+Microbenchmark of the cluster bring-up barrier of the reservation server.
+
+Simulated workers are threads on localhost that register with an allreduce_reservation.Server and wait for the cluster
+spec, once with the blocking AWAIT barrier and once polling QUERY every second, as the clients did before. The barrier
+latency is the time from the last registration until every worker has the cluster spec.
+
+    python -m hops.distribute.reservation_benchmark 8 64 256
+
+The load test keeps hundreds of executors connected at once, more sockets than select supports, each sending a stream of
+requests, and sends one large message to check that receiving it is linear in its size.
+
+    python -m hops.distribute.reservation_benchmark --load 1000
+
+The codec benchmark compares the encode and decode throughput of the JSON wire format, with and without HMAC, to the
+pickle framing the servers used before.
+
+    python -m hops.distribute.reservation_benchmark --codec
+
+The placement benchmark builds cluster specs from synthetic reservations arriving in random order on hosts spread over
+racks, and compares the placement module to sorting workers by address and assigning parameter servers in arrival
+order.
+
+    python -m hops.distribute.reservation_benchmark --placement 32 4 4
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import pickle
+import random
+import struct
+import sys
+import threading
+import time
+
+from . import allreduce_reservation
+from . import codec
+from . import placement
+
+
+def _poll_reservations(client):
+  """
+  The polling barrier of the clients before AWAIT.
+
+  Args:
+      :client: the allreduce_reservation.Client
+
+  Returns:
+      the cluster info
+  """
+  while not client._request('QUERY'):
+    time.sleep(1)
+  return client.get_reservations()
+
+
+def _run_barrier(num_workers, polling=False):
+  """
+  Brings up a simulated cluster once.
+
+  Args:
+      :num_workers: number of simulated workers
+      :polling: True to wait with QUERY polling instead of AWAIT
+
+  Returns:
+      barrier latency and total time of the bring-up in seconds
+  """
+  server = allreduce_reservation.Server(num_workers)
+  server_addr = server.start()
+  registered = [0.0] * num_workers
+  released = [0.0] * num_workers
+  errors = []
+
+  def _worker(index):
+    try:
+      client = allreduce_reservation.Client(server_addr)
+      client.register({'index': index, 'worker': '127.0.0.1:' + str(20000 + index)})
+      registered[index] = time.time()
+      if polling:
+        cluster = _poll_reservations(client)
+      else:
+        cluster = client.await_reservations()
+      released[index] = time.time()
+      assert len(cluster['cluster']['worker']) == num_workers
+      client.close()
+    except Exception as e:
+      errors.append(e)
+
+  start = time.time()
+  threads = [threading.Thread(target=_worker, args=(index,)) for index in range(num_workers)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  server.stop()
+
+  if errors:
+    raise errors[0]
+  return max(released) - max(registered), max(released) - start
+
+
+def _benchmark(workers=(8, 64, 256), repeats=3):
+  """
+  Compares the barrier latency of AWAIT and QUERY polling.
+
+  Args:
+      :workers: numbers of simulated workers
+      :repeats: bring-ups per number of workers and protocol, the median is reported
+
+  Returns:
+      list of dicts with the number of workers, the protocol and the median latency and total time
+  """
+  results = []
+  for num_workers in workers:
+    for polling in (False, True):
+      runs = sorted(_run_barrier(num_workers, polling=polling) for _ in range(repeats))
+      latency, total = runs[len(runs) // 2]
+      results.append({'workers': num_workers, 'protocol': 'poll' if polling else 'await', 'latency': latency, 'total': total})
+      print('{0:>5} workers {1:>6}: barrier latency {2:8.4f}s, bring-up {3:8.4f}s'.format(
+        num_workers, 'poll' if polling else 'await', latency, total))
+  return results
+
+
+def _load_test(num_clients=500, requests=20, message_size=64*1024*1024):
+  """
+  Keeps ``num_clients`` connections open, every client sending ``requests`` requests, then round trips one large
+  message.
+
+  Args:
+      :num_clients: number of simulated executors
+      :requests: number of requests per executor
+      :message_size: size in bytes of the large message
+
+  Returns:
+      dict with the requests per second and the seconds of the large message round trip
+  """
+  server = allreduce_reservation.Server(num_clients)
+  server_addr = server.start()
+  clients = [allreduce_reservation.Client(server_addr) for _ in range(num_clients)]
+  errors = []
+
+  def _executor(index):
+    try:
+      client = clients[index]
+      client.register({'index': index, 'worker': '127.0.0.1:' + str(20000 + index)})
+      for _ in range(requests - 1):
+        client._request('QUERY')
+    except Exception as e:
+      errors.append(e)
+
+  start = time.time()
+  threads = [threading.Thread(target=_executor, args=(index,)) for index in range(num_clients)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  elapsed = time.time() - start
+  if errors:
+    raise errors[0]
+  cluster = clients[0].get_reservations()
+  assert len(cluster['cluster']['worker']) == num_clients
+  for client in clients:
+    client.close()
+  server.stop()
+  print('{0:>5} executors: {1:.0f} requests/s'.format(num_clients, num_clients * requests / elapsed))
+
+  # a single worker with a huge address, its reservation goes to the server and back
+  server = allreduce_reservation.Server(1)
+  client = allreduce_reservation.Client(server.start())
+  start = time.time()
+  client.register({'index': 0, 'worker': 'x' * message_size + ':1'})
+  cluster = client.get_reservations()
+  round_trip = time.time() - start
+  assert len(cluster['cluster']['worker'][0]) == message_size + 2
+  client.close()
+  server.stop()
+  print('{0:>5} MB message round trip: {1:.3f}s'.format(message_size // (1024 * 1024), round_trip))
+
+  return {'requests_per_second': num_clients * requests / elapsed, 'round_trip': round_trip}
+
+
+def _codec_benchmark(iterations=20000):
+  """
+  Measures messages per second encoded and decoded with pickle framing and with the codec.
+
+  Args:
+      :iterations: number of messages encoded and decoded per message kind and format
+
+  Returns:
+      list of dicts with the message kind, the format, its size and encoded and decoded messages per second
+  """
+  header = struct.Struct('>I')
+
+  def _pickle_frame(msg):
+    data = pickle.dumps(msg)
+    return header.pack(len(data)) + data
+
+  def _pickle_decode(frame):
+    return pickle.loads(frame[header.size:])
+
+  plain = codec.Codec()
+  signed = codec.Codec(codec.new_secret())
+  formats = [('pickle', _pickle_frame, _pickle_decode),
+             ('json', plain.frame, lambda frame: plain.decode(frame[header.size:])),
+             ('json+hmac', signed.frame, lambda frame: signed.decode(frame[header.size:]))]
+  messages = [('REG', {'type': 'REG', 'data': {'index': 17, 'worker': '10.0.0.17:41234'}}),
+              ('QINFO 256', {'cluster': {'worker': ['10.0.0.' + str(i) + ':41234' for i in range(256)]}}),
+              ('METRIC', {'type': 'METRIC', 'data': {'id': 3, 'name': 'lr=0.01.layers=4', 'step': 1200,
+                                                     'metrics': {'loss': 0.2345, 'accuracy': 0.9321}}})]
+
+  results = []
+  for kind, msg in messages:
+    for name, encode, decode in formats:
+      start = time.time()
+      for _ in range(iterations):
+        frame = encode(msg)
+      encoded = iterations / (time.time() - start)
+      start = time.time()
+      for _ in range(iterations):
+        decode(frame)
+      decoded = iterations / (time.time() - start)
+      assert decode(frame) == msg
+      results.append({'message': kind, 'format': name, 'size': len(frame), 'encode': encoded, 'decode': decoded})
+      print('{0:>10} {1:>10}: {2:6d} bytes, encode {3:9.0f} msg/s, decode {4:9.0f} msg/s'.format(
+        kind, name, len(frame), encoded, decoded))
+  return results
+
+
+def _placement_benchmark(num_hosts=32, executors_per_host=4, num_racks=4, num_ps=8, seed=1):
+  """
+  Compares the placement module to the previous cluster spec construction on a synthetic cluster.
+
+  Hosts have an address on one subnet and an explicit rack, and the reservations arrive in random order. Before, the
+  parameter servers were the executors requesting the ps task type in arrival order.
+
+  Args:
+      :num_hosts: number of hosts
+      :executors_per_host: executors on every host
+      :num_racks: number of racks the hosts are spread over
+      :num_ps: number of parameter servers
+      :seed: seed of the arrival order
+
+  Returns:
+      dict with the hops between racks of the allreduce ring and the most parameter servers on one host, before and
+      with the placement module
+  """
+  rng = random.Random(seed)
+  hosts = ['10.0.0.' + str(i + 1) for i in range(num_hosts)]
+  reservations = [{'host_port': host + ':' + str(40000 + rng.randint(0, 20000)), 'rack': 'rack' + str(i % num_racks)}
+                  for i, host in enumerate(hosts) for _ in range(executors_per_host)]
+  # spark numbers the executors of a host one after the other, the first num_ps executors request the ps task type
+  for i, reservation in enumerate(reservations):
+    reservation['task_type'] = 'ps' if i < num_ps else 'worker'
+    reservation['gpus_present'] = False
+  rng.shuffle(reservations)
+  racks = dict((reservation['host_port'], placement.rack(reservation)) for reservation in reservations)
+
+  def _rack_hops(ring):
+    return sum(1 for i in range(len(ring)) if racks[ring[i]] != racks[ring[i - 1]])
+
+  def _max_ps_per_host(ps):
+    counts = {}
+    for host_port in ps:
+      host = host_port.split(':')[0]
+      counts[host] = counts.get(host, 0) + 1
+    return max(counts.values())
+
+  old_ring = sorted([reservation['host_port'] for reservation in reservations], key=lambda x: str(x.split(':')[0]))
+  new_ring = placement.ring_order(reservations)
+  old_ps = [reservation['host_port'] for reservation in reservations if reservation['task_type'] == 'ps']
+  new_ps = placement.parameter_server_spec(reservations)['ps']
+
+  result = {'ring_rack_hops': (_rack_hops(old_ring), _rack_hops(new_ring)),
+            'ring_host_hops': (placement.cross_host_hops(old_ring), placement.cross_host_hops(new_ring)),
+            'max_ps_per_host': (_max_ps_per_host(old_ps), _max_ps_per_host(new_ps))}
+  for key, (old, new) in sorted(result.items()):
+    print('{0:>16}: {1:5d} before, {2:5d} with placement'.format(key, old, new))
+  return result
+
+
+if __name__ == "__main__":
+  if len(sys.argv) > 1 and sys.argv[1] == '--load':
+    _load_test(*[int(arg) for arg in sys.argv[2:]])
+  elif len(sys.argv) > 1 and sys.argv[1] == '--placement':
+    _placement_benchmark(*[int(arg) for arg in sys.argv[2:]])
+  elif len(sys.argv) > 1 and sys.argv[1] == '--codec':
+    _codec_benchmark(*[int(arg) for arg in sys.argv[2:]])
+  elif len(sys.argv) > 1:
+    _benchmark([int(arg) for arg in sys.argv[1:]])
+  else:
+    _benchmark()
@@ -7,7 +7,7 @@ Whenever a function to run an experiment is invoked it is also registered in the
 
 *Three different types of experiments*
     - Run a single standalone Experiment using the *launch* function.
-    - Run Parallel Experiments performing hyperparameter optimization using *grid_search* or *differential_evolution*.
+    - Run Parallel Experiments performing hyperparameter optimization using *grid_search*, *random_search*, *differential_evolution* or *bayesian_optimization*.
     - Run single or multi-machine Distributed Training using *parameter_server* or *collective_all_reduce*.
 
 """
@@ -15,6 +15,7 @@ Whenever a function to run an experiment is invoked it is also registered in the
 from hops import hdfs as hopshdfs
 
 from hops import differential_evolution as diff_evo
+from hops import bayesian_optimization as bayes_opt
 from hops import grid_search as gs
 from hops import launcher as launcher
 from hops import random_search as r_search
@@ -23,6 +24,8 @@ from hops.distribute import parameter_server as ps
 from hops.distribute import mirrored as mirrored_impl
 
 from hops import tensorboard
+from hops import trial_scheduler
+from hops import metrics as hopsmetrics
 
 from hops import util
 
@@ -225,11 +228,11 @@ def launch(map_fun, args_dict=None, name='no-name', local_logdir=False, versione
         retval, tensorboard_logdir = launcher._launch(sc, map_fun, args_dict, local_logdir)
 
         if retval:
-            experiment_json = util._finalize_experiment(experiment_json, None, retval)
+            experiment_json = util._finalize_experiment(experiment_json, None, retval, telemetry=hopsmetrics._telemetry())
             util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
             return tensorboard_logdir
 
-        experiment_json = util._finalize_experiment(experiment_json, None, None)
+        experiment_json = util._finalize_experiment(experiment_json, None, None, telemetry=hopsmetrics._telemetry())
 
         util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
 
@@ -244,13 +247,15 @@ def launch(map_fun, args_dict=None, name='no-name', local_logdir=False, versione
     return tensorboard_logdir
 
 
-def random_search(map_fun, boundary_dict, direction='max', samples=10, name='no-name', local_logdir=False, versioned_resources=None, description=None):
+def random_search(map_fun, boundary_dict, direction='max', samples=10, name='no-name', local_logdir=False, versioned_resources=None, description=None, scheduler=None, dataset_version=None, trials_per_task=1, retries=0, sampler='random'):
     """
 
     *Parallel Experiment*
 
     Run an Experiment contained in *map_fun* for configured number of random samples controlled by the *samples* parameter. Each hyperparameter is contained in *boundary_dict* with the key
     corresponding to the name of the hyperparameter and a list containing two elements defining the lower and upper bound.
+    A third element 'log' samples the hyperparameter on a log scale, a fourth element quantizes it to steps of that size,
+    and any other list is a set of categories, see *random_search*.
     The experiment must return a metric corresponding to how 'good' the given hyperparameter combination is.
 
     Example usage:
@@ -268,11 +273,16 @@ def random_search(map_fun, boundary_dict, direction='max', samples=10, name='no-
         :map_fun: The function to run
         :boundary_dict: dict containing hyperparameter name and corresponding boundaries, each experiment randomize a value in the boundary range.
         :direction: If set to 'max' the highest value returned will correspond to the best solution, if set to 'min' the opposite is true
-        :samples: the number of random samples to evaluate for each hyperparameter given the boundaries
+        :samples: the number of random samples to evaluate for each hyperparameter given the boundaries, duplicate samples are replaced so the combinations are distinct
         :name: name of the experiment
         :local_logdir: True if *tensorboard.logdir()* should be in the local filesystem, otherwise it is in HDFS
         :versioned_resources: A list of HDFS paths of resources to version with this experiment
         :description: A longer description for the experiment
+        :scheduler: a *trial_scheduler* scheduler, e.g. *trial_scheduler.ASHAScheduler()*, to pull trials asynchronously and stop underperforming ones early based on the metrics reported with *report*
+        :dataset_version: version of the training data, if given results of trials stored by earlier experiments with the same function, hyperparameters and dataset_version are reused instead of running the trials again, see *trial_store*
+        :trials_per_task: number of trials run after each other in one Spark task, packing several short trials into a task saves the scheduling and setup overhead of a task per trial
+        :retries: number of times a trial is run again after it raised an exception. A trial that fails on every attempt is recorded as failed with its traceback in the file *error* of its directory and the experiment continues without it
+        :sampler: 'random' for independent random samples, 'halton' or 'sobol' for a quasi-random sequence that covers the search space more evenly
 
     Returns:
         HDFS path in your project where the experiment is stored
@@ -307,9 +317,9 @@ def random_search(map_fun, boundary_dict, direction='max', samples=10, name='no-
 
         util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
 
-        tensorboard_logdir, param, metric = r_search._launch(sc, map_fun, boundary_dict, samples, direction=direction, local_logdir=local_logdir)
+        tensorboard_logdir, param, metric = r_search._launch(sc, map_fun, boundary_dict, samples, direction=direction, local_logdir=local_logdir, name=name, scheduler=scheduler, dataset_version=dataset_version, trials_per_task=trials_per_task, retries=retries, sampler=sampler)
 
-        experiment_json = util._finalize_experiment(experiment_json, param, metric)
+        experiment_json = util._finalize_experiment(experiment_json, param, metric, telemetry=hopsmetrics._telemetry())
 
         util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
 
@@ -326,7 +336,87 @@ def random_search(map_fun, boundary_dict, direction='max', samples=10, name='no-
     return tensorboard_logdir
 
 
-def differential_evolution(objective_function, boundary_dict, direction = 'max', generations=10, population=10, mutation=0.5, crossover=0.7, cleanup_generations=False, name='no-name', local_logdir=False, versioned_resources=None, description=None):
+def bayesian_optimization(map_fun, boundary_dict, direction='max', samples=10, initial_samples=None, name='no-name', local_logdir=False, versioned_resources=None, description=None, dataset_version=None, retries=0):
+    """
+
+    *Parallel Experiment*
+
+    Run Bayesian optimization to find the best hyperparameter combination with as few trials as possible. A Gaussian process
+    models the metric returned by *map_fun*, and each new trial runs the combination with the highest expected improvement.
+    A new combination is proposed as soon as an executor is free, so all executors stay busy.
+
+    Example usage:
+
+    >>> from hops import experiment
+    >>> boundary_dict = {'learning_rate': [0.0001, 0.1, 'log'], 'layers': [2, 9], 'activation': ['relu', 'tanh']}
+    >>> def train_nn(learning_rate, layers, activation):
+    >>>    import tensorflow
+    >>>    # code for preprocessing, training and exporting model
+    >>>    # mandatory return a value for the experiment which is registered in Experiments service
+    >>>    return network.evaluate(learning_rate, layers, activation)
+    >>> experiment.bayesian_optimization(train_nn, boundary_dict, samples=30, direction='max')
+
+    Args:
+        :map_fun: The function to run
+        :boundary_dict: dict containing hyperparameter name and corresponding boundaries, [lower, upper] with two ints or two floats, [lower, upper, 'log'] to search on a log scale, or a list of categories
+        :direction: If set to 'max' the highest value returned will correspond to the best solution, if set to 'min' the opposite is true
+        :samples: the number of trials to run
+        :initial_samples: the number of random trials before the Gaussian process is used, defaults to the number of hyperparameters + 1 and at least 4
+        :name: name of the experiment
+        :local_logdir: True if *tensorboard.logdir()* should be in the local filesystem, otherwise it is in HDFS
+        :versioned_resources: A list of HDFS paths of resources to version with this experiment
+        :description: A longer description for the experiment
+        :dataset_version: version of the training data, if given results of trials stored by earlier experiments with the same function, hyperparameters and dataset_version are reused instead of running the trials again, see *trial_store*
+        :retries: number of times a trial is run again after it raised an exception. A trial that fails on every attempt is recorded as failed with its traceback in the file *error* of its directory and the experiment continues without it
+
+    Returns:
+        HDFS path in your project where the experiment is stored
+
+    """
+
+    num_ps = util.num_param_servers()
+    assert num_ps == 0, "number of parameter servers should be 0"
+
+    global running
+    if running:
+        raise RuntimeError("An experiment is currently running. Please call experiment.end() to stop it.")
+
+    try:
+        global app_id
+        global experiment_json
+        global elastic_id
+        running = True
+
+        sc = util._find_spark().sparkContext
+        app_id = str(sc.applicationId)
+
+        bayes_opt.run_id = bayes_opt.run_id + 1
+
+        versioned_path = util._version_resources(versioned_resources, bayes_opt._get_logdir(app_id))
+
+        experiment_json = util._populate_experiment(sc, name, 'experiment', 'bayesian_optimization', bayes_opt._get_logdir(app_id), json.dumps(boundary_dict), versioned_path, description)
+
+        util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
+
+        tensorboard_logdir, param, metric = bayes_opt._launch(sc, map_fun, boundary_dict, samples, direction=direction, initial_samples=initial_samples, local_logdir=local_logdir, name=name, dataset_version=dataset_version, retries=retries)
+
+        experiment_json = util._finalize_experiment(experiment_json, param, metric, telemetry=hopsmetrics._telemetry())
+
+        util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
+
+    except:
+        _exception_handler()
+        raise
+    finally:
+        #cleanup spark jobs
+        elastic_id +=1
+        running = False
+        sc.setJobGroup("", "")
+
+    return tensorboard_logdir
+
+
+def differential_evolution(objective_function, boundary_dict, direction = 'max', generations=10, population=10, mutation=0.5, crossover=0.7, cleanup_generations=False, name='no-name', local_logdir=False, versioned_resources=None, description=None, strategy='rand/1/bin', asynchronous=False, dataset_version=None, trials_per_task=1, retries=0):
     """
     *Parallel Experiment*
 
@@ -358,6 +448,11 @@ def differential_evolution(objective_function, boundary_dict, direction = 'max',
         :local_logdir: True if *tensorboard.logdir()* should be in the local filesystem, otherwise it is in HDFS
         :versioned_resources: A list of HDFS paths of resources to version with this experiment
         :description: a longer description for the experiment
+        :strategy: how new hyperparameter combinations are created, 'rand/1/bin' from random members of the population, 'best/1/bin' around the best one, or 'current-to-best/1/bin' moving every member towards the best one
+        :asynchronous: True to create a new hyperparameter combination as soon as an executor is free instead of waiting for the whole generation, the best combinations found are selected as their metrics arrive
+        :dataset_version: version of the training data, if given results of trials stored by earlier experiments with the same function, hyperparameters and dataset_version are reused instead of running the trials again, see *trial_store*
+        :trials_per_task: number of trials run after each other in one Spark task, packing several short trials into a task saves the scheduling and setup overhead of a task per trial
+        :retries: number of times a trial is run again after it raised an exception. A trial that fails on every attempt is recorded as failed with its traceback in the file *error* of its directory and the experiment continues without it
 
     Returns:
         HDFS path in your project where the experiment is stored, dict with best hyperparameters
@@ -389,9 +484,9 @@ def differential_evolution(objective_function, boundary_dict, direction = 'max',
 
         util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
 
-        tensorboard_logdir, best_param, best_metric = diff_evo._search(spark, objective_function, boundary_dict, direction=direction, generations=generations, popsize=population, mutation=mutation, crossover=crossover, cleanup_generations=cleanup_generations, local_logdir=local_logdir, name=name)
+        tensorboard_logdir, best_param, best_metric = diff_evo._search(spark, objective_function, boundary_dict, direction=direction, generations=generations, popsize=population, mutation=mutation, crossover=crossover, cleanup_generations=cleanup_generations, local_logdir=local_logdir, name=name, strategy=strategy, asynchronous=asynchronous, dataset_version=dataset_version, trials_per_task=trials_per_task, retries=retries)
 
-        experiment_json = util._finalize_experiment(experiment_json, best_param, best_metric)
+        experiment_json = util._finalize_experiment(experiment_json, best_param, best_metric, telemetry=hopsmetrics._telemetry())
 
         util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
 
@@ -408,7 +503,7 @@ def differential_evolution(objective_function, boundary_dict, direction = 'max',
 
     return tensorboard_logdir, best_param_dict
 
-def grid_search(map_fun, args_dict, direction='max', name='no-name', local_logdir=False, versioned_resources=None, description=None):
+def grid_search(map_fun, args_dict, direction='max', name='no-name', local_logdir=False, versioned_resources=None, description=None, scheduler=None, dataset_version=None, trials_per_task=1, retries=0):
     """
     *Parallel Experiment*
 
@@ -442,6 +537,10 @@ def grid_search(map_fun, args_dict, direction='max', name='no-name', local_logdi
         :local_logdir: True if *tensorboard.logdir()* should be in the local filesystem, otherwise it is in HDFS
         :versioned_resources: A list of HDFS paths of resources to version with this experiment
         :description: a longer description for the experiment
+        :scheduler: a *trial_scheduler* scheduler, e.g. *trial_scheduler.ASHAScheduler()*, to pull trials asynchronously and stop underperforming ones early based on the metrics reported with *report*
+        :dataset_version: version of the training data, if given results of trials stored by earlier experiments with the same function, hyperparameters and dataset_version are reused instead of running the trials again, see *trial_store*
+        :trials_per_task: number of trials run after each other in one Spark task, packing several short trials into a task saves the scheduling and setup overhead of a task per trial
+        :retries: number of times a trial is run again after it raised an exception. A trial that fails on every attempt is recorded as failed with its traceback in the file *error* of its directory and the experiment continues without it
 
     Returns:
         HDFS path in your project where the experiment is stored
@@ -476,9 +575,9 @@ def grid_search(map_fun, args_dict, direction='max', name='no-name', local_logdi
 
         grid_params = util.grid_params(args_dict)
 
-        tensorboard_logdir, param, metric = gs._grid_launch(sc, map_fun, grid_params, direction=direction, local_logdir=local_logdir, name=name)
+        tensorboard_logdir, param, metric = gs._grid_launch(sc, map_fun, grid_params, direction=direction, local_logdir=local_logdir, name=name, scheduler=scheduler, dataset_version=dataset_version, trials_per_task=trials_per_task, retries=retries)
 
-        experiment_json = util._finalize_experiment(experiment_json, param, metric)
+        experiment_json = util._finalize_experiment(experiment_json, param, metric, telemetry=hopsmetrics._telemetry())
 
         util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
     except:
@@ -492,7 +591,7 @@ def grid_search(map_fun, args_dict, direction='max', name='no-name', local_logdi
 
     return tensorboard_logdir
 
-def collective_all_reduce(map_fun, name='no-name', local_logdir=False, versioned_resources=None, description=None):
+def collective_all_reduce(map_fun, name='no-name', local_logdir=False, versioned_resources=None, description=None, elastic=False, heartbeat_timeout=10, abort_grace=10):
     """
     *Distributed Training*
 
@@ -500,6 +599,12 @@ def collective_all_reduce(map_fun, name='no-name', local_logdir=False, versioned
 
     TF_CONFIG is exported in the background and does not need to be set by the user themselves.
 
+    Executors send heartbeats to the driver. When an executor fails or stops sending heartbeats for *heartbeat_timeout*
+    seconds, the tasks of all executors are aborted and the experiment fails within seconds. With *elastic* the cluster
+    is instead re-formed from the surviving executors and the replacements Spark retries the failed tasks on, and the
+    training resumes from the last checkpoint in *tensorboard.logdir()*. Every re-formation costs each task one of its
+    *spark.task.maxFailures* attempts, and the cluster can no longer be re-formed once an executor finished its task.
+
     Example usage:
 
     >>> from hops import experiment
@@ -517,6 +622,9 @@ def collective_all_reduce(map_fun, name='no-name', local_logdir=False, versioned
         :local_logdir: True if *tensorboard.logdir()* should be in the local filesystem, otherwise it is in HDFS
         :versioned_resources: A list of HDFS paths of resources to version with this experiment
         :description: a longer description for the experiment
+        :elastic: True to re-form the cluster and resume from the last checkpoint when an executor fails
+        :heartbeat_timeout: seconds without a heartbeat after which an executor is considered failed
+        :abort_grace: seconds an executor aborted after a failure has to return from map_fun before its python worker exits, None to never exit
 
     Returns:
         HDFS path in your project where the experiment is stored
@@ -552,9 +660,9 @@ def collective_all_reduce(map_fun, name='no-name', local_logdir=False, versioned
 
         util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
 
-        retval, logdir = tf_allreduce._launch(sc, map_fun, local_logdir=local_logdir, name=name)
+        retval, logdir = tf_allreduce._launch(sc, map_fun, local_logdir=local_logdir, name=name, elastic=elastic, heartbeat_timeout=heartbeat_timeout, abort_grace=abort_grace)
 
-        experiment_json = util._finalize_experiment(experiment_json, None, retval)
+        experiment_json = util._finalize_experiment(experiment_json, None, retval, telemetry=hopsmetrics._telemetry())
 
         util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
     except:
@@ -568,7 +676,7 @@ def collective_all_reduce(map_fun, name='no-name', local_logdir=False, versioned
 
     return logdir
 
-def parameter_server(map_fun, name='no-name', local_logdir=False, versioned_resources=None, description=None):
+def parameter_server(map_fun, name='no-name', local_logdir=False, versioned_resources=None, description=None, elastic=False, heartbeat_timeout=10, abort_grace=10):
     """
     *Distributed Training*
 
@@ -576,6 +684,12 @@ def parameter_server(map_fun, name='no-name', local_logdir=False, versioned_reso
 
     TF_CONFIG is exported in the background and does not need to be set by the user themselves.
 
+    Executors send heartbeats to the driver. When an executor fails or stops sending heartbeats for *heartbeat_timeout*
+    seconds, the tasks of all executors are aborted and the experiment fails within seconds. With *elastic* the cluster
+    is instead re-formed from the surviving executors and the replacements Spark retries the failed tasks on, and the
+    training resumes from the last checkpoint in *tensorboard.logdir()*. Every re-formation costs each task one of its
+    *spark.task.maxFailures* attempts, and the cluster can no longer be re-formed once an executor finished its task.
+
     Example usage:
 
     >>> from hops import experiment
@@ -593,6 +707,9 @@ def parameter_server(map_fun, name='no-name', local_logdir=False, versioned_reso
         :local_logdir: True if *tensorboard.logdir()* should be in the local filesystem, otherwise it is in HDFS
         :versioned_resources: A list of HDFS paths of resources to version with this experiment
         :description: a longer description for the experiment
+        :elastic: True to re-form the cluster and resume from the last checkpoint when an executor fails
+        :heartbeat_timeout: seconds without a heartbeat after which an executor is considered failed
+        :abort_grace: seconds an executor aborted after a failure has to return from map_fun before its python worker exits, None to never exit
 
     Returns:
         HDFS path in your project where the experiment is stored
@@ -627,9 +744,9 @@ def parameter_server(map_fun, name='no-name', local_logdir=False, versioned_reso
 
         util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
 
-        retval, logdir = ps._launch(sc, map_fun, local_logdir=local_logdir, name=name)
+        retval, logdir = ps._launch(sc, map_fun, local_logdir=local_logdir, name=name, elastic=elastic, heartbeat_timeout=heartbeat_timeout, abort_grace=abort_grace)
 
-        experiment_json = util._finalize_experiment(experiment_json, None, retval)
+        experiment_json = util._finalize_experiment(experiment_json, None, retval, telemetry=hopsmetrics._telemetry())
 
         util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
     except:
@@ -643,10 +760,15 @@ def parameter_server(map_fun, name='no-name', local_logdir=False, versioned_reso
 
     return logdir
 
-def mirrored(map_fun, name='no-name', local_logdir=False, versioned_resources=None, description=None):
+def mirrored(map_fun, name='no-name', local_logdir=False, versioned_resources=None, description=None, num_executors=1):
     """
     *Distributed Training* single machine - multiple GPUs
 
+    With *num_executors* larger than 1 every executor mirrors over its local GPUs and the executors all-reduce across
+    each other, TF_CONFIG is exported in the background. Create the strategy with *mirrored.strategy()* and the model code
+    is the same for one and for several executors. Without GPUs the executors train on their CPUs, so a local Spark with
+    several worker threads, e.g. local[2], runs the multi executor mode on one machine.
+
     Example usage:
 
     >>> from hops import experiment
@@ -654,9 +776,10 @@ def mirrored(map_fun, name='no-name', local_logdir=False, versioned_resources=No
     >>>    import tensorflow
     >>>    from hops import tensorboard
     >>>    from hops import devices
+    >>>    from hops.distribute import mirrored
     >>>    logdir = tensorboard.logdir()
-    >>>    ...MirroredStrategy()...
-    >>> experiment.mirrored(mirrored_training)
+    >>>    ...strategy = mirrored.strategy()...
+    >>> experiment.mirrored(mirrored_training, num_executors=4)
 
     Args:
         :map_fun: contains the code where you are using MirroredStrategy.
@@ -664,6 +787,7 @@ def mirrored(map_fun, name='no-name', local_logdir=False, versioned_resources=No
         :local_logdir: True if *tensorboard.logdir()* should be in the local filesystem, otherwise it is in HDFS
         :versioned_resources: A list of HDFS paths of resources to version with this experiment
         :description: a longer description for the experiment
+        :num_executors: number of executors to mirror across, each one mirrors over its local GPUs
 
     Returns:
         HDFS path in your project where the experiment is stored
@@ -672,6 +796,7 @@ def mirrored(map_fun, name='no-name', local_logdir=False, versioned_resources=No
 
     num_ps = util.num_param_servers()
     assert num_ps == 0, "number of parameter servers should be 0"
+    assert num_executors > 0, "number of executors should be greater than 0"
 
     global running
     if running:
@@ -696,9 +821,9 @@ def mirrored(map_fun, name='no-name', local_logdir=False, versioned_resources=No
 
         util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
 
-        retval, logdir = mirrored_impl._launch(sc, map_fun, local_logdir=local_logdir, name=name)
+        retval, logdir = mirrored_impl._launch(sc, map_fun, local_logdir=local_logdir, name=name, num_executors=num_executors)
 
-        experiment_json = util._finalize_experiment(experiment_json, None, retval)
+        experiment_json = util._finalize_experiment(experiment_json, None, retval, telemetry=hopsmetrics._telemetry())
 
         util._put_elastic(hopshdfs.project_name(), app_id, elastic_id, experiment_json)
     except:
@@ -712,6 +837,46 @@ def mirrored(map_fun, name='no-name', local_logdir=False, versioned_resources=No
 
     return logdir
 
+def report(step, metric=None, **metrics):
+    """
+    Report metrics from inside the function of any experiment. The metrics are sent to the driver as they are reported
+    and collected in a table, see *reported_metrics*. If a *grid_search* or *random_search* runs with a scheduler, the
+    scheduler uses them to stop underperforming trials early.
+
+    >>> from hops import experiment
+    >>> def train_nn(learning_rate, dropout):
+    >>>    for epoch in range(1, 28):
+    >>>        loss, accuracy = network.train_epoch(learning_rate, dropout)
+    >>>        experiment.report(epoch, accuracy, loss=loss)
+    >>>    return accuracy
+
+    Args:
+        :step: the step, e.g. the epoch, the metrics were computed at
+        :metric: the metric that is maximized or minimized, reported as 'metric'
+        :metrics: any other named metrics
+
+    Raises:
+        trial_scheduler.TrialStopped when the trial should stop, it is handled by the experiment and should not be caught
+    """
+    if metric is not None:
+        metrics['metric'] = metric
+    if hopsmetrics.report(step, **metrics) == trial_scheduler.STOP:
+        raise trial_scheduler.TrialStopped('stopped at step ' + str(step))
+
+def reported_metrics(trial=None):
+    """
+    Get the metrics reported with *report* by the running experiment, or by the last one if none is running
+
+    Args:
+        :trial: only return the metrics of this trial, e.g. 'learning_rate=0.1.dropout=0.4'
+
+    Returns:
+        list of dicts with the 'trial', 'step', 'time' and the reported metrics, in the order they were received
+    """
+    if hopsmetrics.table is None:
+        return []
+    return hopsmetrics.table.rows(trial=trial)
+
 def _exception_handler():
     """
 
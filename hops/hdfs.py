@@ -12,59 +12,116 @@ import stat as local_stat
 import fnmatch
 import os
 import errno
+import time
+import hashlib
+import fcntl
+import re
+import threading
+import json
+import sys
+from collections import deque
+from multiprocessing.pool import ThreadPool
 import pydoop.hdfs.path as path
+from hops import constants
 
 fd = None
+_shipper = None
+
+# Records the log shipper buffers in memory, once it is full log waits for the shipper to write
+LOG_BUFFER_SIZE = 10000
+# The shipper writes the buffered records once they reach this many bytes...
+LOG_FLUSH_SIZE = 1024 * 1024
+# ...or once the oldest of them waited this many seconds
+LOG_FLUSH_INTERVAL = 2.0
+# Seconds log waits for room in a full buffer before it drops the oldest record
+LOG_BACKPRESSURE_TIMEOUT = 0.1
+
+# Number of files (or file chunks) transferred in parallel by copy_to_hdfs, copy_to_local and localize
+TRANSFER_CONCURRENCY = 16
+# Files larger than this are downloaded as several ranged reads in parallel
+TRANSFER_CHUNK_SIZE = 64 * 1024 * 1024
+# Size of each read/write issued against HDFS or the local filesystem during a transfer
+TRANSFER_BUFFER_SIZE = 4 * 1024 * 1024
+# Number of times a failed file (or chunk) transfer is retried before the whole transfer fails
+TRANSFER_RETRIES = 3
+
+# Directory below $PDIR where localize keeps files and directories shared by all processes on the host
+LOCALIZATION_CACHE_DIR = '.localization_cache'
+# Disk budget of the localization cache in bytes, least recently used entries are evicted to stay below it.
+# Can be overridden with the HOPS_LOCALIZATION_CACHE_SIZE environment variable.
+LOCALIZATION_CACHE_SIZE = 20 * 1024 * 1024 * 1024
+
+# Number of directory listings issued in parallel by stat_many and exists_many
+METADATA_CONCURRENCY = 16
+# Seconds a path info fetched by stat_many, exists_many and the glob helpers is reused before asking the NameNode again.
+# Only existing paths are cached, and exists, isdir and isfile always ask the NameNode.
+STAT_CACHE_TTL = 2.0
+
+# normalized path -> (expiry time, path info)
+_stat_cache = {}
+_stat_cache_lock = threading.Lock()
+# project name -> absolute project path
+_project_paths = {}
+
+# Lock files of the cache entries used by this process, keeping them open (and share-locked) pins the entries
+_localization_pins = {}
 
 
 class FsTree(object):
+    """
+    Compares a directory tree on the local filesystem with a directory tree in HDFS. Files match if they have the same
+    size and modification time, files localized by copy_to_local are given the modification time of their HDFS source.
+    """
 
-    def walk(self, parent_path, file_list, hdfs_parent_path, hdfs_file_list):
-        print("%s %s" %(parent_path, hdfs_parent_path))
-        if len(file_list) == 0 and len(hdfs_file_list) == 0:
-            if os.path.basename(parent_path) == path.basename(hdfs_parent_path):
-                return True
+    def walk(self, parent_path):
+        """
+        Walks a directory tree on the local filesystem
+
+        Args:
+            :parent_path: root of the tree
+
+        Returns:
+            dict of path relative to parent_path -> (size, modification time), directories map to None
+        """
+        tree = {}
+        for root, dir_names, file_names in os.walk(parent_path):
+            relative_root = os.path.relpath(root, parent_path).replace(os.sep, '/')
+            prefix = '' if relative_root == '.' else relative_root + '/'
+            for dir_name in dir_names:
+                tree[prefix + dir_name] = None
+            for file_name in file_names:
+                st = os.stat(os.path.join(root, file_name))
+                tree[prefix + file_name] = (st.st_size, int(st.st_mtime))
+        return tree
+
+    def check(self, root, hdfs_root, hdfs_tree=None):
+        """
+        Checks if the local tree in root is an up-to-date copy of the tree in hdfs_root
+
+        Args:
+            :root: root of the local tree
+            :hdfs_root: root of the HDFS tree
+            :hdfs_tree: optional result of _list_tree(hdfs_root) if the caller already listed it
+
+        Returns:
+            True if the trees contain the same directories and files
+        """
+        print("checking: %s" % root)
+        print("checking hdfs: %s" % hdfs_root)
+        if os.path.isdir(root) == False:
             return False
-        elif len(file_list) != len(hdfs_file_list):
-            print("No match: number of files in dirs")
+        if hdfs_tree is None:
+            hdfs_tree = _list_tree(hdfs_root)
+        info, entries = hdfs_tree
+        if info['kind'] != 'directory':
             return False
-        else:
-            file_list.sort(key=lambda f: os.path.isfile(os.path.join(parent_path, f)))
-            hdfs_file_list.sort(key=lambda f: path.isfile(path.join(hdfs_parent_path, f)))
-            hIdx=0
-            for idx, sub_path in enumerate(file_list):
-                full_path = os.path.join(parent_path, sub_path)
-                hdfs_sub_path = hdfs_file_list[idx]
-                hdfs_full_path = path.join(hdfs_parent_path, hdfs_sub_path)
-
-                if (os.path.basename(sub_path) != path.basename(hdfs_sub_path)):
-                    print("No match: %s and %s" %(sub_path, hdfs_sub_path))
-                    return False
-                
-                if os.path.isdir(full_path):
-                    if path.isdir(hdfs_full_path) == False:
-                        print("No match on directory: %s and %s" %(full_path, hdfs_full_path))
-                        return False
-                    return self.walk(full_path, os.listdir(full_path), hdfs_full_path, hdfs.ls(hdfs_full_path))
-                elif os.path.isfile(full_path):
-                   sz = os.path.getsize(full_path)
-                   hdfs_size = path.getsize(hdfs_full_path)
-                   if (hdfs_size != sz):
-                       return False
-
-        return True
-
-    def check(self, args):
-        self.root = args["root"]
-        self.hdfs_root = args["hdfs_root"]
-        print("checking: %s" % self.root)
-        print("checking hdfs: %s" % self.hdfs_root)
-        if path.isdir(self.hdfs_root) == False:
-            return False;
-        if os.path.isdir(self.root) == False:
-            return False;
-        return self.walk(self.root, os.listdir(self.root), self.hdfs_root, hdfs.ls(self.hdfs_root))
-
+        expected = {}
+        for relative_path, entry in entries:
+            if entry['kind'] == 'directory':
+                expected[relative_path] = None
+            else:
+                expected[relative_path] = (entry['size'], int(entry['last_mod']))
+        return self.walk(root) == expected
 
 
 def project_user():
@@ -108,11 +165,12 @@ def project_path(project=None):
         returns the project absolute path
     """
 
-    if project:
+    if not project:
+        project = project_name()
+    if project not in _project_paths:
         # abspath means "hdfs://namenode:port/ is preprended
-        return hdfs.path.abspath("/Projects/" + project + "/")
-    project = project_name()
-    return hdfs.path.abspath("/Projects/" + project + "/")
+        _project_paths[project] = hdfs.path.abspath("/Projects/" + project + "/")
+    return _project_paths[project]
 
 def get():
     """ Get a handle to pydoop hdfs using the default namenode (specified in hadoop config)
@@ -137,6 +195,9 @@ def _expand_path(hdfs_path, project="", exists=True):
     Expands a given path. If the path is /Projects.. hdfs:// is prepended.
     If the path is ../ the full project path is prepended.
 
+    Callers that perform an operation on the path that fails anyway if it does not exist should pass exists=False to
+    save a round trip to the NameNode.
+
     Args:
         :hdfs_path the path to be expanded
         :exists boolean flag, if this is true an exception is thrown if the expanded path does not exist.
@@ -158,54 +219,428 @@ def _expand_path(hdfs_path, project="", exists=True):
             raise IOError("path %s must be a full hdfs path or a relative path" % hdfs_path)
         proj_path = project_path(project)
         hdfs_path = proj_path + hdfs_path
-    if exists == True and not hdfs.path.exists(hdfs_path):
+    if exists == True and _stat(hdfs_path) is None:
         raise IOError("path %s not found" % hdfs_path)
     return hdfs_path
 
 
-def _init_logger():
+def _normalize_path(hdfs_path):
+    """
+    Strips the scheme and namenode from a HDFS path and removes duplicate and trailing slashes, so that different
+    spellings of the same path share stat cache entries.
+
+    Args:
+        :hdfs_path: the path to normalize
+
+    Returns:
+        the normalized path
+    """
+    if hdfs_path.startswith("hdfs://"):
+        hdfs_path = hdfs_path[len("hdfs://"):]
+        separator = hdfs_path.find("/")
+        hdfs_path = hdfs_path[separator:] if separator >= 0 else "/"
+    hdfs_path = re.sub("/+", "/", hdfs_path)
+    if len(hdfs_path) > 1:
+        hdfs_path = hdfs_path.rstrip("/")
+    return hdfs_path
+
+
+def _cache_stat(normalized_path, info, now):
+    """
+    Stores the path info of a path in the stat cache. Paths that do not exist are not cached, other processes may create
+    them at any time.
+
+    Args:
+        :normalized_path: the path, normalized with _normalize_path
+        :info: the path info, or None if the path does not exist
+        :now: time.time() when the info was fetched
+    """
+    with _stat_cache_lock:
+        if info is None:
+            _stat_cache.pop(normalized_path, None)
+        else:
+            _stat_cache[normalized_path] = (now + STAT_CACHE_TTL, info)
+
+
+def _cached_stat(normalized_path, now):
+    """
+    Looks up a path in the stat cache
+
+    Args:
+        :normalized_path: the path, normalized with _normalize_path
+        :now: the current time.time()
+
+    Returns:
+        (True, path info) on a hit, (False, None) on a miss
+    """
+    with _stat_cache_lock:
+        entry = _stat_cache.get(normalized_path)
+    if entry is None or entry[0] < now:
+        return False, None
+    return True, entry[1]
+
+
+def _invalidate_stat_cache():
+    """
+    Drops the stat cache, called by every helper that modifies the filesystem
+    """
+    with _stat_cache_lock:
+        _stat_cache.clear()
+
+
+def _stat(hdfs_path, cached=False):
+    """
+    Gets the path info of an expanded HDFS path, the fetched info refreshes the stat cache
+
+    Args:
+        :hdfs_path: the expanded path
+        :cached: True to reuse a recent path info of the stat cache, only for batched internal lookups since the cache
+                 does not see changes made by other processes
+
+    Returns:
+        the path info (see lsl) or None if the path does not exist
+    """
+    now = time.time()
+    normalized_path = _normalize_path(hdfs_path)
+    if cached:
+        hit, info = _cached_stat(normalized_path, now)
+        if hit:
+            return info
+    try:
+        info = get().get_path_info(hdfs_path)
+    except IOError:
+        info = None
+    _cache_stat(normalized_path, info, now)
+    return info
+
+
+def _list_parent(parent):
+    """
+    Lists a directory for stat_many
+
+    Args:
+        :parent: normalized path of the directory
+
+    Returns:
+        (parent, list of path infos), the list is None if the directory does not exist
+    """
+    try:
+        return parent, get().list_directory(parent)
+    except IOError:
+        return parent, None
+
+
+def stat_many(hdfs_paths, project=None):
+    """
+    Gets the path info of many paths at once. Instead of one request per path, the parent directory of each path is
+    listed once and the listings of different parents are issued in parallel. Existing paths (including the siblings
+    that came with each listing) are kept in a short-lived cache, so repeated batches can reuse them. Paths that do
+    not exist are always looked up again.
+
+    >>> from hops import hdfs
+    >>> infos = hdfs.stat_many(["Resources/a.csv", "Resources/b.csv", "Logs"])
+
+    Args:
+        :hdfs_paths: list of paths, you can specify either full hdfs pathnames or relative ones (relative to your Project's path in HDFS).
+        :project: If this value is not specified, it will get the path to your project. If you need to path to another project, you can specify the name of the project as a string.
+
+    Returns:
+        a list with the path info (a dict like the entries returned by lsl) of each path, None for paths that do not exist
+    """
+    if project == None:
+        project = project_name()
+    now = time.time()
+    normalized_paths = [_normalize_path(_expand_path(p, project, exists=False)) for p in hdfs_paths]
+
+    results = {}
+    missing_parents = set()
+    for normalized_path in normalized_paths:
+        hit, info = _cached_stat(normalized_path, now)
+        if hit:
+            results[normalized_path] = info
+        elif normalized_path == "/":
+            results[normalized_path] = _stat(normalized_path, cached=True)
+        else:
+            missing_parents.add(normalized_path.rsplit("/", 1)[0] or "/")
+
+    if len(missing_parents) > 0:
+        pool = ThreadPool(max(1, min(METADATA_CONCURRENCY, len(missing_parents))))
+        try:
+            listings = pool.map(_list_parent, list(missing_parents))
+        finally:
+            pool.close()
+            pool.join()
+        for parent, children in listings:
+            for child in children or []:
+                normalized_child = _normalize_path(child['name'])
+                _cache_stat(normalized_child, child, now)
+                results[normalized_child] = child
+
+    infos = []
+    for normalized_path in normalized_paths:
+        if normalized_path not in results:
+            results[normalized_path] = None
+        infos.append(results[normalized_path])
+    return infos
+
+
+def exists_many(hdfs_paths, project=None):
+    """
+    Checks if many paths exist at once, see stat_many.
+
+    Args:
+        :hdfs_paths: list of paths, you can specify either full hdfs pathnames or relative ones (relative to your Project's path in HDFS).
+        :project: If this value is not specified, it will get the path to your project. If you need to path to another project, you can specify the name of the project as a string.
+
+    Returns:
+        a list with True for each path that exists and False for each path that does not
+    """
+    return [info is not None for info in stat_many(hdfs_paths, project=project)]
+
+
+def _finished_metric(hdfs_exec_logdir):
+    """
+    Reads the metric a trial wrote to its directory, to resume a retried task or sweep without running the trials
+    that finished again
+
+    Args:
+        :hdfs_exec_logdir: the directory of the trial
+
+    Returns:
+        the metric, None if the trial did not finish
+    """
+    metric_file = hdfs_exec_logdir + '/metric'
+    if not get().exists(metric_file):
+        return None
+    try:
+        return float(hdfs.load(metric_file))
+    except (IOError, ValueError):
+        return None
+
+
+class _LogShipper(object):
+    """
+    Writes the records of *log* to the logfile on a background thread.
+
+    Records wait in a bounded in-memory buffer and are written as one batch of JSON lines when they reach
+    LOG_FLUSH_SIZE bytes or LOG_FLUSH_INTERVAL seconds, so a training loop logging every step does not wait for an HDFS
+    write per line. If HDFS is slower than the records arrive the buffer fills up and *log* waits for the shipper,
+    after LOG_BACKPRESSURE_TIMEOUT seconds the oldest record is dropped and the drop is reported in the logfile.
+
+    A forked child has no shipper thread and must not write to the HDFS stream of its parent, it writes its records to
+    stderr, which Spark keeps in the executor logs.
+    """
+
+    def __init__(self, fd, task=None):
+        """
+        Args:
+            :fd: the open logfile
+            :task: index of the task the records belong to, None on the driver
+        """
+        self.fd = fd
+        self.task = task
+        self.dropped = 0
+        self._pid = os.getpid()
+        self._records = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, level, msg, step=None):
+        """
+        Buffers a record, waits for room if the buffer is full.
+
+        Args:
+            :level: the level of the record, e.g. 'INFO'
+            :msg: the message
+            :step: the training step the record belongs to, None if it belongs to none
+        """
+        record = (time.time(), level, step, msg)
+        if os.getpid() != self._pid:
+            if not self._closed:
+                sys.stderr.write(self._encode(record))
+            return
+        with self._cond:
+            if self._closed:
+                return
+            deadline = time.time() + LOG_BACKPRESSURE_TIMEOUT
+            while len(self._records) >= LOG_BUFFER_SIZE and not self._closed:
+                self._cond.notify_all()
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    dropped = self._records.popleft()
+                    self._size -= len(dropped[3])
+                    self.dropped += 1
+                    break
+                self._cond.wait(remaining)
+            self._records.append(record)
+            self._size += len(msg)
+            # the shipper waits for the first record, then for its interval or a full batch
+            if len(self._records) == 1 or self._size >= LOG_FLUSH_SIZE:
+                self._cond.notify_all()
+
+    def _encode(self, record):
+        """
+        Args:
+            :record: the buffered record
+
+        Returns:
+            the record as JSON line
+        """
+        logged, level, step, msg = record
+        line = {'time': datetime.datetime.fromtimestamp(logged).isoformat(), 'level': level}
+        if self.task is not None:
+            line['task'] = self.task
+        if step is not None:
+            line['step'] = step
+        line['message'] = msg
+        return json.dumps(line) + '\n'
+
+    def _take(self):
+        """
+        Waits until the buffered records are due and takes them out of the buffer.
+
+        Returns:
+            the records to write and the number of records dropped since the last batch, no records once closed
+        """
+        with self._cond:
+            while not self._closed:
+                if self._records:
+                    waited = time.time() - self._records[0][0]
+                    if self._size >= LOG_FLUSH_SIZE or len(self._records) >= LOG_BUFFER_SIZE or \
+                            waited >= LOG_FLUSH_INTERVAL:
+                        break
+                    self._cond.wait(LOG_FLUSH_INTERVAL - waited)
+                else:
+                    self._cond.wait()
+            records = list(self._records)
+            self._records.clear()
+            self._size = 0
+            dropped = self.dropped
+            self.dropped = 0
+            # wakes up the callers waiting for room
+            self._cond.notify_all()
+            return records, dropped
+
+    def _write(self, records, dropped):
+        """
+        Writes a batch of records to the logfile.
+
+        Args:
+            :records: the records
+            :dropped: number of records dropped before them
+        """
+        lines = [self._encode(record) for record in records]
+        if dropped:
+            lines.insert(0, self._encode((time.time(), 'WARNING', None,
+                                          'Dropped ' + str(dropped) + ' log records, HDFS could not keep up')))
+        if not lines:
+            return
+        try:
+            self.fd.write(''.join(lines).encode())
+            self.fd.flush()
+        except Exception as e:
+            print('Could not write ' + str(len(lines)) + ' log records: ' + str(e))
+
+    def _run(self):
+        """
+        Writes batches until the shipper is closed, then the remaining records.
+        """
+        while True:
+            records, dropped = self._take()
+            self._write(records, dropped)
+            with self._cond:
+                if self._closed and not self._records:
+                    return
+
+    def close(self):
+        """
+        Writes the remaining records and closes the logfile.
+        """
+        if os.getpid() != self._pid:
+            # a forked child never wrote to the logfile, it is left to the parent
+            self._closed = True
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        try:
+            self.fd.close()
+        except:
+            pass
+
+
+def _init_logger(task=None):
     """
-    Initialize the logger by opening the log file and pointing the global fd to the open file
+    Initialize the logger by opening the log file and pointing the global fd to the open file, records are written by a
+    background log shipper
+
+    Args:
+        :task: index of the task writing the logfile, None on the driver
     """
     logfile = os.environ['EXEC_LOGFILE']
     fs_handle = get_fs()
     global fd
+    global _shipper
+    _kill_logger()
     try:
         fd = fs_handle.open_file(logfile, mode='w')
     except:
         fd = fs_handle.open_file(logfile, flags='w')
+    _shipper = _LogShipper(fd, task=task)
 
 
-def log(string):
+def _init_task_logger(hdfs_run_dir, task):
     """
-    Logs a string to the log file
+    Initialize one logger for all the trials a task runs, in the run directory instead of the directory of a trial
+
+    Args:
+        :hdfs_run_dir: the run directory of the experiment
+        :task: index of the task
+    """
+    os.environ['EXEC_LOGFILE'] = hdfs_run_dir + '/task.' + str(task) + '.log'
+    _init_logger(task=task)
+
+
+def log(string, level='INFO', step=None):
+    """
+    Logs a string to the log file.
+
+    The logfile has one JSON record per line with the time, the level, the task and the step of the message. Records
+    are buffered and written in batches in the background, so log is cheap enough to call every training step and from
+    several threads.
 
     Args:
         :string: string to log
+        :level: level of the message, e.g. 'INFO', 'WARNING' or 'ERROR'
+        :step: the training step the message belongs to, optional
     """
-    global fd
-    if fd:
+    shipper = _shipper
+    if shipper:
         if isinstance(string, string_types):
-            fd.write(('{0}: {1}'.format(datetime.datetime.now().isoformat(), string) + '\n').encode())
+            shipper.put(level, string, step=step)
         else:
-            fd.write(('{0}: {1}'.format(datetime.datetime.now().isoformat(),
-                                        'ERROR! Attempting to write a non-string object to logfile') + '\n').encode())
+            shipper.put('ERROR', 'ERROR! Attempting to write a non-string object to logfile', step=step)
 
 
 def _kill_logger():
     """
-    Closes the logfile
+    Writes the buffered records and closes the logfile
     """
     global fd
-    if fd:
-        try:
-            fd.flush()
-            fd.close()
-        except:
-            pass
+    global _shipper
+    shipper = _shipper
+    _shipper = None
+    fd = None
+    if shipper:
+        shipper.close()
 
 
-def _create_directories(app_id, run_id, param_string, type, sub_type=None):
+def _create_directories(app_id, run_id, param_string, type, sub_type=None, keep=False):
     """
     Creates directories for an experiment, if Experiments folder exists it will create directories
     below it, otherwise it will create them in the Logs directory.
@@ -216,6 +651,7 @@ def _create_directories(app_id, run_id, param_string, type, sub_type=None):
         :param_string: name of the new directory created under parent directories
         :type: type of the new directory parent, e.g differential_evolution
         :sub_type: type of sub directory to parent, e.g generation
+        :keep: True to keep the contents of an existing directory, e.g. the checkpoints a re-formed cluster resumes from
 
     Returns:
         The new directories for the yarn-application and for the execution (hdfs_exec_logdir, hdfs_appid_logdir)
@@ -223,10 +659,12 @@ def _create_directories(app_id, run_id, param_string, type, sub_type=None):
 
     pyhdfs_handle = get()
 
-    if pyhdfs_handle.exists(project_path() + "Experiments"):
-        hdfs_events_parent_dir = project_path() + "Experiments"
-    elif pyhdfs_handle.exists(project_path() + "Logs"):
-        hdfs_events_parent_dir = project_path() + "Logs/TensorFlow"
+    proj_path = project_path()
+    experiments_exists, logs_exists = exists_many([proj_path + "Experiments", proj_path + "Logs"])
+    if experiments_exists:
+        hdfs_events_parent_dir = proj_path + "Experiments"
+    elif logs_exists:
+        hdfs_events_parent_dir = proj_path + "Logs/TensorFlow"
         try:
             st = hdfs.stat(hdfs_events_parent_dir)
             if not bool(st.st_mode & local_stat.S_IWGRP):  # if not group writable make it so
@@ -249,12 +687,21 @@ def _create_directories(app_id, run_id, param_string, type, sub_type=None):
     else:
         hdfs_exec_logdir = hdfs_run_id_logdir + '/' + str(param_string)
 
+    # a retried task keeps the directories of the trials it finished before it failed, see _finished_metric, and a
+    # re-formed cluster the checkpoints of the previous epoch
+    if (param_string and pyhdfs_handle.exists(hdfs_exec_logdir + '/metric')) or (keep and pyhdfs_handle.exists(hdfs_exec_logdir)):
+        os.environ['EXEC_LOGFILE'] = hdfs_exec_logdir + '/' + 'logfile'
+        return hdfs_exec_logdir, hdfs_appid_logdir
+
     # Need to remove directory if it exists (might be a task retry)
-    if pyhdfs_handle.exists(hdfs_exec_logdir):
+    try:
         pyhdfs_handle.delete(hdfs_exec_logdir, recursive=True)
+    except IOError:
+        pass
 
     # create the new directory
     pyhdfs_handle.create_directory(hdfs_exec_logdir)
+    _invalidate_stat_cache()
 
     # update logfile
     logfile = hdfs_exec_logdir + '/' + 'logfile'
@@ -263,7 +710,277 @@ def _create_directories(app_id, run_id, param_string, type, sub_type=None):
     return hdfs_exec_logdir, hdfs_appid_logdir
 
 
-def copy_to_hdfs(local_path, relative_hdfs_path, overwrite=False, project=None):
+def _retry(fun, *args):
+    """
+    Calls fun(*args), retrying with exponential backoff if it raises an IOError/OSError
+
+    Args:
+        :fun: the function to call
+        :args: arguments to the function
+
+    Returns:
+        the return value of fun
+    """
+    attempt = 0
+    while True:
+        try:
+            return fun(*args)
+        except (IOError, OSError):
+            attempt += 1
+            if attempt > TRANSFER_RETRIES:
+                raise
+            time.sleep(min(0.1 * 2 ** attempt, 5))
+
+
+def _run_transfer_task(task):
+    """
+    Runs a single transfer task, a tuple of (function, args), in a worker thread of the transfer pool
+
+    Args:
+        :task: the task to run
+
+    Returns:
+        number of bytes transferred by the task
+    """
+    fun, args = task
+    return _retry(fun, *args)
+
+
+def _run_transfer(tasks, concurrency):
+    """
+    Runs the given transfer tasks on a thread pool
+
+    Args:
+        :tasks: list of (function, args) tuples, each function returns the number of bytes it transferred
+        :concurrency: maximum number of tasks to run in parallel
+
+    Returns:
+        total number of bytes transferred
+    """
+    if len(tasks) == 0:
+        return 0
+    num_bytes = 0
+    pool = ThreadPool(max(1, min(concurrency, len(tasks))))
+    try:
+        for transferred in pool.imap_unordered(_run_transfer_task, tasks):
+            num_bytes += transferred
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return num_bytes
+
+
+def _report_transfer(direction, num_files, num_bytes, transfer_start):
+    """
+    Prints the throughput of a finished transfer
+
+    Args:
+        :direction: description of the transfer, e.g 'Uploaded'
+        :num_files: number of files transferred
+        :num_bytes: number of bytes transferred
+        :transfer_start: time.time() when the transfer started
+
+    Returns:
+        (num_files, num_bytes, seconds)
+    """
+    seconds = max(time.time() - transfer_start, 1e-6)
+    megabytes = num_bytes / (1024.0 * 1024.0)
+    print("{0} {1} files ({2:.1f} MB) in {3:.1f} seconds, {4:.1f} MB/s".format(direction, num_files, megabytes,
+                                                                             seconds, megabytes / seconds))
+    return num_files, num_bytes, seconds
+
+
+def _mkdir_hdfs(hdfs_dir):
+    """
+    Creates a directory and its parents in HDFS
+
+    Args:
+        :hdfs_dir: the directory to create
+
+    Returns:
+        0, the number of bytes transferred
+    """
+    hdfs.mkdir(hdfs_dir)
+    return 0
+
+
+def _upload_file(local_file, hdfs_file, overwrite):
+    """
+    Streams a local file to HDFS. HDFS only supports a single writer per file, so large files are not split. A failed
+    upload removes the partial file, so that a retry does not take it for an existing one.
+
+    Args:
+        :local_file: the file to upload
+        :hdfs_file: full HDFS path of the file to create
+        :overwrite: if False the file is skipped if it already exists in HDFS
+
+    Returns:
+        number of bytes uploaded
+    """
+    if not overwrite and hdfs.path.exists(hdfs_file):
+        return 0
+    num_bytes = 0
+    try:
+        with open(local_file, 'rb') as src:
+            with hdfs.open(hdfs_file, 'w') as dest:
+                while True:
+                    buf = src.read(TRANSFER_BUFFER_SIZE)
+                    if not buf:
+                        break
+                    dest.write(buf)
+                    num_bytes += len(buf)
+    except:
+        try:
+            hdfs.rmr(hdfs_file)
+        except IOError:
+            pass
+        raise
+    return num_bytes
+
+
+def _download_range(hdfs_file, local_file, offset, length):
+    """
+    Copies a byte range of a HDFS file into the same range of a preallocated local file
+
+    Args:
+        :hdfs_file: the file to read
+        :local_file: the preallocated local file to write
+        :offset: start of the range
+        :length: length of the range
+
+    Returns:
+        number of bytes downloaded
+    """
+    with hdfs.open(hdfs_file, 'r') as src:
+        src.seek(offset)
+        with open(local_file, 'r+b') as dest:
+            dest.seek(offset)
+            remaining = length
+            while remaining > 0:
+                buf = src.read(min(TRANSFER_BUFFER_SIZE, remaining))
+                if not buf:
+                    raise IOError("unexpected end of file while reading %s" % hdfs_file)
+                dest.write(buf)
+                remaining -= len(buf)
+    return length
+
+
+def _upload(paths, overwrite=True, concurrency=TRANSFER_CONCURRENCY):
+    """
+    Uploads local files and directory trees to HDFS. The source trees are walked up front and every file is scheduled
+    on a thread pool, failed files are retried.
+
+    Args:
+        :paths: list of (local_path, hdfs_path) tuples, hdfs_path is the exact destination of local_path
+        :overwrite: if False files that already exist in HDFS are skipped
+        :concurrency: number of files to upload in parallel
+
+    Returns:
+        (num_files, num_bytes, seconds)
+    """
+    transfer_start = time.time()
+    dirs = []
+    files = []
+    for local_path, hdfs_path in paths:
+        hdfs_path = hdfs_path.rstrip('/')
+        if os.path.isfile(local_path):
+            files.append((local_path, hdfs_path))
+            continue
+        if not os.path.isdir(local_path):
+            raise IOError("path %s not found" % local_path)
+        for root, dir_names, file_names in os.walk(local_path):
+            relative_root = os.path.relpath(root, local_path)
+            hdfs_root = hdfs_path
+            if relative_root != '.':
+                hdfs_root = hdfs_path + '/' + relative_root.replace(os.sep, '/')
+            dirs.append(hdfs_root)
+            for file_name in file_names:
+                files.append((os.path.join(root, file_name), hdfs_root + '/' + file_name))
+
+    # Creating a file in HDFS creates its parents, so only directories that would otherwise stay empty are created
+    non_empty = set([hdfs_file.rsplit('/', 1)[0] for _, hdfs_file in files] + [d.rsplit('/', 1)[0] for d in dirs])
+    _run_transfer([(_mkdir_hdfs, (d,)) for d in dirs if d not in non_empty], concurrency)
+
+    num_bytes = _run_transfer([(_upload_file, (src, dest, overwrite)) for src, dest in files], concurrency)
+    _invalidate_stat_cache()
+    return _report_transfer('Uploaded', len(files), num_bytes, transfer_start)
+
+
+def _list_tree(hdfs_path):
+    """
+    Lists a file or a directory tree in HDFS with a single recursive listing
+
+    Args:
+        :hdfs_path: the file or directory to list
+
+    Raises:
+        IOError if the path does not exist
+
+    Returns:
+        (path info of hdfs_path, list of (path relative to hdfs_path, path info) for everything below it)
+    """
+    info = get().get_path_info(hdfs_path)
+    if info['kind'] != 'directory':
+        return info, []
+    root = info['name'].rstrip('/')
+    entries = []
+    for entry in hdfs.lsl(hdfs_path, recursive=True):
+        entries.append((entry['name'][len(root):].lstrip('/'), entry))
+    return info, entries
+
+
+def _download(paths, concurrency=TRANSFER_CONCURRENCY, trees=None):
+    """
+    Downloads HDFS files and directory trees to the local filesystem. The source trees are listed up front and every
+    file is scheduled on a thread pool, files larger than TRANSFER_CHUNK_SIZE are split into ranges that are
+    downloaded in parallel. Failed files (or ranges) are retried. Downloaded files are given the modification time of
+    their source so that later copies can be checked for freshness.
+
+    Args:
+        :paths: list of (hdfs_path, local_path) tuples, local_path is the exact destination of hdfs_path
+        :concurrency: number of files (or ranges) to download in parallel
+        :trees: optional dict of hdfs_path -> result of _list_tree(hdfs_path), for sources already listed by the caller
+
+    Returns:
+        (num_files, num_bytes, seconds)
+    """
+    transfer_start = time.time()
+    files = []
+    for hdfs_path, local_path in paths:
+        if trees and hdfs_path in trees:
+            info, entries = trees[hdfs_path]
+        else:
+            info, entries = _list_tree(hdfs_path)
+        if info['kind'] != 'directory':
+            files.append((hdfs_path, local_path, info))
+            continue
+        _mkdir_p(local_path)
+        for relative_path, entry in entries:
+            local_entry = os.path.join(local_path, *relative_path.split('/'))
+            if entry['kind'] == 'directory':
+                _mkdir_p(local_entry)
+            else:
+                files.append((entry['name'], local_entry, entry))
+
+    tasks = []
+    for hdfs_file, local_file, info in files:
+        # preallocate so that ranges can be written independently of each other
+        with open(local_file, 'wb') as f:
+            f.truncate(info['size'])
+        for offset in range(0, info['size'], TRANSFER_CHUNK_SIZE):
+            tasks.append((_download_range,
+                          (hdfs_file, local_file, offset, min(TRANSFER_CHUNK_SIZE, info['size'] - offset))))
+
+    num_bytes = _run_transfer(tasks, concurrency)
+    for hdfs_file, local_file, info in files:
+        os.utime(local_file, (info['last_mod'], info['last_mod']))
+    return _report_transfer('Downloaded', len(files), num_bytes, transfer_start)
+
+
+def copy_to_hdfs(local_path, relative_hdfs_path, overwrite=False, project=None, concurrency=TRANSFER_CONCURRENCY):
     """
     Copies a path from local filesystem to HDFS project (recursively) using relative path in $CWD to a path in hdfs (hdfs_path)
 
@@ -278,6 +995,7 @@ def copy_to_hdfs(local_path, relative_hdfs_path, overwrite=False, project=None):
         :relative_hdfs_path: a path in HDFS relative to the project root to where the local path should be written
         :overwrite: a boolean flag whether to overwrite if the path already exists in HDFS
         :project: name of the project, defaults to the current HDFS user's project
+        :concurrency: number of files to upload in parallel
     """
     if project == None:
         project = project_name()
@@ -291,20 +1009,28 @@ def copy_to_hdfs(local_path, relative_hdfs_path, overwrite=False, project=None):
 
     if overwrite:
         hdfs_handle = get()
-        # check if project path exist, if so delete it (since overwrite flag was set to true)
-        if hdfs_handle.exists(hdfs_path):
+        # delete the project path if it exists (since overwrite flag was set to true)
+        try:
             hdfs_handle.delete(hdfs_path, recursive=True)
+        except IOError:
+            pass
+        _invalidate_stat_cache()
                                                         
             
+    # like hdfs.put, copy into the destination if it is an existing directory
+    info = _stat(hdfs_path)
+    if info is not None and info['kind'] == 'directory':
+        hdfs_path = hdfs_path.rstrip('/') + '/' + os.path.basename(full_local.rstrip('/'))
+
     # copy directories from local path to HDFS project path
-    hdfs.put(full_local, hdfs_path)
+    _upload([(full_local, hdfs_path)], concurrency=concurrency)
 
 
-def copy_to_local(hdfs_path, local_path, overwrite=False, project=None):
+def copy_to_local(hdfs_path, local_path, overwrite=False, project=None, concurrency=TRANSFER_CONCURRENCY):
     """
     Copies a directory or file from a HDFS project to a local private scratch directory. If there is not enough space on the local scratch directory, an exception is thrown.
-    If the local file exists, and the hdfs file and the local file are the same size in bytes, return 'ok' immediately.
-    If the local directory tree exists, and the hdfs subdirectory and the local subdirectory have the same files and directories, and the files are the same size in bytes, return 'ok' immediately.
+    If the local file exists, and the hdfs file and the local file have the same size and modification time, return immediately.
+    If the local directory tree exists, and the hdfs subdirectory and the local subdirectory have the same files and directories, and the files have the same size and modification time, return immediately.
 
     Raises:
       IOError if there is not enough space to localize the file/directory in HDFS to the scratch directory ($PDIR)
@@ -314,6 +1040,7 @@ def copy_to_local(hdfs_path, local_path, overwrite=False, project=None):
         :hdfs_path: You can specify either a full hdfs pathname or a relative one (relative to your Project's path in HDFS).
         :overwrite: a boolean flag whether to overwrite if the path already exists in the local scratch directory.
         :project: name of the project, defaults to the current HDFS user's project
+        :concurrency: number of files to download in parallel
 
     Returns:
         the full local pathname of the file/dir
@@ -333,36 +1060,41 @@ def copy_to_local(hdfs_path, local_path, overwrite=False, project=None):
     filename = path.basename(hdfs_path)
     full_local = local_dir + "/" + filename
 
-    project_hdfs_path = _expand_path(hdfs_path, project=project)
-    sub_path = hdfs_path.find("hdfs:///Projects/" + project)
-    rel_path = hdfs_path[sub_path + 1:]
+    project_hdfs_path = _expand_path(hdfs_path, project=project, exists=False)
 
     # Get the amount of free space on the local drive
     stat = os.statvfs(local_dir)
-    free_space_bytes = stat.f_bsize * stat.f_bavail    
+    free_space_bytes = stat.f_bsize * stat.f_bavail
 
-    hdfs_size = path.getsize(project_hdfs_path)
+    hdfs_tree = _list_tree(project_hdfs_path)
+    info, entries = hdfs_tree
+    if info['kind'] == 'directory':
+        hdfs_size = sum([entry['size'] for _, entry in entries])
+    else:
+        hdfs_size = info['size']
 
     if os.path.isfile(full_local) and overwrite == False:
-        sz = os.path.getsize(full_local)
-        if (hdfs_size == sz):
+        st = os.stat(full_local)
+        if info['size'] == st.st_size and int(info['last_mod']) == int(st.st_mtime):
             return full_local
 
     if os.path.isdir(full_local) and overwrite == False:
-        if FsTree().check(full_local, project_hdfs_path) == True:
+        if FsTree().check(full_local, project_hdfs_path, hdfs_tree=hdfs_tree) == True:
             print("Full directory subtree already on local disk and unchanged.")
             return full_local
-        
+
     if (hdfs_size > free_space_bytes):
-        raise IOError("Not enough local free space available on scratch directory: %s" % path)        
-    
-    if overwrite:
-        if os.path.isdir(full_local):
-            shutil.rmtree(full_local)
-        elif os.path.isfile(full_local):
-            os.remove(full_local)
-            
-    hdfs.get(project_hdfs_path, local_dir)
+        raise IOError("Not enough local free space available on scratch directory: %s" % local_dir)
+
+    if os.path.islink(full_local):
+        # a link into the localization cache
+        os.remove(full_local)
+    elif os.path.isdir(full_local):
+        shutil.rmtree(full_local)
+    elif os.path.isfile(full_local):
+        os.remove(full_local)
+
+    _download([(project_hdfs_path, full_local)], concurrency=concurrency, trees={project_hdfs_path: hdfs_tree})
 
     return full_local
 
@@ -377,8 +1109,9 @@ def cp(src_hdfs_path, dest_hdfs_path):
         :dest_hdfs_path: You can specify either a full hdfs pathname or a relative one (relative to your Project's path in HDFS).
 
     """
-    src_hdfs_path = _expand_path(src_hdfs_path)
+    src_hdfs_path = _expand_path(src_hdfs_path, exists=False)
     dest_hdfs_path = _expand_path(dest_hdfs_path)
+    _invalidate_stat_cache()
     hdfs.cp(src_hdfs_path, dest_hdfs_path)
 
 
@@ -389,15 +1122,134 @@ def _get_experiments_dir():
     Returns:
         the folder where the experiments are writing results
     """
-    pyhdfs_handle = get()
-    if pyhdfs_handle.exists(project_path() + "Experiments"):
-        return project_path() + "Experiments"
-    elif pyhdfs_handle.exists(project_path() + "Logs"):
-        return project_path() + "Logs/TensorFlow"
+    proj_path = project_path()
+    experiments_exists, logs_exists = exists_many([proj_path + "Experiments", proj_path + "Logs"])
+    if experiments_exists:
+        return proj_path + "Experiments"
+    elif logs_exists:
+        return proj_path + "Logs/TensorFlow"
+
+
+def _has_magic(component):
+    """
+    Args:
+        :component: a path component
+
+    Returns:
+        True if the path component contains glob wildcards
+    """
+    return re.search('[*?[]', component) is not None
+
+
+def _glob_directories(pool, parents):
+    """
+    Lists directories in parallel for iglob, in the order the listings complete
+
+    Args:
+        :pool: the thread pool to list with
+        :parents: the directories to list
+
+    Returns:
+        a generator of (parent, list of path infos), directories that do not exist are skipped
+    """
+    for parent, children in pool.imap_unordered(_list_parent, parents):
+        if children is not None:
+            yield parent, children
+
+
+def iglob(hdfs_path, recursive=False, project=None):
+    """
+    Finds all the pathnames matching a specified pattern according to the rules used by the Unix shell, and yields them
+    as they are found. Results are returned in arbitrary order.
+
+    Wildcards (*, ?, [seq]) can be used in any component of the path, and a component that is exactly ** matches
+    zero or more directories. The pattern is expanded one component at a time, so only directories that can contain a
+    match are listed, and the listings of sibling directories are issued in parallel.
+
+    >>> from hops import hdfs
+    >>> for metric_file in hdfs.iglob("Experiments/*/grid_search/run.*/*/metric"):
+    >>>     print(metric_file)
+
+    Args:
+     :hdfs_path: You can specify either a full hdfs pathname or a relative one (relative to project_name in HDFS.
+     :recursive: if True, the last component of the pattern is also matched in all subdirectories, same as inserting ** before it
+     :project: If the supplied hdfs_path is a relative path, it will look for that file in this project's subdir in HDFS.
+
+    Raises:
+        IOError if the part of the path before the first wildcard does not exist
+
+    Returns:
+      A generator of path names that match the pattern
+    """
+    if project == None:
+        project = project_name()
+    hdfs_path = _expand_path(hdfs_path, project, exists=False)
+
+    # "hdfs://namenode:port/a/b" => "hdfs://namenode:port", ["a", "b"]
+    separator = hdfs_path.find("/", len("hdfs://"))
+    root = hdfs_path[:separator] if separator >= 0 else hdfs_path
+    components = [c for c in hdfs_path[len(root):].split("/") if c]
+    if recursive and len(components) > 0 and "**" not in components:
+        components.insert(len(components) - 1, "**")
+
+    # the part before the first wildcard is not listed, it only has to exist
+    base = root
+    while len(components) > 0 and not _has_magic(components[0]):
+        base = base + "/" + components.pop(0)
+    if _stat(base or "/", cached=True) is None:
+        raise IOError("Glob path %s not found" % base)
+    if len(components) == 0:
+        yield base
+        return
+
+    pool = ThreadPool(METADATA_CONCURRENCY)
+    try:
+        candidates = [base]
+        for index, component in enumerate(components):
+            last = index == len(components) - 1
+            if component == "**":
+                # zero or more directories: the candidates themselves and every directory below them
+                matches = list(candidates)
+                frontier = list(candidates)
+                while len(frontier) > 0:
+                    next_frontier = []
+                    for _, children in _glob_directories(pool, frontier):
+                        for child in children:
+                            if child['kind'] == 'directory':
+                                next_frontier.append(child['name'])
+                            elif last:
+                                yield child['name']
+                    matches.extend(next_frontier)
+                    frontier = next_frontier
+                if last:
+                    for match in matches:
+                        yield match
+                candidates = matches
+            elif not _has_magic(component):
+                candidates = [candidate + "/" + component for candidate in candidates]
+                if last:
+                    for candidate, info in zip(candidates, stat_many(candidates, project=project)):
+                        if info is not None:
+                            yield candidate
+            else:
+                matches = []
+                for _, children in _glob_directories(pool, candidates):
+                    for child in children:
+                        if fnmatch.fnmatchcase(path.basename(child['name']), component):
+                            if last:
+                                yield child['name']
+                            elif child['kind'] == 'directory':
+                                matches.append(child['name'])
+                candidates = matches
+            if len(candidates) == 0:
+                return
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 def glob(hdfs_path, recursive=False, project=None):
-    """ 
+    """
     Finds all the pathnames matching a specified pattern according to the rules used by the Unix shell, although results are returned in arbitrary order.
 
     Globbing gives you the list of files in a dir that matches a supplied pattern
@@ -406,33 +1258,23 @@ def glob(hdfs_path, recursive=False, project=None):
     >>> glob.glob('./[0-9].*')
     >>> ['./1.gif', './2.txt']
 
-    glob is implemented as  os.listdir() and fnmatch.fnmatch()
-    We implement glob as hdfs.ls() and fnmatch.filter()
+    Wildcards can be used in any component of the path, and ** matches zero or more directories, see iglob.
+
+    >>> from hops import hdfs
+    >>> hdfs.glob("Resources/**/*.jpg")
 
     Args:
      :hdfs_path: You can specify either a full hdfs pathname or a relative one (relative to project_name in HDFS.
+     :recursive: if True, the last component of the pattern is also matched in all subdirectories
      :project: If the supplied hdfs_path is a relative path, it will look for that file in this project's subdir in HDFS.
 
     Raises:
-        IOError if the supplied hdfs path does not exist
+        IOError if the part of the path before the first wildcard does not exist
 
     Returns:
       A possibly-empty list of path names that match pathname, which must be a string containing a path specification. pathname can be either absolute
     """
-
-    # Get the full path to the dir for the input glob pattern
-    # "hdfs://Projects/jim/blah/*.jpg" => "hdfs://Projects/jim/blah"
-    # Then, ls on 'hdfs://Projects/jim/blah', then filter out results
-    if project == None:
-        project = project_name()
-    lastSep = hdfs_path.rfind("/")
-    inputDir = hdfs_path[:lastSep]
-    inputDir = _expand_path(inputDir, project)
-    pattern = hdfs_path[lastSep + 1:]
-    if not hdfs.path.exists(inputDir):
-        raise IOError("Glob path %s not found" % inputDir)
-    dirContents = hdfs.ls(inputDir, recursive=recursive)
-    return fnmatch.filter(dirContents, pattern)
+    return list(iglob(hdfs_path, recursive=recursive, project=project))
 
 
 def ls(hdfs_path, recursive=False, project=None):
@@ -449,7 +1291,7 @@ def ls(hdfs_path, recursive=False, project=None):
     """
     if project == None:
         project = project_name()
-    hdfs_path = _expand_path(hdfs_path, project)
+    hdfs_path = _expand_path(hdfs_path, project, exists=False)
     return hdfs.ls(hdfs_path, recursive=recursive)
 
 
@@ -467,7 +1309,7 @@ def lsl(hdfs_path, recursive=False, project=None):
     """
     if project == None:
         project = project_name()
-    hdfs_path = _expand_path(hdfs_path, project)
+    hdfs_path = _expand_path(hdfs_path, project, exists=False)
     return hdfs.lsl(hdfs_path, recursive=recursive)
 
 
@@ -482,7 +1324,8 @@ def rmr(hdfs_path, project=None):
     """
     if project == None:
         project = project_name()
-    hdfs_path = _expand_path(hdfs_path, project)
+    hdfs_path = _expand_path(hdfs_path, project, exists=False)
+    _invalidate_stat_cache()
     return hdfs.rmr(hdfs_path)
 
 
@@ -498,6 +1341,7 @@ def mkdir(hdfs_path, project=None):
     if project == None:
         project = project_name()
     hdfs_path = _expand_path(hdfs_path, project, exists=False)
+    _invalidate_stat_cache()
     return hdfs.mkdir(hdfs_path)
 
 
@@ -510,8 +1354,9 @@ def move(src, dest):
         :dest: You can specify either a full hdfs pathname or a relative one (relative to your Project's path in HDFS).
 
     """
-    src = _expand_path(src, project_name())
+    src = _expand_path(src, project_name(), exists=False)
     dest = _expand_path(dest, project_name(), exists=False)
+    _invalidate_stat_cache()
     return hdfs.move(src, dest)
 
 
@@ -523,8 +1368,9 @@ def rename(src, dest):
         :src: You can specify either a full hdfs pathname or a relative one (relative to your Project's path in HDFS).
         :dest: You can specify either a full hdfs pathname or a relative one (relative to your Project's path in HDFS).
     """
-    src = _expand_path(src, project_name())
+    src = _expand_path(src, project_name(), exists=False)
     dest = _expand_path(dest, project_name(), exists=False)
+    _invalidate_stat_cache()
     return hdfs.rename(src, dest)
 
 
@@ -540,7 +1386,8 @@ def chown(hdfs_path, user, group, project=None):
     """
     if project == None:
         project = project_name()
-    hdfs_path = _expand_path(hdfs_path, project)
+    hdfs_path = _expand_path(hdfs_path, project, exists=False)
+    _invalidate_stat_cache()
     return hdfs.chown(hdfs_path, user, group)
 
 
@@ -555,7 +1402,8 @@ def chmod(hdfs_path, mode, project=None):
     """
     if project == None:
         project = project_name()
-    hdfs_path = _expand_path(hdfs_path, project)
+    hdfs_path = _expand_path(hdfs_path, project, exists=False)
+    _invalidate_stat_cache()
     return hdfs.chmod(hdfs_path, mode)
 
 
@@ -572,7 +1420,7 @@ def stat(hdfs_path, project=None):
     """
     if project == None:
         project = project_name()
-    hdfs_path = _expand_path(hdfs_path, project)
+    hdfs_path = _expand_path(hdfs_path, project, exists=False)
     return hdfs.stat(hdfs_path)
 
 
@@ -631,6 +1479,8 @@ def open_file(hdfs_path, project=None, flags='rw', buff_size=0):
     if project == None:
         project = project_name()
     hdfs_path = _expand_path(hdfs_path, project, exists=False)
+    if 'w' in flags or 'a' in flags:
+        _invalidate_stat_cache()
     fs_handle = get_fs()
     fd = fs_handle.open_file(hdfs_path, flags, buff_size=buff_size)
     return fd
@@ -661,10 +1511,10 @@ def exists(hdfs_path, project=None):
         project = project_name()
 
     try:
-        hdfs_path = _expand_path(hdfs_path, project)
+        hdfs_path = _expand_path(hdfs_path, project, exists=False)
     except IOError:
         return False
-    return hdfs.path.exists(hdfs_path)
+    return _stat(hdfs_path) is not None
 
 
 def isdir(hdfs_path, project=None):
@@ -682,8 +1532,11 @@ def isdir(hdfs_path, project=None):
     """
     if project == None:
         project = project_name()
-    hdfs_path = _expand_path(hdfs_path, project)
-    return hdfs.isdir(hdfs_path)
+    hdfs_path = _expand_path(hdfs_path, project, exists=False)
+    info = _stat(hdfs_path)
+    if info is None:
+        raise IOError("path %s not found" % hdfs_path)
+    return info['kind'] == 'directory'
 
 
 def isfile(hdfs_path, project=None):
@@ -701,8 +1554,11 @@ def isfile(hdfs_path, project=None):
     """
     if project == None:
         project = project_name()
-    hdfs_path = _expand_path(hdfs_path, project)
-    return hdfs.isfile(hdfs_path)
+    hdfs_path = _expand_path(hdfs_path, project, exists=False)
+    info = _stat(hdfs_path)
+    if info is None:
+        raise IOError("path %s not found" % hdfs_path)
+    return info['kind'] == 'file'
 
 
 def capacity():
@@ -725,6 +1581,7 @@ def dump(data, hdfs_path):
     """
 
     hdfs_path = _expand_path(hdfs_path, exists=False)
+    _invalidate_stat_cache()
     return hdfs.dump(data, hdfs_path)
 
 
@@ -738,54 +1595,321 @@ def load(hdfs_path):
     Returns:
         the read contents of hdfs_path
     """
-    hdfs_path = _expand_path(hdfs_path)
+    hdfs_path = _expand_path(hdfs_path, exists=False)
     return hdfs.load(hdfs_path)
 
-def ls(hdfs_path, recursive=False):
+def abs_path(hdfs_path):
+    """
+     Return an absolute path for hdfs_path.
+
+     Args:
+         :hdfs_path: You can specify either a full hdfs pathname or a relative one (relative to your Project's path in HDFS).
+
+    Returns:
+        Return an absolute path for hdfs_path.
     """
-    lists a directory in HDFS
+    return _expand_path(hdfs_path)
+
+def _localization_cache_dir():
+    """
+    Returns:
+        the directory of the localization cache, created if it does not exist
+    """
+    if "PDIR" in os.environ:
+        cache_dir = os.path.join(os.environ['PDIR'], LOCALIZATION_CACHE_DIR)
+    else:
+        cache_dir = os.path.join(os.getcwd(), LOCALIZATION_CACHE_DIR)
+    _mkdir_p(cache_dir)
+    return cache_dir
+
+
+def _localization_cache_key(hdfs_tree):
+    """
+    Computes the cache key of a listed HDFS file or directory tree from the path, length and modification time of
+    everything in it, so that any change in HDFS results in a new key.
 
     Args:
-        :hdfs_path: You can specify either a full hdfs pathname or a relative one (relative to your Project's path in HDFS).
+        :hdfs_tree: result of _list_tree
 
     Returns:
-        returns a list of hdfs paths
+        (key, total size in bytes)
     """
-    hdfs_path = _expand_path(hdfs_path)
-    return hdfs.ls(hdfs_path, recursive=recursive)
+    info, entries = hdfs_tree
+    key = hashlib.sha1()
+    key.update(u'{0}|{1}|{2}\n'.format(info['name'].rstrip('/'), info['size'], info['last_mod']).encode('utf-8'))
+    size = info['size']
+    for relative_path, entry in sorted(entries, key=lambda e: e[0]):
+        key.update(u'{0}|{1}|{2}|{3}\n'.format(relative_path, entry['kind'], entry['size'],
+                                              entry['last_mod']).encode('utf-8'))
+        size += entry['size']
+    return key.hexdigest(), size
+
+
+def _localization_cache_entries(cache_dir):
+    """
+    Lists the complete entries of the localization cache
 
-def stat(hdfs_path):
+    Args:
+        :cache_dir: the cache directory
+
+    Returns:
+        list of (last access time, key, size) sorted with the least recently used entry first
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.size'):
+            continue
+        key = name[:-len('.size')]
+        try:
+            with open(os.path.join(cache_dir, name)) as f:
+                size = int(f.read())
+            entries.append((os.path.getmtime(os.path.join(cache_dir, key)), key, size))
+        except (IOError, OSError, ValueError):
+            continue
+    entries.sort()
+    return entries
+
+
+def _evict_localization_cache(cache_dir, required_bytes):
     """
-    Performs the equivalent of os.stat() on hdfs_path, returning a StatResult object.
+    Evicts least recently used entries until required_bytes fit within both the cache budget and the free space of the
+    scratch directory. Entries pinned by a running process are never evicted. Must be called with the cache lock held.
 
     Args:
-        :hdfs_path: You can specify either a full hdfs pathname or a relative one (relative to your Project's path in HDFS).
+        :cache_dir: the cache directory
+        :required_bytes: size of the entry about to be added
+
+    Raises:
+        IOError if not enough space can be freed
+    """
+    budget = int(os.environ.get(constants.ENV_VARIABLES.LOCALIZATION_CACHE_SIZE_ENV_VAR, LOCALIZATION_CACHE_SIZE))
+    entries = _localization_cache_entries(cache_dir)
+    used = sum([size for _, _, size in entries])
+    stat = os.statvfs(cache_dir)
+    free_space_bytes = stat.f_bsize * stat.f_bavail
+
+    for _, key, size in entries:
+        if used + required_bytes <= budget and required_bytes <= free_space_bytes:
+            return
+        lock_fd = os.open(os.path.join(cache_dir, key + '.lock'), os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            # in use by some process
+            os.close(lock_fd)
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, key + '.size'))
+            shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        finally:
+            os.close(lock_fd)
+        used -= size
+        free_space_bytes += size
+
+    if used + required_bytes > budget or required_bytes > free_space_bytes:
+        raise IOError("Not enough local free space available in localization cache: %s" % cache_dir)
+
+
+def _localization_entry_current(local_path, hdfs_tree):
+    """
+    Checks that a cache entry is a complete copy of its HDFS source, files are compared by size and modification time
+
+    Args:
+        :local_path: the file or directory in the cache entry
+        :hdfs_tree: result of _list_tree of the source
 
     Returns:
-        returns a list of hdfs paths
+        True if the entry matches the source
     """
-    hdfs_path = _expand_path(hdfs_path)
-    return hdfs.stat(hdfs_path)
+    info, entries = hdfs_tree
+    try:
+        if info['kind'] != 'directory':
+            st = os.stat(local_path)
+            return os.path.isfile(local_path) and info['size'] == st.st_size and \
+                int(info['last_mod']) == int(st.st_mtime)
+        if not os.path.isdir(local_path):
+            return False
+        expected = {}
+        for relative_path, entry in entries:
+            if entry['kind'] == 'directory':
+                expected[relative_path] = None
+            else:
+                expected[relative_path] = (entry['size'], int(entry['last_mod']))
+        return FsTree().walk(local_path) == expected
+    except (IOError, OSError):
+        return False
 
-def abs_path(hdfs_path):
+
+def _download_localization_entry(cache_dir, key, size, hdfs_path, hdfs_tree, local_path, concurrency):
     """
-     Return an absolute path for hdfs_path.
+    Downloads a cache entry into a temporary directory and renames it into place, replacing an outdated entry. Must be
+    called with the download lock of the entry held, and to replace an entry also with its pin lock held exclusively.
 
-     Args:
-         :hdfs_path: You can specify either a full hdfs pathname or a relative one (relative to your Project's path in HDFS).
+    Args:
+        :cache_dir: the cache directory
+        :key: key of the entry
+        :size: size of the entry in bytes
+        :hdfs_path: the source
+        :hdfs_tree: result of _list_tree of the source
+        :local_path: the file or directory in the entry
+        :concurrency: number of files to download in parallel
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    cache_lock_fd = os.open(os.path.join(cache_dir, '.lock'), os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(cache_lock_fd, fcntl.LOCK_EX)
+        _evict_localization_cache(cache_dir, size)
+        with open(os.path.join(cache_dir, key + '.size'), 'w') as f:
+            f.write(str(size))
+    finally:
+        os.close(cache_lock_fd)
+    tmp_dir = os.path.join(cache_dir, '.tmp.' + key + '.' + str(os.getpid()))
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    _mkdir_p(tmp_dir)
+    try:
+        _download([(hdfs_path, os.path.join(tmp_dir, os.path.basename(local_path)))],
+                  concurrency=concurrency, trees={hdfs_path: hdfs_tree})
+        if os.path.exists(entry_dir):
+            # a modified entry no other process has pinned
+            old_dir = tmp_dir + '.old'
+            os.rename(entry_dir, old_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+        os.rename(tmp_dir, entry_dir)
+    except:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        try:
+            os.remove(os.path.join(cache_dir, key + '.size'))
+        except OSError:
+            pass
+        raise
+
+
+def _lock_unpinned_entry(cache_dir, key):
+    """
+    Locks the pin lock of an entry exclusively if no process has the entry pinned, dropping the pin of this process
+
+    Args:
+        :cache_dir: the cache directory
+        :key: key of the entry
 
     Returns:
-        Return an absolute path for hdfs_path.
+        the locked file descriptor, None if another process has the entry pinned
     """
-    return _expand_path(hdfs_path)
+    if key in _localization_pins:
+        os.close(_localization_pins.pop(key))
+    lock_fd = os.open(os.path.join(cache_dir, key + '.lock'), os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        os.close(lock_fd)
+        return None
+    return lock_fd
+
+
+def _link_localized(local_path, link_path):
+    """
+    Points a path in the scratch directory at a cache entry, replacing what was localized there before
+
+    Args:
+        :local_path: the file or directory in the cache entry
+        :link_path: the path in the scratch directory
+
+    Returns:
+        link_path
+    """
+    if os.path.islink(link_path) and os.readlink(link_path) == local_path:
+        return link_path
+    tmp_link = link_path + '.' + str(os.getpid()) + '.link'
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(local_path, tmp_link)
+    if os.path.isdir(link_path) and not os.path.islink(link_path):
+        # a copy of an earlier localize or copy_to_local
+        shutil.rmtree(link_path)
+    os.rename(tmp_link, link_path)
+    return link_path
+
+
+def _localize_cached(hdfs_path, concurrency=TRANSFER_CONCURRENCY):
+    """
+    Localizes a file or directory through the localization cache. Entries are keyed by the HDFS path and the length and
+    modification time of everything below it, downloaded into a temporary directory and renamed into place when
+    complete. An existing entry is only used if its files still match the source in size and modification time.
+
+    Entries are shared read-only by all processes on the host. A process downloads an entry holding the exclusive
+    download lock of the entry, so concurrent localizations of the same entry wait for a single download, and then
+    share-locks the pin lock of the entry for its lifetime so that the entry is not evicted while in use. The pin is
+    never held while waiting for a download. An entry that was modified after it was localized is only replaced if no
+    other process has it pinned.
+
+    Args:
+        :hdfs_path: full HDFS path of the file or directory
+
+    Returns:
+        local path of the cached file or directory, None if the entry was modified and is in use by another process
+    """
+    cache_dir = _localization_cache_dir()
+    hdfs_tree = _list_tree(hdfs_path)
+    key, size = _localization_cache_key(hdfs_tree)
+    entry_dir = os.path.join(cache_dir, key)
+    local_path = os.path.join(entry_dir, path.basename(hdfs_tree[0]['name']))
+
+    if key in _localization_pins and _localization_entry_current(local_path, hdfs_tree):
+        os.utime(entry_dir, None)
+        return local_path
+
+    lock_fd = os.open(os.path.join(cache_dir, key + '.lock'), os.O_RDWR | os.O_CREAT)
+    try:
+        while True:
+            if not _localization_entry_current(local_path, hdfs_tree):
+                download_fd = os.open(os.path.join(cache_dir, key + '.download'), os.O_RDWR | os.O_CREAT)
+                try:
+                    fcntl.flock(download_fd, fcntl.LOCK_EX)
+                    # another process may have downloaded the entry while this one waited for the lock
+                    if not _localization_entry_current(local_path, hdfs_tree):
+                        replace_fd = None
+                        if os.path.exists(entry_dir):
+                            replace_fd = _lock_unpinned_entry(cache_dir, key)
+                            if replace_fd is None:
+                                os.close(lock_fd)
+                                return None
+                        try:
+                            _download_localization_entry(cache_dir, key, size, hdfs_path, hdfs_tree, local_path,
+                                                         concurrency)
+                        finally:
+                            if replace_fd is not None:
+                                os.close(replace_fd)
+                finally:
+                    os.close(download_fd)
+            fcntl.flock(lock_fd, fcntl.LOCK_SH)
+            # the entry may have been evicted between the download and the pin
+            if os.path.exists(entry_dir):
+                break
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        os.utime(entry_dir, None)
+    except:
+        os.close(lock_fd)
+        raise
 
-def localize(hdfs_path):
+    if key in _localization_pins:
+        os.close(_localization_pins[key])
+    _localization_pins[key] = lock_fd
+    return local_path
+
+
+def localize(hdfs_path, concurrency=TRANSFER_CONCURRENCY):
     """
      Localizes (copies) the given file or directory from HDFS into a local scratch directory, indicated by the env variable $PDIR.
      Returns the absolute path for the local file. If there is not enough space on the local scratch directory, an exception is thrown.
 
+     Localized files are kept in a cache in the scratch directory that is shared by all processes on the host, so
+     localizing the same unchanged file or directory again (e.g from another trial of a grid search) does not download it
+     again. The returned path $PDIR/<name> is a symlink into the cache and should be treated as read-only. If the file or
+     directory was modified in HDFS while another process still uses the cached copy, a private copy is made instead.
+
      Args:
          :hdfs_path: You can specify either a full hdfs pathname or a relative one (relative to your Project's path in HDFS).
+         :concurrency: number of files to download in parallel
 
      Raises:
         IOError if there is not enough space to localize the file/directory in HDFS to the scratch directory ($PDIR)
@@ -793,7 +1917,12 @@ def localize(hdfs_path):
      Returns:
         Return an absolute path for local file/directory.
     """
-    #filename = path.basename(hdfs_path)
-    #return copy_to_local(hdfs_path, filename, overwrite = True)
-    return copy_to_local(hdfs_path, "", overwrite = True)
-
+    hdfs_path = _expand_path(hdfs_path, exists=False)
+    scratch_dir = os.environ['PDIR'] if 'PDIR' in os.environ else os.getcwd()
+    link_path = os.path.join(scratch_dir, os.path.basename(hdfs_path.rstrip('/')))
+    local_path = _localize_cached(hdfs_path, concurrency=concurrency)
+    if local_path is None:
+        if os.path.islink(link_path):
+            os.remove(link_path)
+        return copy_to_local(hdfs_path, "", overwrite=True)
+    return _link_localized(local_path, link_path)
@@ -0,0 +1,388 @@
+"""
+Channel for reporting metrics from running experiments to the driver.
+
+Every launcher in *experiment* starts a metric server on the driver before the Spark job, and connects the executors to
+it. Calls to *experiment.report* inside the wrapped function send metrics over the same length-prefixed socket framing
+used by the reservation servers, authenticated with the secret of the application, and the driver appends them to an
+in-memory table as they arrive. The table can be read
+while the experiment runs, e.g. from another notebook thread, and stays available after it finished.
+
+>>> from hops import experiment
+>>> def train_nn(learning_rate):
+>>>    for epoch in range(10):
+>>>        loss, accuracy = network.train_epoch(learning_rate)
+>>>        experiment.report(epoch, loss=loss, accuracy=accuracy)
+>>>    return accuracy
+>>> experiment.launch(train_nn, {'learning_rate': [0.1, 0.01]})
+>>> experiment.reported_metrics()
+"""
+
+from hops.distribute import allreduce_reservation
+
+import threading
+import logging
+import time
+
+table = None
+
+_server_addr = None
+_secret = None
+_client = None
+_trial = None
+
+
+class MetricTable(object):
+    """
+    Thread-safe table of reported metrics, one row per report
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._rows = []
+        self._last = {}
+        self._results = []
+        self._telemetry = []
+
+    def append(self, trial, step, metrics):
+        """
+        Add a row
+
+        Args:
+            :trial: name of the trial or task that reported the metrics
+            :step: the step the metrics were reported at
+            :metrics: dict of metric name to value
+
+        Returns:
+            the added row
+        """
+        row = dict(metrics)
+        row['trial'] = trial
+        row['step'] = step
+        row['time'] = time.time()
+        with self.lock:
+            self._rows.append(row)
+            self._last[trial] = row
+        return row
+
+    def finish(self, param_string, metric):
+        """
+        Record the final metric of a trial
+
+        Args:
+            :param_string: the hyperparameters of the trial
+            :metric: the metric returned by the trial
+        """
+        with self.lock:
+            self._results.append((param_string, metric))
+
+    def results(self, start=0):
+        """
+        Get the final metrics of the trials that finished so far, also if the experiment failed later
+
+        Args:
+            :start: skip the first start results, e.g. the number of results before a launch
+
+        Returns:
+            dict of param_string to metric
+        """
+        with self.lock:
+            return dict(self._results[start:])
+
+    def num_results(self):
+        """
+
+        Returns:
+            the number of final metrics recorded
+        """
+        with self.lock:
+            return len(self._results)
+
+    def add_telemetry(self, task, summary):
+        """
+        Record the GPU telemetry summary of a task
+
+        Args:
+            :task: name of the task
+            :summary: the summary of its telemetry.Sampler
+        """
+        summary = dict(summary)
+        summary['task'] = task
+        with self.lock:
+            self._telemetry.append(summary)
+
+    def telemetry(self):
+        """
+        Get the GPU telemetry summaries of the tasks that finished so far
+
+        Returns:
+            list of telemetry.Sampler summaries with the 'task' they belong to, in the order they were received
+        """
+        with self.lock:
+            return list(self._telemetry)
+
+    def rows(self, trial=None):
+        """
+        Get the reported rows, in the order they were received
+
+        Args:
+            :trial: only return the rows of this trial
+
+        Returns:
+            list of dicts with the 'trial', 'step', 'time' and the reported metrics
+        """
+        with self.lock:
+            if trial is None:
+                return list(self._rows)
+            return [row for row in self._rows if row['trial'] == trial]
+
+    def last(self):
+        """
+        Get the last row reported by every trial
+
+        Returns:
+            dict of trial to its last row
+        """
+        with self.lock:
+            return dict(self._last)
+
+    def __len__(self):
+        with self.lock:
+            return len(self._rows)
+
+
+class Server(allreduce_reservation.Server):
+    """
+    Driver side metric server, appends every reported metric to its table
+    """
+
+    def __init__(self, secret=None):
+        """
+        Args:
+            :secret: secret of the application from codec.new_secret, clients without it are rejected
+        """
+        # the reservations of the base server are not used
+        super(Server, self).__init__(1, secret=secret)
+        self.secret = secret
+        self.done = False
+        self.lock = threading.RLock()
+        self.table = MetricTable()
+
+    def _on_metric(self, data):
+        """
+        Handles a reported metric
+
+        Args:
+            :data: dict with the 'id' and 'name' of the trial, the 'step' and the 'metrics'
+
+        Returns:
+            the response to send to the executor
+        """
+        self.table.append(data['name'], data['step'], data['metrics'])
+        return 'OK'
+
+    def _handle_message(self, sock, msg):
+        """
+        Records METRIC, RESULT and TELEMETRY messages in the table and stops on STOP
+
+        Args:
+            :sock: the socket of the executor
+            :msg: the message, dict with the 'type' and the 'data'
+        """
+        logging.debug("received: {0}".format(msg))
+        msg_type = msg['type']
+        with self.lock:
+            if msg_type == 'METRIC':
+                self.send(sock, self._on_metric(msg['data']))
+            elif msg_type == 'RESULT':
+                self.table.finish(msg['data']['param_string'], msg['data']['metric'])
+                self.send(sock, 'OK')
+            elif msg_type == 'TELEMETRY':
+                self.table.add_telemetry(msg['data']['task'], msg['data']['summary'])
+                self.send(sock, 'OK')
+            elif msg_type == 'STOP':
+                self.send(sock, 'OK')
+                self.done = True
+            else:
+                self.send(sock, 'ERR')
+
+
+class Client(allreduce_reservation.Client):
+    """
+    Executor side client of the metric server
+    """
+
+    def report(self, trial, step, metrics):
+        """
+        Send metrics to the driver
+
+        Args:
+            :trial: dict with the 'id' and 'name' of the trial
+            :step: the step the metrics were reported at
+            :metrics: dict of metric name to value
+
+        Returns:
+            the response of the server
+        """
+        return self._request('METRIC', {'id': trial['id'], 'name': trial['name'], 'step': step, 'metrics': metrics})
+
+    def result(self, trial, metric):
+        """
+        Send the final metric of a trial to the driver
+
+        Args:
+            :trial: dict with the 'id' and 'param_string' of the trial
+            :metric: the metric returned by the trial
+        """
+        return self._request('RESULT', {'id': trial['id'], 'param_string': trial['param_string'], 'metric': metric})
+
+    def telemetry(self, task, summary):
+        """
+        Send the GPU telemetry summary of a task to the driver
+
+        Args:
+            :task: name of the task
+            :summary: the summary of its telemetry.Sampler
+        """
+        return self._request('TELEMETRY', {'task': task, 'summary': summary})
+
+
+def _select(metrics, name='metric'):
+    """
+    Picks the metric used for optimization from reported metrics
+
+    Args:
+        :metrics: dict of metric name to value
+        :name: name of the metric to pick
+
+    Returns:
+        the value of the metric called name, or the only reported value, otherwise None
+    """
+    if name in metrics:
+        return metrics[name]
+    if len(metrics) == 1:
+        return list(metrics.values())[0]
+    return None
+
+
+def _start(server=None, secret=None):
+    """
+    Starts a metric server on the driver and makes its table the current one
+
+    Args:
+        :server: the server to start, a new Server if None
+        :secret: the secret of a new Server, executors connect with it
+
+    Returns:
+        the server and its address
+    """
+    global table
+    if server is None:
+        server = Server(secret=secret)
+    table = server.table
+    return server, server.start()
+
+
+def _connect(server_addr, trial_id, name, client=None, param_string=None, secret=None):
+    """
+    Connects the executor to the metric server for the trial about to run, the connection is opened on the first report
+
+    Args:
+        :server_addr: address of the metric server
+        :trial_id: id of the trial
+        :name: name of the trial, e.g. its parameter string
+        :client: an already connected client to reuse
+        :param_string: the hyperparameters of the trial, defaults to name
+        :secret: the secret the metric server was started with
+    """
+    global _server_addr
+    global _secret
+    global _client
+    global _trial
+    _server_addr = server_addr
+    _secret = secret
+    if client is not None:
+        _client = client
+    _trial = {'id': trial_id, 'name': name, 'param_string': name if param_string is None else param_string}
+
+
+def _disconnect(close=True):
+    """
+    Disconnects the executor from the metric server
+
+    Args:
+        :close: False to keep the client connected for the next trial
+    """
+    global _server_addr
+    global _secret
+    global _client
+    global _trial
+    if close:
+        if _client is not None:
+            _client.close()
+            _client = None
+        _server_addr = None
+        _secret = None
+    _trial = None
+
+
+def _finish(metric):
+    """
+    Sends the final metric of the running trial to the driver
+
+    Args:
+        :metric: the metric returned by the trial
+    """
+    global _client
+    if _trial is None:
+        return
+    if _client is None:
+        _client = Client(_server_addr, secret=_secret)
+    _client.result(_trial, float(metric))
+
+
+def _publish_telemetry(task, summary):
+    """
+    Sends the GPU telemetry summary of a task to the driver, does nothing if the task is not connected
+
+    Args:
+        :task: name of the task
+        :summary: the summary of its telemetry.Sampler
+    """
+    global _client
+    if _server_addr is None:
+        return
+    if _client is None:
+        _client = Client(_server_addr, secret=_secret)
+    _client.telemetry(task, summary)
+
+
+def _telemetry():
+    """
+    Returns:
+        the GPU telemetry summaries collected by the current metric server, empty if none ran
+    """
+    if table is None:
+        return []
+    return table.telemetry()
+
+
+def report(step, **metrics):
+    """
+    Report metrics of the running trial to the driver. Does nothing outside of an experiment.
+
+    Args:
+        :step: the step (e.g. epoch) the metrics were computed at
+        :metrics: metric names and values
+
+    Returns:
+        the response of the server, None outside of an experiment
+    """
+    global _client
+    if _trial is None:
+        return None
+    if _client is None:
+        _client = Client(_server_addr, secret=_secret)
+    metrics = dict((key, float(value)) for key, value in metrics.items())
+    _trial['last_step'] = step
+    _trial['last_metrics'] = metrics
+    return _client.report(_trial, step, metrics)
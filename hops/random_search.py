@@ -1,31 +1,69 @@
 """
 Random Search implementation
+
+Hyperparameters in *boundary_dict* are given as
+    - [lower, upper] with two ints for an int parameter, or two floats for a float parameter, sampled uniformly.
+    - [lower, upper, 'log'] for a parameter sampled uniformly on a log scale, e.g. a learning rate.
+    - [lower, upper, 'uniform', step] or [lower, upper, 'log', step] for a parameter quantized to lower + k * step.
+    - any other list, e.g. ['relu', 'tanh'] or [32, 64, 128], for a categorical parameter.
+
+All samples are drawn at once. With *sampler='halton'* or *sampler='sobol'* they come from a randomly shifted
+quasi-random sequence instead, which covers the search space more evenly than independent random samples for the same
+number of trials. Sobol sequences need scipy 1.7 or later, without it the Halton sequence is used.
+
+Duplicate combinations are dropped and replaced by new samples, so *samples* distinct combinations are run unless the
+search space has fewer.
 """
 
+from __future__ import absolute_import
+
 from hops import util
 from hops import hdfs as hopshdfs
-from hops import tensorboard
-from hops import devices
+from hops import metrics as hopsmetrics
+from hops import runtime
+from hops import trial_scheduler
+from hops import trial_store
+from hops.distribute import codec
 
 import pydoop.hdfs
-import threading
+import numpy as np
 import six
 import datetime
-import os
-import random
+import math
+
+try:
+    from scipy.stats import qmc
+except ImportError:
+    qmc = None
 
 run_id = 0
 
+SAMPLERS = ['random', 'halton', 'sobol']
+
+# the first primes, one Halton base per hyperparameter
+_PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67, 71, 73, 79, 83, 89, 97, 101, 103,
+           107, 109, 113, 127, 131, 137, 139, 149, 151, 157, 163, 167, 173, 179, 181, 191, 193, 197, 199]
 
-def _launch(sc, map_fun, args_dict, samples, direction='max', local_logdir=False, name="no-name"):
+# rounds of new samples drawn to replace duplicates before running fewer combinations
+_TOP_UP_ROUNDS = 10
+
+
+def _launch(sc, map_fun, args_dict, samples, direction='max', local_logdir=False, name="no-name", scheduler=None, dataset_version=None, trials_per_task=1, retries=0, sampler='random'):
     """
 
     Args:
         sc:
         map_fun:
         args_dict:
+        samples:
+        direction:
         local_logdir:
         name:
+        scheduler:
+        dataset_version:
+        trials_per_task:
+        retries:
+        sampler:
 
     Returns:
 
@@ -34,51 +72,43 @@ def _launch(sc, map_fun, args_dict, samples, direction='max', local_logdir=False
 
     app_id = str(sc.applicationId)
 
-    arg_lists = list(args_dict.values())
-    for i in range(len(arg_lists)):
-       if len(arg_lists[i]) != 2:
-           raise ValueError('Boundary list must contain exactly two elements, [lower_bound, upper_bound] for each hyperparameter')
-
-    hp_names = args_dict.keys()
+    if sampler not in SAMPLERS:
+        raise ValueError('Invalid sampler ' + str(sampler) + ', must be one of ' + ', '.join(SAMPLERS))
 
-    random_dict = {}
-    for hp in hp_names:
-        lower_bound = args_dict[hp][0]
-        upper_bound = args_dict[hp][1]
+    random_dict, new_samples = _sample_unique(_parse_boundaries(args_dict), samples, sampler)
 
-        assert lower_bound < upper_bound, "lower bound: " + str(lower_bound) + " must be less than upper bound: " + str(upper_bound)
-
-        random_values = []
-
-        if type(lower_bound) == int and type(upper_bound) == int:
-            for i in range(samples):
-                random_values.append(random.randint(lower_bound, upper_bound))
-        elif type(lower_bound) == float and type(upper_bound) == float:
-            for i in range(samples):
-                random_values.append(random.uniform(lower_bound, upper_bound))
-        else:
-            raise ValueError('Only float and int is currently supported')
+    sc.setJobGroup("Random Search", "{} | Hyperparameter Optimization".format(name))
 
-        random_dict[hp] = random_values
+    def _run(random_dict):
+        new_samples = len(list(random_dict.values())[0])
+        if scheduler is not None:
+            return trial_scheduler._launch(sc, map_fun, random_dict, new_samples, scheduler, direction, app_id, run_id, 'random_search', local_logdir=local_logdir, retries=retries)
 
-    random_dict, new_samples = _remove_duplicates(random_dict, samples)
+        #Each TF task should be run on 1 executor, running trials_per_task trials after each other
+        num_tasks = int(math.ceil(new_samples / float(trials_per_task)))
+        nodeRDD = sc.parallelize(range(new_samples), num_tasks)
 
-    sc.setJobGroup("Random Search", "{} | Hyperparameter Optimization".format(name))
-    #Each TF task should be run on 1 executor
-    nodeRDD = sc.parallelize(range(new_samples), new_samples)
+        # executors get the secret along with the server address in the closure of the task
+        secret = codec.new_secret()
+        metric_server, metric_server_addr = hopsmetrics._start(secret=secret)
+        try:
+            return nodeRDD.mapPartitions(_prepare_func(app_id, run_id, map_fun, random_dict, local_logdir, metric_server_addr, retries, secret)).collect()
+        finally:
+            metric_server.stop()
 
     job_start = datetime.datetime.now()
-    nodeRDD.foreachPartition(_prepare_func(app_id, run_id, map_fun, random_dict, local_logdir))
+    results = trial_store._memoize(map_fun, random_dict, _run, dataset_version=dataset_version)
     job_end = datetime.datetime.now()
 
     job_time_str = util._time_diff(job_start, job_end)
 
-    arg_count = six.get_function_code(map_fun).co_argcount
-    arg_names = six.get_function_code(map_fun).co_varnames
-    hdfs_appid_dir = hopshdfs._get_experiments_dir() + '/' + app_id
     hdfs_runid_dir = _get_logdir(app_id)
 
-    max_val, max_hp, min_val, min_hp, avg = _get_best(random_dict, new_samples, arg_names, arg_count, hdfs_appid_dir, run_id)
+    max_val, max_hp, min_val, min_hp, avg = util._get_best(results)
+    failed = [param_string for param_string, metric in results if np.isnan(metric)]
+    failed_str = ''
+    if len(failed) > 0:
+        failed_str = 'FAILED combinations ' + ', '.join(failed) + '\n'
 
     param_combination = ""
     best_val = ""
@@ -90,8 +120,9 @@ def _launch(sc, map_fun, args_dict, samples, direction='max', local_logdir=False
         'BEST combination ' + max_hp + ' -- metric ' + str(max_val) + '\n' \
         'WORST combination ' + min_hp + ' -- metric ' + str(min_val) + '\n' \
         'AVERAGE metric -- ' + str(avg) + '\n' \
+        + failed_str + \
         'Total job time ' + job_time_str + '\n'
-        _write_result(hdfs_runid_dir, results)
+        util._write_result(hdfs_runid_dir, results)
         print(results)
     elif direction == 'min':
         param_combination = min_hp
@@ -100,283 +131,269 @@ def _launch(sc, map_fun, args_dict, samples, direction='max', local_logdir=False
         'BEST combination ' + min_hp + ' -- metric ' + str(min_val) + '\n' \
         'WORST combination ' + max_hp + ' -- metric ' + str(max_val) + '\n' \
         'AVERAGE metric -- ' + str(avg) + '\n' \
+        + failed_str + \
         'Total job time ' + job_time_str + '\n'
-        _write_result(hdfs_runid_dir, results)
+        util._write_result(hdfs_runid_dir, results)
         print(results)
 
     print('Finished Experiment \n')
 
     return hdfs_runid_dir, param_combination, best_val
 
-def _remove_duplicates(random_dict, samples):
-    hp_names = random_dict.keys()
-    concatenated_hp_combs_arr = []
-    for index in range(samples):
-        separated_hp_comb = ""
-        for hp in hp_names:
-            separated_hp_comb = separated_hp_comb + str(random_dict[hp][index]) + "%"
-        concatenated_hp_combs_arr.append(separated_hp_comb)
-
-    entry_index = 0
-    indices_to_skip = []
-    for entry in concatenated_hp_combs_arr:
-        inner_index = 0
-        for possible_dup_entry in concatenated_hp_combs_arr:
-            if entry == possible_dup_entry and inner_index > entry_index:
-                indices_to_skip.append(inner_index)
-            inner_index = inner_index + 1
-        entry_index = entry_index + 1
-    indices_to_skip = list(set(indices_to_skip))
-
-    for hp in hp_names:
-        index = 0
-        pruned_duplicates_arr = []
-        for random_value in random_dict[hp]:
-            if index not in indices_to_skip:
-                pruned_duplicates_arr.append(random_value)
-            index = index + 1
-        random_dict[hp] = pruned_duplicates_arr
-
-    return random_dict, samples - len(indices_to_skip)
-
-
-def _get_logdir(app_id):
+def _parse_boundaries(args_dict):
     """
+    Parses the boundary list of every hyperparameter
 
     Args:
-        app_id:
+        :args_dict: dict of hyperparameter name to its boundary list
 
     Returns:
-
+        list of dicts describing the distribution of each hyperparameter
     """
-    global run_id
-    return hopshdfs._get_experiments_dir() + '/' + app_id + '/random_search/run.' +  str(run_id)
+    params = []
+    for name, spec in args_dict.items():
+        spec = list(spec)
+        numeric = len(spec) >= 2 and all(isinstance(val, six.integer_types + (float,)) and not isinstance(val, bool) for val in spec[:2])
+        if numeric and (len(spec) == 2 or (len(spec) in (3, 4) and spec[2] in ('uniform', 'log'))):
+            lower, upper = spec[0], spec[1]
+            if not lower < upper:
+                raise ValueError('lower bound: ' + str(lower) + ' must be less than upper bound: ' + str(upper) + ' for ' + name)
+            log = len(spec) > 2 and spec[2] == 'log'
+            if log and lower <= 0:
+                raise ValueError('lower bound of log scaled hyperparameter ' + name + ' must be positive')
+            step = spec[3] if len(spec) == 4 else None
+            if step is not None and not step > 0:
+                raise ValueError('step of hyperparameter ' + name + ' must be positive')
+            is_int = isinstance(lower, six.integer_types) and isinstance(upper, six.integer_types) and \
+                     (step is None or isinstance(step, six.integer_types))
+            params.append({'name': name, 'kind': 'log' if log else 'uniform', 'int': is_int, 'lower': lower,
+                           'upper': upper, 'step': step})
+        elif len(spec) >= 2:
+            params.append({'name': name, 'kind': 'cat', 'categories': spec})
+        else:
+            raise ValueError('Hyperparameter ' + name + ' needs a [lower_bound, upper_bound] list or at least two categories')
+    return params
 
 
-#Helper to put Spark required parameter iter in function signature
-def _prepare_func(app_id, run_id, map_fun, args_dict, local_logdir):
+def _space_size(params):
     """
 
     Args:
-        app_id:
-        run_id:
-        map_fun:
-        args_dict:
-        local_logdir:
+        :params: the parsed hyperparameters
 
     Returns:
+        the number of distinct combinations, inf if a hyperparameter is continuous
+    """
+    size = 1
+    for param in params:
+        if param['kind'] == 'cat':
+            size *= len(param['categories'])
+        elif param['step'] is not None:
+            size *= int(math.floor((param['upper'] - param['lower']) / float(param['step']) + 1e-9)) + 1
+        elif param['int']:
+            size *= param['upper'] - param['lower'] + 1
+        else:
+            return float('inf')
+    return size
+
 
+class _UnitSampler(object):
     """
-    def _wrapper_fun(iter):
+    Draws points in the unit hypercube, successive draws continue the sequence
+    """
+
+    def __init__(self, dims, sampler):
+        """
+        Args:
+            :dims: number of dimensions
+            :sampler: 'random', 'halton' or 'sobol'
+        """
+        self.dims = dims
+        if sampler == 'sobol' and qmc is None:
+            print('Sobol sampling needs scipy 1.7 or later, using the Halton sequence instead')
+            sampler = 'halton'
+        if sampler == 'halton' and dims > len(_PRIMES):
+            print('The Halton sequence supports up to ' + str(len(_PRIMES)) + ' hyperparameters, using random sampling instead')
+            sampler = 'random'
+        self.sampler = sampler
+        self.index = 1
+        # a random shift of the sequence, every experiment gets different points with the same coverage
+        self.shift = np.random.rand(dims)
+        if sampler == 'sobol':
+            self.sobol = qmc.Sobol(dims, scramble=True)
+
+    def draw(self, n):
         """
 
         Args:
-            iter:
+            :n: number of points
 
         Returns:
-
+            n x dims matrix of points
         """
+        if self.sampler == 'random':
+            return np.random.rand(n, self.dims)
+        if self.sampler == 'sobol':
+            return self.sobol.random(n)
+        points = (_halton(self.index, n, self.dims) + self.shift) % 1.0
+        self.index += n
+        return points
 
-        for i in iter:
-            executor_num = i
-
-        tb_pid = 0
-        tb_hdfs_path = ''
-        hdfs_exec_logdir = ''
-
-        t = threading.Thread(target=devices._print_periodic_gpu_utilization)
-        if devices.get_num_gpus() > 0:
-            t.start()
-
-        try:
-            #Arguments
-            if args_dict:
-                argcount = six.get_function_code(map_fun).co_argcount
-                names = six.get_function_code(map_fun).co_varnames
-
-                args = []
-                argIndex = 0
-                param_string = ''
-                while argcount > 0:
-                    #Get args for executor and run function
-                    param_name = names[argIndex]
-                    param_val = args_dict[param_name][executor_num]
-                    param_string += str(param_name) + '=' + str(param_val) + '.'
-                    args.append(param_val)
-                    argcount -= 1
-                    argIndex += 1
-                param_string = param_string[:-1]
-                hdfs_exec_logdir, hdfs_appid_logdir = hopshdfs._create_directories(app_id, run_id, param_string, 'random_search')
-                pydoop.hdfs.dump('', os.environ['EXEC_LOGFILE'], user=hopshdfs.project_user())
-                hopshdfs._init_logger()
-                tb_hdfs_path, tb_pid = tensorboard._register(hdfs_exec_logdir, hdfs_appid_logdir, executor_num, local_logdir=local_logdir)
-
-                gpu_str = '\nChecking for GPUs in the environment' + devices._get_gpu_info()
-                hopshdfs.log(gpu_str)
-                print(gpu_str)
-                print('-------------------------------------------------------')
-                print('Started running task ' + param_string + '\n')
-                hopshdfs.log('Started running task ' + param_string)
-                task_start = datetime.datetime.now()
-                retval = map_fun(*args)
-                task_end = datetime.datetime.now()
-                _handle_return(retval, hdfs_exec_logdir)
-                time_str = 'Finished task ' + param_string + ' - took ' + util._time_diff(task_start, task_end)
-                print('\n' + time_str)
-                print('Returning metric ' + str(retval))
-                print('-------------------------------------------------------')
-                hopshdfs.log(time_str)
-        except:
-            #Always do cleanup
-            _cleanup(tb_hdfs_path)
-            if devices.get_num_gpus() > 0:
-                t.do_run = False
-                t.join()
-            raise
-        finally:
-            try:
-                if local_logdir:
-                    local_tb = tensorboard.local_logdir_path
-                    util._store_local_tensorboard(local_tb, hdfs_exec_logdir)
-            except:
-                pass
-
-        _cleanup(tb_hdfs_path)
-        if devices.get_num_gpus() > 0:
-            t.do_run = False
-            t.join()
 
-    return _wrapper_fun
-
-def _cleanup(tb_hdfs_path):
+def _halton(start, n, dims):
     """
+    Computes points of the Halton sequence, the radical inverse of the point index in one prime base per dimension
 
     Args:
-        tb_hdfs_path:
+        :start: index of the first point
+        :n: number of points
+        :dims: number of dimensions
 
     Returns:
-
+        n x dims matrix of points
     """
-    global experiment_json
-    handle = hopshdfs.get()
-    if not tb_hdfs_path == None and not tb_hdfs_path == '' and handle.exists(tb_hdfs_path):
-        handle.delete(tb_hdfs_path)
-    hopshdfs._kill_logger()
-
-def _handle_return(val, hdfs_exec_logdir):
+    points = np.zeros((n, dims))
+    for dim in range(dims):
+        base = _PRIMES[dim]
+        indices = np.arange(start, start + n)
+        scale = 1.0
+        while np.any(indices > 0):
+            scale /= base
+            indices, digits = np.divmod(indices, base)
+            points[:, dim] += digits * scale
+    return points
+
+
+def _map_samples(params, unit):
     """
+    Maps points in the unit hypercube to hyperparameter values
 
     Args:
-        val:
-        hdfs_exec_logdir:
+        :params: the parsed hyperparameters
+        :unit: n x len(params) matrix of points
 
     Returns:
-
+        list of columns with the values of each hyperparameter, as python types
     """
-    try:
-        test = int(val)
-    except:
-        raise ValueError('Your function needs to return a metric (number) which should be maximized or minimized')
-
-    metric_file = hdfs_exec_logdir + '/metric'
-    fs_handle = hopshdfs.get_fs()
-    try:
-        fd = fs_handle.open_file(metric_file, mode='w')
-    except:
-        fd = fs_handle.open_file(metric_file, flags='w')
-    fd.write(str(float(val)).encode())
-    fd.flush()
-    fd.close()
-
-
-def _get_best(args_dict, num_combinations, arg_names, arg_count, hdfs_appid_dir, run_id):
+    columns = []
+    for dim, param in enumerate(params):
+        u = unit[:, dim]
+        if param['kind'] == 'cat':
+            categories = param['categories']
+            indices = np.minimum((u * len(categories)).astype(int), len(categories) - 1)
+            columns.append([categories[i] for i in indices])
+            continue
+
+        lower, upper, step = param['lower'], param['upper'], param['step']
+        if param['kind'] == 'log':
+            values = np.exp(math.log(lower) + u * (math.log(upper) - math.log(lower)))
+        elif param['int'] and step is None:
+            values = lower + np.floor(u * (upper - lower + 1))
+        else:
+            values = lower + u * (upper - lower)
+        if step is not None:
+            values = lower + np.round((values - lower) / step) * step
+            # rounding can go past upper, the largest reachable value is lower + k * step
+            values = np.where(values > upper, values - step, values)
+            # lower + k * step is not exact in floating point, e.g. 0.1 + 2 * 0.1
+            values = np.round(values, 12)
+        values = np.clip(values, lower, upper)
+        if param['int']:
+            values = np.round(values).astype(int)
+        columns.append(values.tolist())
+    return columns
+
+
+def _sample_unique(params, samples, sampler='random'):
     """
+    Samples distinct hyperparameter combinations, duplicates are replaced by new samples
 
     Args:
-        args_dict:
-        num_combinations:
-        arg_names:
-        arg_count:
-        hdfs_appid_dir:
-        run_id:
+        :params: the parsed hyperparameters
+        :samples: number of combinations
+        :sampler: 'random', 'halton' or 'sobol'
 
     Returns:
-
+        dict of hyperparameter name to its list of values, the number of combinations
     """
+    size = _space_size(params)
+    if size < samples:
+        print('The search space only has ' + str(size) + ' distinct combinations, running ' + str(size) + ' instead of ' + str(samples))
+        samples = size
+
+    unit_sampler = _UnitSampler(len(params), sampler)
+    seen = set()
+    rows = []
+    missing = samples
+    for _ in range(_TOP_UP_ROUNDS):
+        # draw more than missing when topping up, most of the new samples of a nearly exhausted space are duplicates
+        n = missing if len(rows) == 0 else 2 * missing
+        for row in zip(*_map_samples(params, unit_sampler.draw(n))):
+            if row not in seen:
+                seen.add(row)
+                rows.append(row)
+                if len(rows) == samples:
+                    break
+        missing = samples - len(rows)
+        if missing == 0:
+            break
+
+    if len(rows) < samples:
+        print('Could only sample ' + str(len(rows)) + ' distinct combinations of the ' + str(samples) + ' requested')
+
+    columns = list(zip(*rows)) if len(rows) > 0 else [[] for _ in params]
+    return dict((param['name'], list(column)) for param, column in zip(params, columns)), len(rows)
 
-    max_hp = ''
-    max_val = ''
-
-    min_hp = ''
-    min_val = ''
-
-    results = []
-
-    first = True
 
-    for i in range(num_combinations):
-
-        argIndex = 0
-        param_string = ''
-
-        num_args = arg_count
-
-        while num_args > 0:
-            #Get args for executor and run function
-            param_name = arg_names[argIndex]
-            param_val = args_dict[param_name][i]
-            param_string += str(param_name) + '=' + str(param_val) + '.'
-            num_args -= 1
-            argIndex += 1
-
-        param_string = param_string[:-1]
+def _get_logdir(app_id):
+    """
 
-        path_to_metric = hdfs_appid_dir + '/random_search/run.' + str(run_id) + '/' + param_string + '/metric'
+    Args:
+        app_id:
 
-        metric = None
+    Returns:
 
-        with pydoop.hdfs.open(path_to_metric, "r") as fi:
-            metric = float(fi.read())
-            fi.close()
+    """
+    global run_id
+    return hopshdfs._get_experiments_dir() + '/' + app_id + '/random_search/run.' +  str(run_id)
 
-            if first:
-                max_hp = param_string
-                max_val = metric
-                min_hp = param_string
-                min_val = metric
-                first = False
 
-            if metric > max_val:
-                max_val = metric
-                max_hp = param_string
-            if metric <  min_val:
-                min_val = metric
-                min_hp = param_string
+#Helper to put Spark required parameter iter in function signature
+def _prepare_func(app_id, run_id, map_fun, args_dict, local_logdir, metric_server_addr, retries, secret=None):
+    """
 
+    Args:
+        app_id:
+        run_id:
+        map_fun:
+        args_dict:
+        local_logdir:
+        metric_server_addr:
+        retries:
+        secret:
 
-        results.append(metric)
+    Returns:
 
-    avg = sum(results)/float(len(results))
+    """
+    def _wrapper_fun(iter):
+        """
 
-    return max_val, max_hp, min_val, min_hp, avg
+        Args:
+            iter:
 
-def _write_result(runid_dir, string):
-    """
+        Returns:
+            list with the parameter string and metric of the trial
 
-    Args:
-        runid_dir:
-        string:
+        """
 
-    Returns:
+        trials = list(iter)
+        if not trials:
+            return []
 
-    """
-    metric_file = runid_dir + '/summary'
-    fs_handle = hopshdfs.get_fs()
-    try:
-        fd = fs_handle.open_file(metric_file, mode='w')
-    except:
-        fd = fs_handle.open_file(metric_file, flags='w')
-    fd.write(string.encode())
-    fd.flush()
-    fd.close()
+        with runtime.Task(app_id, run_id, 'random_search', trials[0], local_logdir=local_logdir) as task:
+            #Arguments
+            if args_dict:
+                return runtime._run_trials(task, map_fun, args_dict, trials, metric_server_addr, retries, secret=secret)
+            return []
 
+    return _wrapper_fun
@@ -0,0 +1,514 @@
+"""
+Executor side runtime shared by the launchers.
+
+Every Spark task that runs user code goes through the same steps: sampling the GPUs, the directories and the
+logfile of the run, TensorBoard, banners and timing around the user function, the metric file and the cleanup when the
+task ends. A *Task* does these steps and the launchers only add what is specific to them, e.g. the trials of a search or
+forming the cluster of a distributed strategy.
+
+The setup steps that do not depend on each other run at the same time on a small thread pool: the GPUs are probed through
+NVML while the directories are created, and the logfile is opened while TensorBoard is prepared. TensorBoard
+itself only starts when the task first calls *tensorboard.logdir()*. Before the first run the task prints how long
+the setup took and each of its steps.
+
+Cross-cutting behaviour plugs in with hooks, subclasses of *Hook* overriding the steps they need. Hooks in *hooks* run
+for every task of the executor process, hooks passed to a Task only for that task.
+
+>>> from hops import runtime
+>>> class Timing(runtime.Hook):
+>>>     def before_run(self, task, name):
+>>>         self.start = time.time()
+>>>     def after_run(self, task, name, result):
+>>>         print(name + ' ran for ' + str(time.time() - self.start) + 's')
+>>> runtime.hooks.append(Timing())
+"""
+
+from __future__ import absolute_import
+
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import datetime
+import threading
+import time
+
+import six
+
+from hops import devices
+from hops import hdfs as hopshdfs
+from hops import metrics as hopsmetrics
+from hops import telemetry
+from hops import tensorboard
+from hops import util
+
+# hooks of every task of this executor process
+hooks = []
+
+# setup steps of a task running at the same time
+BOOTSTRAP_CONCURRENCY = 4
+
+# seconds between two prints of the GPU utilization
+GPU_PRINT_INTERVAL = 10
+
+_RULE = '-------------------------------------------------------'
+
+
+class Hook(object):
+    """Callbacks of a Task, every method does nothing unless overridden."""
+
+    def on_start(self, task):
+        """
+        Called when the task starts, before its directories exist.
+
+        Args:
+            :task: the Task
+        """
+
+    def on_setup(self, task):
+        """
+        Called once the logfile and TensorBoard of the task are started.
+
+        Args:
+            :task: the Task
+        """
+
+    def before_run(self, task, name):
+        """
+        Called right before the user function runs.
+
+        Args:
+            :task: the Task
+            :name: the parameter string of the trial, '' if the task runs no trials
+        """
+
+    def after_run(self, task, name, result):
+        """
+        Called right after the user function returned, not if it raised.
+
+        Args:
+            :task: the Task
+            :name: the parameter string of the trial, '' if the task runs no trials
+            :result: what the function returned
+        """
+
+    def on_close(self, task, failed):
+        """
+        Called when the task ends, after its cleanup.
+
+        Args:
+            :task: the Task
+            :failed: True if the task raised
+        """
+
+
+class Task(object):
+    """
+    The runtime of one Spark task, used as context manager so that the cleanup runs however the task ends.
+
+    >>> with runtime.Task(app_id, run_id, 'launcher', executor_num, local_logdir) as task:
+    >>>     task.setup()
+    >>>     retval = task.run(map_fun)
+    >>>     task.handle_return(retval)
+    """
+
+    def __init__(self, app_id, run_id, type, executor_num, local_logdir=False, hooks=None):
+        """
+        Args:
+            :app_id: the application id
+            :run_id: the run of the experiment
+            :type: the type of the experiment, the directory of its runs
+            :executor_num: the partition of the task
+            :local_logdir: True to write the TensorBoard logdir locally and copy it to HDFS at the end
+            :hooks: list of Hook of this task only
+        """
+        self.app_id = app_id
+        self.run_id = run_id
+        self.type = type
+        self.executor_num = executor_num
+        self.local_logdir = local_logdir
+        self.hooks = list(hooks or [])
+        self.param_string = None
+        self.hdfs_exec_logdir = ''
+        self.hdfs_appid_logdir = ''
+        self.tb_hdfs_path = ''
+        self.tb_pid = 0
+        # True once this task owns the logfile, the workers of a distributed run only print
+        self.logging = False
+        # True if the trials of the task share the logfile and TensorBoard of the run directory
+        self.shared = False
+        # seconds spent in every setup step, steps on the thread pool overlap
+        self.bootstrap = OrderedDict()
+        self._start_time = None
+        self._pool = None
+        self._gpus = None
+        self._gpu_str = None
+        self._sampler = None
+        # summary of the GPU samples of the task, set when it closes
+        self.telemetry = None
+        self._ran = False
+        # the heartbeat of an aborted task may close it while the task itself returns
+        self._close_lock = threading.Lock()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close(failed=exc_type is not None)
+        return False
+
+    def _notify(self, method, *args):
+        """
+        Calls a method of every hook, a failing hook is reported and does not fail the task.
+
+        Args:
+            :method: name of the Hook method
+            :args: its arguments
+        """
+        for hook in hooks + self.hooks:
+            try:
+                getattr(hook, method)(self, *args)
+            except Exception as e:
+                print('Hook ' + type(hook).__name__ + '.' + method + ' failed: ' + str(e))
+
+    def _timed(self, step, fun, *args, **kwargs):
+        """
+        Runs a setup step and adds its duration to *bootstrap*.
+
+        Args:
+            :step: name of the step
+            :fun: the step
+            :args: its arguments
+            :kwargs: its keyword arguments
+
+        Returns:
+            what fun returned
+        """
+        step_start = time.time()
+        try:
+            return fun(*args, **kwargs)
+        finally:
+            self.bootstrap[step] = self.bootstrap.get(step, 0.0) + time.time() - step_start
+
+    def _start_sampler(self):
+        """
+        Starts sampling the GPUs in the background if the executor has any.
+
+        Returns:
+            the number of GPUs
+        """
+        num_gpus = telemetry.num_gpus()
+        if num_gpus > 0:
+            self._sampler = telemetry.Sampler(print_interval=GPU_PRINT_INTERVAL).start()
+        return num_gpus
+
+    def start(self):
+        """
+        Starts probing the GPUs in the background, and the GPU sampler if there are any.
+
+        Returns:
+            the task
+        """
+        self._start_time = time.time()
+        self._pool = ThreadPool(BOOTSTRAP_CONCURRENCY)
+        self._gpus = self._pool.apply_async(self._timed, ('gpus', self._start_sampler))
+        self._gpu_str = self._pool.apply_async(self._timed, ('gpu info', devices._get_gpu_info))
+        self._notify('on_start')
+        return self
+
+    def num_gpus(self):
+        """
+        Returns:
+            the number of GPUs of the executor, probed once when the task started
+        """
+        return self._gpus.get()
+
+    def gpu_info(self):
+        """
+        Returns:
+            the GPUs of the executor as printed before every run
+        """
+        return '\nChecking for GPUs in the environment' + self._gpu_str.get()
+
+    def create_directories(self, param_string=None, sub_type=None, keep=False):
+        """
+        Creates the directory of the run, or of a trial of the run.
+
+        Args:
+            :param_string: the parameter string of the trial, None if the task runs no trials
+            :sub_type: directory of the trial between the run and the trial directory, e.g. the generation
+            :keep: True to keep the contents of an existing directory
+
+        Returns:
+            the directory
+        """
+        self.param_string = param_string
+        self.hdfs_exec_logdir, self.hdfs_appid_logdir = self._timed('directories', hopshdfs._create_directories,
+                                                                    self.app_id, self.run_id, param_string, self.type,
+                                                                    sub_type=sub_type, keep=keep)
+        return self.hdfs_exec_logdir
+
+    def init_logdir(self, shared=False):
+        """
+        Starts the logfile and TensorBoard of the task for the directory created last.
+
+        Args:
+            :shared: True if several trials of the task share them, they are started once on the run directory and
+                     TensorBoard follows the directory of the current trial
+        """
+        if shared:
+            self.shared = True
+            if not self.tb_hdfs_path:
+                hdfs_runid_logdir = self.hdfs_appid_logdir + '/' + self.type + '/run.' + str(self.run_id)
+                self._init_logdir(hdfs_runid_logdir, hopshdfs._init_task_logger, hdfs_runid_logdir, self.executor_num)
+            tensorboard._set_trial_logdir(self.hdfs_exec_logdir, self.param_string)
+        else:
+            # opening the logfile creates it
+            self._init_logdir(self.hdfs_exec_logdir, hopshdfs._init_logger, self.executor_num)
+
+    def _init_logdir(self, tb_logdir, init_logger, *args):
+        """
+        Opens the logfile on the thread pool while TensorBoard is prepared.
+
+        Args:
+            :tb_logdir: the directory TensorBoard shows
+            :init_logger: function opening the logfile
+            :args: its arguments
+        """
+        logger = self._pool.apply_async(self._timed, ('logfile', init_logger) + args)
+        self.tb_hdfs_path, self.tb_pid = self._timed('tensorboard', tensorboard._register, tb_logdir,
+                                                     self.hdfs_appid_logdir, self.executor_num,
+                                                     local_logdir=self.local_logdir)
+        logger.get()
+        self.logging = True
+        self._notify('on_setup')
+
+    def setup(self, param_string=None, keep=False):
+        """
+        Creates the directory, logfile and TensorBoard of a task running a single function.
+
+        Args:
+            :param_string: the parameter string of the function, None if it takes no arguments
+            :keep: True to keep the contents of an existing directory
+
+        Returns:
+            the directory
+        """
+        self.create_directories(param_string, keep=keep)
+        self.init_logdir()
+        return self.hdfs_exec_logdir
+
+    def log(self, msg, level='INFO', step=None):
+        """
+        Writes to the logfile if this task owns it.
+
+        Args:
+            :msg: the message
+            :level: level of the message
+            :step: the training step the message belongs to, optional
+        """
+        if self.logging:
+            hopshdfs.log(msg, level=level, step=step)
+
+    def run(self, fun, name=''):
+        """
+        Runs the user function with banners and timing.
+
+        Args:
+            :fun: function without arguments
+            :name: the parameter string of the trial, '' if the task runs no trials
+
+        Returns:
+            what fun returned
+        """
+        gpu_str = self.gpu_info()
+        if not self._ran:
+            self.num_gpus()
+            self._report_bootstrap()
+        started = 'Started running task' + (' ' + name if name else '')
+        self.log(gpu_str)
+        print(gpu_str)
+        print(_RULE)
+        print(started + '\n')
+        self.log(started)
+        self._ran = True
+        self._notify('before_run', name)
+        task_start = datetime.datetime.now()
+        result = fun()
+        task_end = datetime.datetime.now()
+        self._notify('after_run', name, result)
+        time_str = 'Finished task ' + (name + ' ' if name else '') + '- took ' + util._time_diff(task_start, task_end)
+        print('\n' + time_str)
+        self.log(time_str)
+        return result
+
+    def _report_bootstrap(self):
+        """Prints and logs how long the setup before the first run took, in total and per step."""
+        total = time.time() - self._start_time
+        steps = ', '.join([step + ' ' + '{0:.2f}s'.format(seconds) for step, seconds in self.bootstrap.items()])
+        msg = 'Bootstrap took {0:.2f}s ({1})'.format(total, steps)
+        print(msg)
+        self.log(msg)
+
+    def handle_return(self, val):
+        """
+        Writes the metric the user function returned to the directory created last.
+
+        Args:
+            :val: the metric
+        """
+        _handle_return(val, self.hdfs_exec_logdir)
+        print('Returning metric ' + str(val))
+
+    def store_tensorboard(self):
+        """Copies the local TensorBoard logdir to the directory created last."""
+        if self.local_logdir and self.tb_hdfs_path:
+            util._store_local_tensorboard(tensorboard.local_logdir_path, self.hdfs_exec_logdir)
+
+    def _stop_sampler(self):
+        """
+        Stops the GPU sampler and publishes its summary to the metric server.
+        """
+        # the sampler is started by the probe on the pool
+        self._gpus.wait()
+        if self._sampler is None:
+            return
+        self.telemetry = self._sampler.stop()
+        self._sampler = None
+        try:
+            hopsmetrics._publish_telemetry('task' + str(self.executor_num), self.telemetry)
+        except Exception as e:
+            print('Could not publish the GPU telemetry: ' + str(e))
+
+    def close(self, failed=False):
+        """
+        Disconnects from the metric server, stores the local TensorBoard logdir, removes the TensorBoard endpoint and
+        stops the logfile and the GPU sampler. The summary of the GPU samples goes to the metric server before it
+        disconnects, so that the driver records it with the experiment. Only the first call closes the task.
+
+        Args:
+            :failed: True if the task raised, errors of the cleanup are then ignored so that the original one surfaces
+        """
+        if not self._close_lock.acquire(False):
+            return
+        try:
+            self._stop_sampler()
+            hopsmetrics._disconnect()
+            if not self.shared:
+                try:
+                    self.store_tensorboard()
+                except:
+                    if not failed:
+                        raise
+        finally:
+            if self._ran:
+                print(_RULE)
+            _cleanup(self.tb_hdfs_path)
+            self.logging = False
+            self._pool.close()
+            self._pool.join()
+            self._notify('on_close', failed)
+
+
+def _trial_args(map_fun, args_dict, index):
+    """
+    Args:
+        :map_fun: the user function
+        :args_dict: dict of the argument names of map_fun to lists of values
+        :index: the trial
+
+    Returns:
+        the arguments of the trial and its parameter string
+    """
+    code = six.get_function_code(map_fun)
+    names = code.co_varnames[:code.co_argcount]
+    args = [args_dict[name][index] for name in names]
+    param_string = '.'.join([str(name) + '=' + str(val) for name, val in zip(names, args)])
+    return args, param_string
+
+
+def _run_trials(task, map_fun, args_dict, trials, metric_server_addr, retries, sub_type=None, evaluated=None, secret=None):
+    """
+    Runs the trials of a search task one after the other. A retried task skips the trials it finished before it failed,
+    and several trials of a task share one logfile and TensorBoard.
+
+    Args:
+        :task: the Task
+        :map_fun: the user function
+        :args_dict: dict of the argument names of map_fun to lists of values
+        :trials: indices of the trials of the task
+        :metric_server_addr: address of the metric server
+        :retries: number of times a trial is run again after it raised
+        :sub_type: directory of the trials between the run and the trial directory, e.g. the generation
+        :evaluated: dict of param_string to metric of combinations evaluated before, they are not run again
+        :secret: the secret the metric server was started with
+
+    Returns:
+        list of the parameter string and metric of every trial, the metric of a failed trial is nan
+    """
+    shared = len(trials) > 1
+    results = []
+    for index in trials:
+        args, param_string = _trial_args(map_fun, args_dict, index)
+        name = param_string if sub_type is None else sub_type + '/' + param_string
+        hdfs_exec_logdir = task.create_directories(param_string, sub_type=sub_type)
+        retval = hopshdfs._finished_metric(hdfs_exec_logdir)
+        if retval is not None:
+            print('Reading returned metric of finished task ' + param_string + ': ' + str(retval))
+            hopsmetrics._connect(metric_server_addr, index, name, param_string=param_string, secret=secret)
+            hopsmetrics._finish(retval)
+            results.append((param_string, retval))
+            continue
+        task.init_logdir(shared=shared)
+        hopsmetrics._connect(metric_server_addr, index, name, param_string=param_string, secret=secret)
+        val = evaluated.get(param_string) if evaluated else None
+        if val is not None:
+            print('Reading returned metric from previous run: ' + str(val))
+            retval, error = val, None
+        else:
+            retval, error = task.run(lambda: util._run_trial(map_fun, args, retries, param_string, hdfs_exec_logdir),
+                                     param_string)
+        if error is None:
+            task.handle_return(retval)
+            hopsmetrics._finish(retval)
+            results.append((param_string, float(retval)))
+        else:
+            results.append((param_string, float('nan')))
+        if shared:
+            task.store_tensorboard()
+    return results
+
+
+def _handle_return(val, hdfs_exec_logdir):
+    """
+    Writes the metric of a run or trial to its directory.
+
+    Args:
+        :val: the metric
+        :hdfs_exec_logdir: the directory of the run or trial
+    """
+    try:
+        test = int(val)
+    except:
+        raise ValueError('Your function needs to return a metric (number) which should be maximized or minimized')
+
+    metric_file = hdfs_exec_logdir + '/metric'
+    fs_handle = hopshdfs.get_fs()
+    try:
+        fd = fs_handle.open_file(metric_file, mode='w')
+    except:
+        fd = fs_handle.open_file(metric_file, flags='w')
+    fd.write(str(float(val)).encode())
+    fd.flush()
+    fd.close()
+
+
+def _cleanup(tb_hdfs_path):
+    """
+    Removes the TensorBoard endpoint file and stops the logfile.
+
+    Args:
+        :tb_hdfs_path: the TensorBoard endpoint file, '' if the task did not start TensorBoard
+    """
+    handle = hopshdfs.get()
+    if not tb_hdfs_path == None and not tb_hdfs_path == '' and handle.exists(tb_hdfs_path):
+        handle.delete(tb_hdfs_path)
+    hopshdfs._kill_logger()
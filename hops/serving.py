@@ -7,7 +7,6 @@ Utility functions to export models to the Models dataset and get information abo
 from hops import hdfs
 
 import os
-import pydoop.hdfs
 import json
 import base64
 
@@ -36,23 +35,9 @@ def export(local_model_path, model_name, model_version):
     model_name_root_directory = project_path + '/Models/' + str(model_name) + '/' + str(model_version) + '/'
     hdfs_handle.create_directory(model_name_root_directory)
 
-    for (path, dirs, files) in os.walk(local_model_path):
-
-        hdfs_export_subpath = path.replace(local_model_path, '')
-
-        current_hdfs_dir = model_name_root_directory + '/' + hdfs_export_subpath
-
-        if not hdfs_handle.exists(current_hdfs_dir):
-            hdfs_handle.create_directory(model_name_root_directory)
-
-        for f in files:
-            if not hdfs_handle.exists(current_hdfs_dir + '/' + f):
-                pydoop.hdfs.put(path + '/' + f, current_hdfs_dir)
-
-        for d in dirs:
-            if not hdfs_handle.exists(current_hdfs_dir + '/' + d):
-                pydoop.hdfs.put(path + '/' + d, current_hdfs_dir + '/')
-        break
+    # Upload the model files in parallel, files already exported are left untouched
+    hdfs._upload([(os.path.join(local_model_path, entry), model_name_root_directory + entry)
+                  for entry in os.listdir(local_model_path)], overwrite=False)
 
 def get_serving_endpoint(model, project=None):
     """
@@ -0,0 +1,420 @@
+"""
+GPU telemetry of the executor.
+
+Devices are read through NVML with the pynvml bindings if they are installed, otherwise with nvidia-smi, and an
+executor where neither finds a GPU has none. The static information of the devices, their names, memory and numbers,
+is read once per process. A *Sampler* samples the utilization and memory of every GPU on a background thread at a
+configurable rate into a ring buffer, and summarizes all samples it took when it stops. Every task of an experiment
+samples its GPUs this way and the summaries end up in the experiment record.
+
+>>> from hops import telemetry
+>>> telemetry.num_gpus()
+>>> sampler = telemetry.Sampler(interval=0.5).start()
+>>> ...
+>>> sampler.stop()
+>>> sampler.summary()
+
+On machines without GPUs a fake NVML stands in for the bindings:
+
+>>> telemetry.set_backend(telemetry.NvmlBackend(telemetry.FakeNvml([{'name': 'Tesla P100', 'memory_total': 16280}])))
+>>> telemetry.devices()
+[{'index': 0, 'name': 'Tesla P100', 'memory_total': 16280, 'minor_number': 0, 'pci_bus_id': '00000000:00:00.0'}]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import socket
+import subprocess
+import threading
+import time
+
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
+# seconds between two samples of a Sampler
+SAMPLE_INTERVAL = 1.0
+# samples kept by a Sampler, older ones are dropped but still count in its summary
+SAMPLE_CAPACITY = 600
+
+_MB = 1024 * 1024
+
+_lock = threading.Lock()
+_backend = None
+_devices = None
+
+
+class NvmlBackend(object):
+    """Reads the GPUs through NVML, without starting a process."""
+
+    def __init__(self, nvml=None):
+        """
+        Args:
+            :nvml: the pynvml module, or a stand-in like FakeNvml
+        """
+        self.nvml = pynvml if nvml is None else nvml
+        self.nvml.nvmlInit()
+        self.handles = [self.nvml.nvmlDeviceGetHandleByIndex(i) for i in range(self.nvml.nvmlDeviceGetCount())]
+
+    def devices(self):
+        """
+        Returns:
+            list of dicts with the 'index', 'name', 'memory_total' in MB, 'minor_number' and 'pci_bus_id' of every GPU
+        """
+        result = []
+        for index, handle in enumerate(self.handles):
+            result.append({'index': index,
+                           'name': _str(self.nvml.nvmlDeviceGetName(handle)),
+                           'memory_total': self.nvml.nvmlDeviceGetMemoryInfo(handle).total // _MB,
+                           'minor_number': self.nvml.nvmlDeviceGetMinorNumber(handle),
+                           'pci_bus_id': _str(self.nvml.nvmlDeviceGetPciInfo(handle).busId)})
+        return result
+
+    def sample(self):
+        """
+        Returns:
+            list of dicts with the 'utilization' in percent and 'memory_used' in MB of every GPU
+        """
+        result = []
+        for handle in self.handles:
+            result.append({'utilization': self.nvml.nvmlDeviceGetUtilizationRates(handle).gpu,
+                           'memory_used': self.nvml.nvmlDeviceGetMemoryInfo(handle).used // _MB})
+        return result
+
+
+class SmiBackend(object):
+    """Reads the GPUs with nvidia-smi, every call starts a process."""
+
+    def _query(self, fields):
+        """
+        Args:
+            :fields: comma separated nvidia-smi query fields
+
+        Returns:
+            list of the values of every GPU
+        """
+        output = subprocess.check_output(["nvidia-smi", "--format=csv,noheader,nounits", "--query-gpu=" + fields]).decode()
+        return [[value.strip() for value in line.split(',')] for line in output.split('\n') if len(line) > 0]
+
+    def devices(self):
+        """
+        Returns:
+            list of dicts with the 'index', 'name', 'memory_total' in MB, 'minor_number' and 'pci_bus_id' of every GPU
+        """
+        result = []
+        for index, name, memory_total, pci_bus_id in self._query('index,name,memory.total,pci.bus_id'):
+            result.append({'index': int(index), 'name': name, 'memory_total': int(memory_total),
+                           'minor_number': _minor_number(pci_bus_id, int(index)), 'pci_bus_id': pci_bus_id})
+        return result
+
+    def sample(self):
+        """
+        Returns:
+            list of dicts with the 'utilization' in percent and 'memory_used' in MB of every GPU
+        """
+        return [{'utilization': int(utilization), 'memory_used': int(memory_used)}
+                for utilization, memory_used in self._query('utilization.gpu,memory.used')]
+
+
+class FakeNvml(object):
+    """
+    Stand-in for the pynvml module for tests on machines without GPUs, pass it to NvmlBackend.
+    """
+
+    class _Struct(object):
+        """The structs NVML returns."""
+
+        def __init__(self, **fields):
+            self.__dict__.update(fields)
+
+    def __init__(self, devices):
+        """
+        Args:
+            :devices: list of dicts with the 'name' and 'memory_total' in MB of every GPU, optionally its 'minor_number',
+                      'pci_bus_id', and its 'utilization' in percent and 'memory_used' in MB, numbers or functions
+                      without arguments returning the current value
+        """
+        self._devices = devices
+
+    def _value(self, handle, key):
+        value = self._devices[handle].get(key, 0)
+        return value() if callable(value) else value
+
+    def nvmlInit(self):
+        pass
+
+    def nvmlShutdown(self):
+        pass
+
+    def nvmlDeviceGetCount(self):
+        return len(self._devices)
+
+    def nvmlDeviceGetHandleByIndex(self, index):
+        return index
+
+    def nvmlDeviceGetName(self, handle):
+        return self._devices[handle]['name'].encode()
+
+    def nvmlDeviceGetMemoryInfo(self, handle):
+        total = self._devices[handle]['memory_total'] * _MB
+        used = self._value(handle, 'memory_used') * _MB
+        return FakeNvml._Struct(total=total, used=used, free=total - used)
+
+    def nvmlDeviceGetUtilizationRates(self, handle):
+        return FakeNvml._Struct(gpu=self._value(handle, 'utilization'), memory=0)
+
+    def nvmlDeviceGetMinorNumber(self, handle):
+        return self._devices[handle].get('minor_number', handle)
+
+    def nvmlDeviceGetPciInfo(self, handle):
+        bus_id = self._devices[handle].get('pci_bus_id', '00000000:{0:02X}:00.0'.format(handle))
+        return FakeNvml._Struct(busId=bus_id.encode())
+
+
+def _str(value):
+    """
+    Args:
+        :value: a string NVML returned, bytes with older bindings
+
+    Returns:
+        the string
+    """
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
+
+
+def _minor_number(pci_bus_id, index):
+    """
+    The minor number of a GPU, its /dev/nvidia<minor number> device, which nvidia-smi can not query.
+
+    Args:
+        :pci_bus_id: the PCI bus id of the GPU
+        :index: the index of the GPU, used if the driver does not list the GPU in /proc
+
+    Returns:
+        the minor number
+    """
+    # the driver lists the GPUs by their bus id in lower case and with a 4 digit domain
+    bus_id = pci_bus_id.lower()[-12:]
+    try:
+        with open('/proc/driver/nvidia/gpus/' + bus_id + '/information') as f:
+            for line in f:
+                if line.startswith('Device Minor:'):
+                    return int(line.split(':', 1)[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return index
+
+
+def _detect():
+    """
+    Returns:
+        NvmlBackend if the pynvml bindings are installed and NVML finds the driver, otherwise SmiBackend
+    """
+    if pynvml is not None:
+        try:
+            return NvmlBackend()
+        except Exception:
+            pass
+    return SmiBackend()
+
+
+def backend():
+    """
+    Returns:
+        the backend of this process, detected on the first call
+    """
+    global _backend
+    with _lock:
+        if _backend is None:
+            _backend = _detect()
+        return _backend
+
+
+def set_backend(new_backend):
+    """
+    Replaces the backend of this process, e.g. with NvmlBackend(FakeNvml(...)) in tests, and drops the cached devices.
+
+    Args:
+        :new_backend: the backend, None to detect it again
+    """
+    global _backend
+    global _devices
+    with _lock:
+        _backend = new_backend
+        _devices = None
+
+
+def devices():
+    """
+    The GPUs of the executor, read once per process.
+
+    Returns:
+        list of dicts with the 'index', 'name', 'memory_total' in MB, 'minor_number' and 'pci_bus_id' of every GPU,
+        empty if there are none
+    """
+    global _devices
+    current = backend()
+    with _lock:
+        if _devices is None:
+            try:
+                _devices = current.devices()
+            except Exception:
+                _devices = []
+        return [dict(device) for device in _devices]
+
+
+def num_gpus():
+    """
+    Returns:
+        the number of GPUs of the executor
+    """
+    return len(devices())
+
+
+def sample():
+    """
+    Reads the current utilization and memory of the GPUs.
+
+    Returns:
+        list of dicts with the 'utilization' in percent and 'memory_used' in MB of every GPU, empty if there are none or
+        they can not be read
+    """
+    if num_gpus() == 0:
+        return []
+    try:
+        return backend().sample()
+    except Exception:
+        return []
+
+
+class Sampler(object):
+    """
+    Samples the GPUs on a daemon thread. The last *capacity* samples are kept, the summary covers all samples.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, capacity=SAMPLE_CAPACITY, print_interval=None):
+        """
+        Args:
+            :interval: seconds between two samples
+            :capacity: number of samples kept
+            :print_interval: seconds between two prints of the utilization, None to not print it
+        """
+        self.interval = interval
+        self.print_interval = print_interval
+        self.buffer = collections.deque(maxlen=capacity)
+        self.count = 0
+        self.lock = threading.Lock()
+        self._totals = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_time = None
+        self._end_time = None
+
+    def start(self):
+        """
+        Starts sampling, does nothing without GPUs.
+
+        Returns:
+            the sampler
+        """
+        self._start_time = time.time()
+        if num_gpus() > 0:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def _run(self):
+        """Takes a sample every interval seconds until stopped."""
+        last_print = time.time()
+        while True:
+            samples = self._sample()
+            if self.print_interval is not None and samples and time.time() - last_print >= self.print_interval:
+                print(_format_utilization(samples))
+                last_print = time.time()
+            if self._stop.wait(self.interval):
+                return
+
+    def _sample(self):
+        """
+        Adds the current utilization and memory of the GPUs to the buffer and the totals.
+
+        Returns:
+            the sample, empty if the GPUs could not be read
+        """
+        samples = sample()
+        if not samples:
+            return samples
+        with self.lock:
+            self.buffer.append((time.time(), samples))
+            self.count += 1
+            while len(self._totals) < len(samples):
+                self._totals.append({'utilization': 0, 'utilization_max': 0, 'memory_used': 0, 'memory_used_max': 0})
+            for totals, device in zip(self._totals, samples):
+                totals['utilization'] += device['utilization']
+                totals['utilization_max'] = max(totals['utilization_max'], device['utilization'])
+                totals['memory_used'] += device['memory_used']
+                totals['memory_used_max'] = max(totals['memory_used_max'], device['memory_used'])
+        return samples
+
+    def stop(self):
+        """
+        Stops sampling.
+
+        Returns:
+            the summary
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._end_time = time.time()
+        return self.summary()
+
+    def samples(self):
+        """
+        Returns:
+            list of the (time, sample) kept in the buffer, oldest first
+        """
+        with self.lock:
+            return list(self.buffer)
+
+    def summary(self):
+        """
+        Returns:
+            dict with the 'host', the 'seconds' sampled, the number of 'samples' and the 'devices', a dict for every GPU
+            with its static information and the mean and max of its 'utilization' and 'memory_used'
+        """
+        end_time = self._end_time if self._end_time is not None else time.time()
+        with self.lock:
+            count = self.count
+            result = []
+            for device, totals in zip(devices(), self._totals):
+                device['utilization_mean'] = round(totals['utilization'] / float(count), 1)
+                device['utilization_max'] = totals['utilization_max']
+                device['memory_used_mean'] = round(totals['memory_used'] / float(count), 1)
+                device['memory_used_max'] = totals['memory_used_max']
+                result.append(device)
+        return {'host': socket.gethostname(), 'seconds': round(end_time - (self._start_time or end_time), 1),
+                'samples': count, 'devices': result}
+
+
+def _format_utilization(samples):
+    """
+    Args:
+        :samples: a sample of every GPU
+
+    Returns:
+        the utilization and memory of the GPUs as printed while a task runs
+    """
+    gpu_str = '\n------------------------------ GPU usage information ------------------------------\n'
+    for device, current in zip(devices(), samples):
+        gpu_str += '[Type: ' + device['name'] + ', Memory Usage: ' + str(current['memory_used']) + ' /' + \
+                   str(device['memory_total']) + ' (MB), Current utilization: ' + str(current['utilization']) + '%]\n'
+    gpu_str += '-----------------------------------------------------------------------------------\n'
+    return gpu_str
@@ -5,6 +5,7 @@ Utility functions to manage the lifecycle of TensorBoard and get the path to wri
 """
 import socket
 import subprocess
+import threading
 import time
 import os
 from hops import hdfs as hopshdfs
@@ -24,18 +25,24 @@ pypath = None
 tb_path = None
 local_logdir_path = None
 local_logdir_bool = False
+# the directory TensorBoard shows, set by _register
+tb_logdir = None
+
+_start_lock = threading.Lock()
 
 def _register(hdfs_exec_dir, endpoint_dir, exec_num, local_logdir=False):
     """
+    Prepares TensorBoard for a task. Starting it takes seconds, so it is only started when the task first calls
+    *logdir*, tasks that never write events do not pay for it.
 
     Args:
-        hdfs_exec_dir:
-        endpoint_dir:
-        exec_num:
-        local_logdir:
+        :hdfs_exec_dir: the HDFS directory TensorBoard shows
+        :endpoint_dir: the HDFS directory of the endpoint file with the address of TensorBoard
+        :exec_num: the partition of the task
+        :local_logdir: True to show a local directory instead, copied to hdfs_exec_dir at the end of the task
 
     Returns:
-
+        the endpoint file, written once TensorBoard runs, and the pid of a running TensorBoard, 0 until it is started
     """
     global tb_pid
 
@@ -50,10 +57,40 @@ def _register(hdfs_exec_dir, endpoint_dir, exec_num, local_logdir=False):
     global local_logdir_bool
     local_logdir_bool = local_logdir
 
+    global pypath
+    pypath = os.getenv("PYSPARK_PYTHON")
+
+    global local_logdir_path
+    global tb_logdir
+    if local_logdir:
+        local_logdir_path = os.getcwd() + '/local_logdir'
+        if os.path.exists(local_logdir_path):
+            shutil.rmtree(local_logdir_path)
+            os.makedirs(local_logdir_path)
+        else:
+            os.makedirs(local_logdir_path)
+
+        local_logdir_path = local_logdir_path + '/'
+        tb_logdir = local_logdir_path
+    else:
+        tb_logdir = events_logdir
+
+    global endpoint
+    endpoint = endpoint_dir + "/TensorBoard.task" + str(exec_num)
+
+    return endpoint, tb_pid
+
+def _start():
+    """
+    Starts TensorBoard for the registered task unless it runs already, and dumps its host:port to the endpoint file.
 
-    if tb_pid == 0:
-        global pypath
-        pypath = os.getenv("PYSPARK_PYTHON")
+    Returns:
+        the pid of TensorBoard, 0 if no task registered
+    """
+    global tb_pid
+    with _start_lock:
+        if tb_pid != 0 or endpoint is None:
+            return tb_pid
 
         #find free port
         tb_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -69,35 +106,37 @@ def _register(hdfs_exec_dir, endpoint_dir, exec_num, local_logdir=False):
         tb_env = os.environ.copy()
         tb_env['CUDA_VISIBLE_DEVICES'] = ''
 
-        tb_proc = None
-        global local_logdir_path
-        if local_logdir:
-            local_logdir_path = os.getcwd() + '/local_logdir'
-            if os.path.exists(local_logdir_path):
-                shutil.rmtree(local_logdir_path)
-                os.makedirs(local_logdir_path)
-            else:
-                os.makedirs(local_logdir_path)
-
-            local_logdir_path = local_logdir_path + '/'
-            tb_proc = subprocess.Popen([pypath, tb_path, "--logdir=%s" % local_logdir_path, "--port=%d" % tb_port, "--host=%s" % "0.0.0.0"],
-                                       env=tb_env, preexec_fn=util._on_executor_exit('SIGTERM'))
-        else:
-            tb_proc = subprocess.Popen([pypath, tb_path, "--logdir=%s" % events_logdir, "--port=%d" % tb_port, "--host=%s" % "0.0.0.0"],
+        tb_proc = subprocess.Popen([pypath, tb_path, "--logdir=%s" % tb_logdir, "--port=%d" % tb_port, "--host=%s" % "0.0.0.0"],
                                    env=tb_env, preexec_fn=util._on_executor_exit('SIGTERM'))
-
         tb_pid = tb_proc.pid
 
         host = socket.gethostname()
         global tb_url
         tb_url = "http://{0}:{1}".format(host, tb_port)
-        global endpoint
-        endpoint = endpoint_dir + "/TensorBoard.task" + str(exec_num)
 
         #dump tb host:port to hdfs
-    pydoop.hdfs.dump(tb_url, endpoint, user=hopshdfs.project_user())
+        pydoop.hdfs.dump(tb_url, endpoint, user=hopshdfs.project_user())
+    return tb_pid
 
-    return endpoint, tb_pid
+def _set_trial_logdir(hdfs_exec_dir, name):
+    """
+    Points *logdir* to the directory of the next trial, for tasks that run several trials with one TensorBoard started on
+    the run directory
+
+    Args:
+        :hdfs_exec_dir: HDFS directory of the trial
+        :name: name of the trial, used as its subdirectory of the local logdir
+    """
+    global events_logdir
+    events_logdir = hdfs_exec_dir
+
+    global local_logdir_path
+    if local_logdir_bool:
+        local_logdir_path = os.getcwd() + '/local_logdir/' + name
+        if os.path.exists(local_logdir_path):
+            shutil.rmtree(local_logdir_path)
+        os.makedirs(local_logdir_path)
+        local_logdir_path = local_logdir_path + '/'
 
 def logdir():
     """
@@ -111,6 +150,7 @@ def logdir():
     Returns:
         The path to store files for your experiment. The content is also visualized in TensorBoard.
     """
+    _start()
 
     global local_logdir_bool
     if local_logdir_bool:
@@ -151,6 +191,8 @@ def _restart_debugging(interactive=True):
     """
     global tb_pid
 
+    _start()
+
     #Kill existing TB
     proc = subprocess.Popen(["kill", str(tb_pid)])
     proc.wait()
@@ -253,7 +295,8 @@ def _reset_global():
     global tb_path
     global local_logdir_path
     global local_logdir_bool
-    
+    global tb_logdir
+
     root_logdir_path = None
     events_logdir = None
     tb_pid = 0
@@ -265,3 +308,4 @@ def _reset_global():
     tb_path = None
     local_logdir_path = None
     local_logdir_bool = False
+    tb_logdir = None
@@ -0,0 +1,506 @@
+"""
+Asynchronous trial scheduling with early stopping for Parallel Experiments.
+
+Instead of running one Spark task per hyperparameter combination and waiting for all of them to finish, the driver
+starts a trial server and launches one long-running task per executor. Each task pulls trials from the server one at a
+time, so a slow trial never holds an executor that could be running the next one. The trial server is a *metrics*
+server, so the intermediate metrics trials send with *experiment.report* end up in the metric table, and the scheduler
+decides after each report if the trial should keep running.
+
+*Schedulers*
+    - *FIFOScheduler* runs every trial to completion.
+    - *ASHAScheduler* implements asynchronous successive halving, a trial is stopped when its metric at a rung is not in the top 1/reduction_factor of the trials that reached that rung before it.
+    - *HyperbandScheduler* runs ASHA over several brackets with different minimum resources, trials are assigned to brackets round robin.
+
+>>> from hops import experiment
+>>> from hops import trial_scheduler
+>>> def train_nn(learning_rate, dropout):
+>>>    for epoch in range(1, 28):
+>>>        accuracy = network.train_epoch(learning_rate, dropout)
+>>>        experiment.report(epoch, accuracy)
+>>>    return accuracy
+>>> experiment.grid_search(train_nn, grid_dict, direction='max', scheduler=trial_scheduler.ASHAScheduler(max_resource=27))
+
+Schedulers look at the reported metric called *metric*, or at the only one reported. A stopped trial is ended by
+raising *TrialStopped* from *experiment.report*, the last metric it reported is used as the result of the trial.
+Functions that never call *experiment.report* always run to completion.
+"""
+
+from hops import hdfs as hopshdfs
+from hops import util
+from hops import metrics as hopsmetrics
+from hops import runtime
+from hops.distribute import codec
+
+import time
+import math
+import six
+
+CONTINUE = 'CONTINUE'
+STOP = 'STOP'
+# sent instead of a trial when the next one can only be generated after running trials finished
+WAIT = 'WAIT'
+
+
+class TrialStopped(Exception):
+    """
+    Raised by *experiment.report* inside a trial when the scheduler decided to stop it.
+    """
+    pass
+
+
+class FIFOScheduler(object):
+    """
+    Runs every trial to completion in the order they were created.
+    """
+
+    def __init__(self, metric='metric'):
+        """
+        Args:
+            :metric: name of the reported metric to schedule on
+        """
+        self.metric = metric
+        self.direction = 'max'
+        self.num_stopped = 0
+
+    def _configure(self, direction):
+        """
+        Sets the optimization direction of the experiment
+
+        Args:
+            :direction: 'max' or 'min'
+        """
+        self.direction = direction
+
+    def on_trial_add(self, trial_id):
+        """
+        Called when a trial is handed to an executor
+
+        Args:
+            :trial_id: id of the trial
+        """
+        pass
+
+    def on_trial_result(self, trial_id, step, metric):
+        """
+        Called for every intermediate metric reported by a trial
+
+        Args:
+            :trial_id: id of the trial
+            :step: the step (e.g. epoch) the metric was reported at
+            :metric: the reported metric
+
+        Returns:
+            CONTINUE or STOP
+        """
+        return CONTINUE
+
+    def on_trial_complete(self, trial_id, metric):
+        """
+        Called when a trial finished or was stopped
+
+        Args:
+            :trial_id: id of the trial
+            :metric: the final metric of the trial
+        """
+        pass
+
+
+class _Bracket(object):
+    """
+    A successive halving bracket, with rungs at min_resource * reduction_factor^(k + s)
+    """
+
+    def __init__(self, min_resource, max_resource, reduction_factor, s):
+        self.reduction_factor = reduction_factor
+        num_rungs = int(math.log(float(max_resource) / min_resource, reduction_factor) - s + 1e-9) + 1
+        self.rungs = [(min_resource * reduction_factor ** (k + s), {}) for k in reversed(range(max(num_rungs, 0)))]
+
+    def on_result(self, trial_id, step, metric):
+        """
+        Records the metric in the highest rung the trial just reached
+
+        Args:
+            :trial_id: id of the trial
+            :step: the step the metric was reported at
+            :metric: the reported metric, where higher is better
+
+        Returns:
+            CONTINUE or STOP
+        """
+        for milestone, recorded in self.rungs:
+            if step < milestone or trial_id in recorded:
+                continue
+            action = CONTINUE
+            if len(recorded) > 0:
+                values = sorted(recorded.values(), reverse=True)
+                cutoff = values[int(math.ceil(len(values) / float(self.reduction_factor))) - 1]
+                if metric < cutoff:
+                    action = STOP
+            recorded[trial_id] = metric
+            return action
+        return CONTINUE
+
+
+class ASHAScheduler(FIFOScheduler):
+    """
+    Asynchronous successive halving. Trials report metrics with *experiment.report(step, metric)*, where step is the
+    resource used so far (e.g. epochs). When a trial reaches a rung it is stopped unless its metric is in the top
+    1/reduction_factor of the metrics recorded at that rung so far. Trials that reach max_resource are not stopped, they
+    finish normally with the metric they return.
+    """
+
+    def __init__(self, min_resource=1, max_resource=81, reduction_factor=3, brackets=1, metric='metric'):
+        """
+        Args:
+            :min_resource: the step of the first rung, trials are never stopped before it
+            :max_resource: the full budget of a trial, the last rung is below it
+            :reduction_factor: only 1/reduction_factor of the trials are promoted past each rung
+            :brackets: the number of brackets, each one starting at a higher rung
+            :metric: name of the reported metric to schedule on
+        """
+        super(ASHAScheduler, self).__init__(metric=metric)
+        if min_resource <= 0 or max_resource < min_resource:
+            raise ValueError('Invalid resources, must be 0 < min_resource <= max_resource')
+        if reduction_factor < 2:
+            raise ValueError('reduction_factor must be at least 2')
+        self.min_resource = min_resource
+        self.max_resource = max_resource
+        self.reduction_factor = reduction_factor
+        self.brackets = [_Bracket(min_resource, max_resource, reduction_factor, s) for s in range(brackets)]
+        self._trial_brackets = {}
+
+    def on_trial_add(self, trial_id):
+        """
+        Assigns the trial to a bracket
+
+        Args:
+            :trial_id: id of the trial
+        """
+        if trial_id not in self._trial_brackets:
+            self._trial_brackets[trial_id] = self.brackets[len(self._trial_brackets) % len(self.brackets)]
+
+    def on_trial_result(self, trial_id, step, metric):
+        """
+        Args:
+            :trial_id: id of the trial
+            :step: the step the metric was reported at
+            :metric: the reported metric
+
+        Returns:
+            CONTINUE or STOP
+        """
+        if step >= self.max_resource:
+            # the trial used its full budget and finishes on its own
+            return CONTINUE
+        if self.direction == 'min':
+            metric = -metric
+        self.on_trial_add(trial_id)
+        action = self._trial_brackets[trial_id].on_result(trial_id, step, metric)
+        if action == STOP:
+            self.num_stopped += 1
+        return action
+
+
+class HyperbandScheduler(ASHAScheduler):
+    """
+    Asynchronous Hyperband, ASHA over all the brackets that fit between min_resource and max_resource.
+    """
+
+    def __init__(self, min_resource=1, max_resource=81, reduction_factor=3, metric='metric'):
+        """
+        Args:
+            :min_resource: the step of the first rung of the most aggressive bracket
+            :max_resource: the full budget of a trial, the last rung is below it
+            :reduction_factor: only 1/reduction_factor of the trials are promoted past each rung
+            :metric: name of the reported metric to schedule on
+        """
+        brackets = int(math.log(float(max_resource) / min_resource, reduction_factor) + 1e-9) + 1
+        super(HyperbandScheduler, self).__init__(min_resource=min_resource, max_resource=max_resource,
+                                                 reduction_factor=reduction_factor, brackets=brackets, metric=metric)
+
+
+class Server(hopsmetrics.Server):
+    """
+    Driver side trial server, hands out trials and forwards reported metrics to the scheduler
+    """
+
+    def __init__(self, trials, scheduler, secret=None):
+        """
+        Args:
+            :trials: list of trials, dicts with an 'id', the 'args' for the function and its 'param_string', optionally a
+                     'sub_type' directory to log the trial below and the 'name' of the trial in the metric table
+            :scheduler: the scheduler deciding when trials are stopped
+            :secret: secret of the application from codec.new_secret, executors without it are rejected
+        """
+        super(Server, self).__init__(secret=secret)
+        self.pending = list(reversed(trials))
+        self.scheduler = scheduler
+        self.assigned = {}
+        self.results = {}
+
+    def _on_metric(self, data):
+        """
+        Records the reported metrics and asks the scheduler if the trial should continue
+
+        Args:
+            :data: dict with the 'id' and 'name' of the trial, the 'step' and the 'metrics'
+
+        Returns:
+            CONTINUE or STOP
+        """
+        super(Server, self)._on_metric(data)
+        metric = hopsmetrics._select(data['metrics'], self.scheduler.metric)
+        if metric is None:
+            return CONTINUE
+        return self.scheduler.on_trial_result(data['id'], data['step'], metric)
+
+    def _next_trial(self):
+        """
+        Picks the trial to hand out next, subclasses generate trials on demand by overriding it
+
+        Returns:
+            the trial, WAIT if it depends on trials that are still running, or None if there are no more trials
+        """
+        if len(self.pending) > 0:
+            return self.pending.pop()
+        return None
+
+    def _on_trial_complete(self, result):
+        """
+        Called when a trial finished
+
+        Args:
+            :result: dict with the 'task', 'id', final 'metric', if the trial was 'stopped' early and if it 'failed'
+        """
+        pass
+
+    def _handle_message(self, sock, msg):
+        """
+        Answers TRIAL with the next trial for the asking task and records FINAL results, other messages are handled like
+        on the metric server
+
+        Args:
+            :sock: the socket of the executor
+            :msg: the message, TRIAL has the index of the task as data, FINAL the 'task', 'id', 'metric', 'stopped' and
+                  'failed' of the trial
+        """
+        msg_type = msg['type']
+        with self.lock:
+            if msg_type == 'TRIAL':
+                # a task asking again without finishing its trial is a retried task, give it the same trial
+                trial = self.assigned.get(msg['data'])
+                if trial is None:
+                    trial = self._next_trial()
+                    if trial is not None and trial != WAIT:
+                        trial['metric'] = self.scheduler.metric
+                        self.assigned[msg['data']] = trial
+                        self.scheduler.on_trial_add(trial['id'])
+                self.send(sock, trial)
+            elif msg_type == 'FINAL':
+                self.results[msg['data']['id']] = msg['data']
+                trial = self.assigned.pop(msg['data']['task'], None)
+                # the metric of a stopped trial depends on the scheduler, only completed trials are results
+                if trial is not None and not msg['data']['stopped'] and not msg['data'].get('failed'):
+                    self.table.finish(trial['param_string'], msg['data']['metric'])
+                self.scheduler.on_trial_complete(msg['data']['id'], msg['data']['metric'])
+                self._on_trial_complete(msg['data'])
+                self.send(sock, 'OK')
+            else:
+                super(Server, self)._handle_message(sock, msg)
+
+
+class Client(hopsmetrics.Client):
+    """
+    Executor side client of the trial server
+    """
+
+    def next_trial(self, task, poll_interval=1):
+        """
+        Get the next trial to run, waits while the server can not generate it yet
+
+        Args:
+            :task: index of the Spark task asking
+            :poll_interval: seconds to wait before asking again
+
+        Returns:
+            the trial or None if there are no more trials
+        """
+        trial = self._request('TRIAL', task)
+        while trial == WAIT:
+            time.sleep(poll_interval)
+            trial = self._request('TRIAL', task)
+        return trial
+
+    def finish(self, task, trial_id, metric, stopped, failed=False):
+        """
+        Report the final metric of a trial
+
+        Args:
+            :task: index of the Spark task that ran the trial
+            :trial_id: id of the trial
+            :metric: the final metric, nan if the trial failed
+            :stopped: True if the trial was stopped early
+            :failed: True if the trial raised on every attempt
+        """
+        return self._request('FINAL', {'task': task, 'id': trial_id, 'metric': metric, 'stopped': stopped, 'failed': failed})
+
+
+def _build_trials(map_fun, args_dict, num_trials):
+    """
+    Turns a dict of argument lists into a list of trials
+
+    Args:
+        :map_fun: the function to run
+        :args_dict: dict with a list of values for every argument of map_fun
+        :num_trials: the number of trials
+
+    Returns:
+        list of trials
+    """
+    argcount = six.get_function_code(map_fun).co_argcount
+    names = six.get_function_code(map_fun).co_varnames[:argcount]
+    trials = []
+    for i in range(num_trials):
+        args = [args_dict[name][i] for name in names]
+        param_string = '.'.join([str(name) + '=' + str(val) for name, val in zip(names, args)])
+        trials.append({'id': i, 'args': args, 'param_string': param_string})
+    return trials
+
+
+def _launch(sc, map_fun, args_dict, num_trials, scheduler, direction, app_id, run_id, type, local_logdir=False, retries=0):
+    """
+    Runs all trials on the executors, pulling them from a trial server on the driver
+
+    Args:
+        :sc: SparkContext
+        :map_fun: the function to run
+        :args_dict: dict with a list of values for every argument of map_fun
+        :num_trials: the number of trials
+        :scheduler: the scheduler deciding when trials are stopped
+        :direction: 'max' or 'min'
+        :app_id: YARN application id
+        :run_id: run id of the experiment
+        :type: type of the experiment, e.g. grid_search
+        :local_logdir: True if *tensorboard.logdir()* should be in the local filesystem
+        :retries: number of times a trial is run again after it raised
+
+    Returns:
+        list of (param_string, metric) of every finished trial, stopped trials with their last reported metric and
+        failed trials with nan
+    """
+    scheduler._configure(direction)
+    trials = _build_trials(map_fun, args_dict, num_trials)
+
+    server = Server(trials, scheduler, secret=codec.new_secret())
+    _run(sc, server, map_fun, num_trials, app_id, run_id, type, local_logdir=local_logdir, retries=retries)
+
+    if scheduler.num_stopped > 0:
+        print('Stopped ' + str(scheduler.num_stopped) + ' of ' + str(num_trials) + ' trials early')
+
+    return [(trial['param_string'], server.results[trial['id']]['metric']) for trial in trials if trial['id'] in server.results]
+
+
+def _run(sc, server, map_fun, num_trials, app_id, run_id, type, local_logdir=False, retries=0):
+    """
+    Starts the trial server and runs one task per executor pulling trials from it, until the server has no more trials
+
+    Args:
+        :sc: SparkContext
+        :server: the trial server, the executors connect with its secret
+        :map_fun: the function to run
+        :num_trials: the number of trials, no more tasks than trials are started
+        :app_id: YARN application id
+        :run_id: run id of the experiment
+        :type: type of the experiment, e.g. grid_search
+        :local_logdir: True if *tensorboard.logdir()* should be in the local filesystem
+        :retries: number of times a trial is run again after it raised
+    """
+    server, server_addr = hopsmetrics._start(server)
+
+    try:
+        num_tasks = min(num_trials, util.num_executors())
+    except (TypeError, ValueError):
+        num_tasks = num_trials
+
+    try:
+        nodeRDD = sc.parallelize(range(num_tasks), num_tasks)
+        nodeRDD.foreachPartition(_prepare_func(app_id, run_id, map_fun, local_logdir, server_addr, type, retries, server.secret))
+    finally:
+        server.stop()
+
+
+def _prepare_func(app_id, run_id, map_fun, local_logdir, server_addr, type, retries, secret=None):
+    """
+    Creates the function run by every Spark task of a trial_scheduler experiment
+
+    Args:
+        :app_id: YARN application id
+        :run_id: run id of the experiment
+        :map_fun: the function to run
+        :local_logdir: True if *tensorboard.logdir()* should be in the local filesystem
+        :server_addr: address of the trial server
+        :type: type of the experiment, e.g. grid_search
+        :retries: number of times a trial is run again after it raised
+        :secret: the secret the trial server was started with
+
+    Returns:
+        the function to pass to foreachPartition
+    """
+
+    def _wrapper_fun(iter):
+        """
+        Pulls trials from the trial server and runs them one after the other until the server has no more trials
+
+        Args:
+            :iter: iterator over the index of the Spark task
+        """
+
+        for i in iter:
+            executor_num = i
+
+        client = Client(server_addr, secret=secret)
+
+        with runtime.Task(app_id, run_id, type, executor_num, local_logdir=local_logdir) as task:
+
+            def _attempt(trial, param_string, hdfs_exec_logdir):
+                try:
+                    retval, error = util._run_trial(map_fun, trial['args'], retries, param_string, hdfs_exec_logdir, no_retry=(TrialStopped,))
+                    return retval, error, False
+                except TrialStopped as e:
+                    retval = hopsmetrics._select(hopsmetrics._trial.get('last_metrics', {}), trial['metric'])
+                    if retval is None:
+                        raise
+                    print('\nTrial ' + param_string + ' ' + str(e))
+                    task.log('Trial ' + param_string + ' ' + str(e))
+                    return retval, None, True
+
+            trial = client.next_trial(executor_num)
+            while trial is not None:
+                param_string = trial['param_string']
+                hdfs_exec_logdir = task.create_directories(param_string, sub_type=trial.get('sub_type'))
+                # a retried task skips the trial if it finished before the task failed
+                retval = hopshdfs._finished_metric(hdfs_exec_logdir)
+                if retval is not None:
+                    print('Reading returned metric of finished task ' + param_string + ': ' + str(retval))
+                    client.finish(executor_num, trial['id'], retval, False)
+                    trial = client.next_trial(executor_num)
+                    continue
+                # all trials of the task share one TensorBoard on the run directory and one logfile
+                task.init_logdir(shared=True)
+
+                hopsmetrics._connect(server_addr, trial['id'], trial.get('name', param_string), client=client, secret=secret)
+                try:
+                    retval, error, stopped = task.run(lambda: _attempt(trial, param_string, hdfs_exec_logdir), param_string)
+                finally:
+                    hopsmetrics._disconnect(close=False)
+                if error is None:
+                    task.handle_return(retval)
+                else:
+                    retval = float('nan')
+                task.store_tensorboard()
+
+                client.finish(executor_num, trial['id'], float(retval), stopped, failed=error is not None)
+                trial = client.next_trial(executor_num)
+
+    return _wrapper_fun
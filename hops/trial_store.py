@@ -0,0 +1,413 @@
+"""
+Persistent store of trial results, shared by all experiments of a project.
+
+Finished trials of *grid_search*, *random_search*, *differential_evolution* and *bayesian_optimization* can be
+recorded in a SQLite file in the experiments directory of the project, keyed by a hash of the function, its
+hyperparameters and a dataset version. Before a trial is dispatched the store is checked, and trials with a stored
+result are not run again. Re-running a sweep after a crash or running a second sweep over an overlapping search space
+therefore only costs the trials that never finished.
+
+A function is identified by its name and its bytecode. Globals, closures and the files it reads are not part of the
+key, so the store is only used when the experiment is given a *dataset_version*, which has to change whenever the
+data or the configuration of the function changes.
+
+>>> from hops import experiment
+>>> experiment.grid_search(train_nn, grid_dict, direction='max', dataset_version='v2')
+
+Set *trial_store.enabled* to True to also store and reuse the results of experiments without a dataset_version.
+
+Every sync writes a new generation of the store file, trial_store.<generation>.db, by renaming an uploaded copy onto
+the next generation. The rename fails if another driver wrote that generation first, the store then merges it and
+tries the following one, so concurrent experiments do not lose each other's results.
+"""
+
+from hops import hdfs as hopshdfs
+from hops import metrics as hopsmetrics
+
+import pydoop.hdfs
+import threading
+import uuid
+import hashlib
+import sqlite3
+import tempfile
+import json
+import time
+import six
+import os
+import sys
+
+enabled = False
+
+STORE_FILE = 'trial_store.db'
+
+# generations of the store file kept in HDFS before the latest one, for readers still downloading them
+KEEP_GENERATIONS = 2
+# times a sync merges and tries to write the next generation before it gives up
+SYNC_ATTEMPTS = 10
+
+# SQLite limits the number of variables in a single statement
+_QUERY_BATCH = 500
+
+
+class TrialStore(object):
+    """
+    SQLite file in HDFS, downloaded when it is opened and merged back on every sync
+    """
+
+    def __init__(self, hdfs_path):
+        """
+        Args:
+            :hdfs_path: full HDFS path of the store file without generation, the first generation is written on the
+                        first sync
+        """
+        self.hdfs_path = hdfs_path
+        self.lock = threading.RLock()
+        fd, self.local_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        # the generation this store was last merged with
+        self.generation = self._download(self.local_path)
+        # the trial server thread of steady state differential evolution reads the store too
+        self.conn = sqlite3.connect(self.local_path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS trials (key TEXT PRIMARY KEY, function TEXT, params TEXT, '
+                          'dataset_version TEXT, metric REAL, time REAL)')
+        self.conn.commit()
+
+    def _generation_path(self, generation):
+        """
+        Args:
+            :generation: the generation
+
+        Returns:
+            full HDFS path of the store file of the generation
+        """
+        return self.hdfs_path[:-len('.db')] + '.' + str(generation) + '.db'
+
+    def _generations(self):
+        """
+        Returns:
+            the generations of the store file in HDFS, sorted
+        """
+        directory, name = self.hdfs_path.rsplit('/', 1)
+        prefix = name[:-len('.db')] + '.'
+        generations = []
+        try:
+            paths = pydoop.hdfs.ls(directory)
+        except IOError:
+            return generations
+        for file_path in paths:
+            file_name = file_path.rstrip('/').rsplit('/', 1)[-1]
+            generation = file_name[len(prefix):-len('.db')]
+            if file_name.startswith(prefix) and file_name.endswith('.db') and generation.isdigit():
+                generations.append(int(generation))
+        return sorted(generations)
+
+    def _download(self, local_path):
+        """
+        Copies the latest generation of the store file from HDFS
+
+        Args:
+            :local_path: the local file to write
+
+        Returns:
+            the generation, 0 if there is none in HDFS
+        """
+        for generation in reversed(self._generations()):
+            try:
+                with pydoop.hdfs.open(self._generation_path(generation), 'r') as src:
+                    data = src.read()
+            except IOError:
+                # removed by a newer sync in the meantime
+                continue
+            with open(local_path, 'wb') as dest:
+                dest.write(data)
+            return generation
+        return 0
+
+    def get_many(self, keys):
+        """
+        Looks up stored results
+
+        Args:
+            :keys: trial keys
+
+        Returns:
+            dict of key to metric for the keys with a stored result
+        """
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), _QUERY_BATCH):
+                batch = keys[i:i + _QUERY_BATCH]
+                query = 'SELECT key, metric FROM trials WHERE key IN (' + ','.join('?' * len(batch)) + ')'
+                for key, metric in self.conn.execute(query, batch):
+                    found[key] = metric
+        return found
+
+    def put_many(self, rows):
+        """
+        Stores results
+
+        Args:
+            :rows: list of (key, function, params, dataset_version, metric)
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO trials VALUES (?, ?, ?, ?, ?, ?)',
+                                  [row + (now,) for row in rows])
+            self.conn.commit()
+
+    def _merge(self):
+        """
+        Merges the latest generation in HDFS into the local store
+
+        Returns:
+            the merged generation
+        """
+        fd, remote_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        try:
+            generation = self._download(remote_path)
+            if generation > 0:
+                self.conn.execute('ATTACH DATABASE ? AS remote', (remote_path,))
+                try:
+                    self.conn.execute('INSERT OR IGNORE INTO trials SELECT * FROM remote.trials')
+                    self.conn.commit()
+                finally:
+                    self.conn.execute('DETACH DATABASE remote')
+            return generation
+        finally:
+            os.remove(remote_path)
+
+    def sync(self):
+        """
+        Merges the results other experiments stored in the meantime and writes the store back to HDFS as the next
+        generation. If another experiment writes that generation first, its results are merged and the following
+        generation is tried.
+
+        Raises:
+            IOError if no generation could be written after SYNC_ATTEMPTS attempts
+        """
+        with self.lock:
+            for _ in range(SYNC_ATTEMPTS):
+                generation = self._merge()
+                tmp_path = self.hdfs_path + '.' + uuid.uuid4().hex + '.tmp'
+                hopshdfs._upload_file(self.local_path, tmp_path, True)
+                try:
+                    # renaming onto an existing file fails, only one driver can write a generation
+                    pydoop.hdfs.rename(tmp_path, self._generation_path(generation + 1))
+                except IOError:
+                    pydoop.hdfs.rmr(tmp_path)
+                    continue
+                finally:
+                    hopshdfs._invalidate_stat_cache()
+                self.generation = generation + 1
+                self._remove_generations(self.generation - KEEP_GENERATIONS)
+                return
+            raise IOError('Could not write the trial store ' + self.hdfs_path + ', too many concurrent writers')
+
+    def _remove_generations(self, oldest):
+        """
+        Removes the generations of the store file older than a generation
+
+        Args:
+            :oldest: the oldest generation to keep
+        """
+        for generation in self._generations():
+            if generation < oldest:
+                try:
+                    pydoop.hdfs.rmr(self._generation_path(generation))
+                except IOError:
+                    # removed by another sync
+                    pass
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+            if os.path.exists(self.local_path):
+                os.remove(self.local_path)
+
+
+def _open(dataset_version=None):
+    """
+    Opens the trial store of the project
+
+    Args:
+        :dataset_version: version of the training data of the experiment
+
+    Returns:
+        the TrialStore, None if the experiment has no dataset_version and the store is not enabled for all experiments
+    """
+    if dataset_version is None and not enabled:
+        return None
+    return TrialStore(hopshdfs._get_experiments_dir() + '/' + STORE_FILE)
+
+
+def _arg_names(map_fun):
+    """
+
+    Args:
+        :map_fun: the function of the experiment
+
+    Returns:
+        the names of the arguments of map_fun
+    """
+    code = six.get_function_code(map_fun)
+    return list(code.co_varnames[:code.co_argcount])
+
+
+def _function_key(map_fun):
+    """
+    Identifies a function by its name and bytecode
+
+    Args:
+        :map_fun: the function of the experiment
+
+    Returns:
+        hex digest identifying the function
+    """
+    code = six.get_function_code(map_fun)
+    # nested code objects are left out of the constants, their repr contains a memory address
+    consts = [repr(const) for const in code.co_consts if isinstance(const, (six.string_types, six.integer_types, float, bool, type(None)))]
+    digest = hashlib.sha1()
+    digest.update(map_fun.__name__.encode('utf-8'))
+    digest.update(code.co_code)
+    digest.update(json.dumps([consts, list(code.co_names)]).encode('utf-8'))
+    return map_fun.__name__ + ':' + digest.hexdigest()
+
+
+def _trial_key(function_key, names, args, dataset_version=None):
+    """
+    Canonical key of a trial
+
+    Args:
+        :function_key: key of the function from _function_key
+        :names: names of the arguments
+        :args: values of the arguments
+        :dataset_version: version of the training data
+
+    Returns:
+        the key and the hyperparameters as JSON
+    """
+    # numpy scalars from the random search sampling are turned into python numbers
+    params = json.dumps(sorted([name, arg.item() if hasattr(arg, 'item') else arg] for name, arg in zip(names, args)), default=str)
+    key = hashlib.sha256(json.dumps([function_key, params, dataset_version]).encode('utf-8')).hexdigest()
+    return key, params
+
+
+def _param_string(names, args):
+    """
+
+    Args:
+        :names: names of the arguments
+        :args: values of the arguments
+
+    Returns:
+        the parameter string the wrappers log trials under
+    """
+    return '.'.join([str(name) + '=' + str(arg) for name, arg in zip(names, args)])
+
+
+def _save(store, map_fun, trials, finished, dataset_version=None):
+    """
+    Stores the results of the trials that finished and writes the store back to HDFS
+
+    Args:
+        :store: the TrialStore
+        :map_fun: the function of the experiment
+        :trials: list of argument lists of the trials that were run
+        :finished: dict of param_string to metric of the finished trials
+        :dataset_version: version of the training data
+    """
+    function_key = _function_key(map_fun)
+    names = _arg_names(map_fun)
+    rows = []
+    for args in trials:
+        param_string = _param_string(names, args)
+        if param_string in finished:
+            key, params = _trial_key(function_key, names, args, dataset_version)
+            rows.append((key, function_key, params, dataset_version, float(finished[param_string])))
+    if len(rows) > 0:
+        store.put_many(rows)
+        store.sync()
+
+
+def _run_and_save(store, map_fun, launch, trials, finished, dataset_version=None):
+    """
+    Runs trials and stores the results of the ones that finished, also if the launch fails. The error of a failed
+    launch is raised even if storing the results fails as well, the error of storing is printed then.
+
+    Args:
+        :store: the TrialStore, None to only run the trials
+        :map_fun: the function of the experiment
+        :launch: function without arguments running the trials
+        :trials: list of argument lists of the trials that are run
+        :finished: function without arguments returning dict of param_string to metric of the finished trials
+        :dataset_version: version of the training data
+
+    Returns:
+        what launch returned
+    """
+    if store is None:
+        return launch()
+    try:
+        result = launch()
+    except:
+        exc_info = sys.exc_info()
+        try:
+            _save(store, map_fun, trials, finished(), dataset_version)
+        except Exception as e:
+            print('Could not store the results of the finished trials: ' + str(e))
+        six.reraise(*exc_info)
+    _save(store, map_fun, trials, finished(), dataset_version)
+    return result
+
+
+def _memoize(map_fun, args_dict, launch, dataset_version=None):
+    """
+    Runs the trials of args_dict that have no stored result and stores the results of the ones that finished, also if
+    the launch fails
+
+    Args:
+        :map_fun: the function of the experiment
+        :args_dict: dict with a list of values for every argument of map_fun
+        :launch: function running the trials of the args_dict passed to it, returning list of (param_string, metric)
+        :dataset_version: version of the training data
+
+    Returns:
+        list of (param_string, metric) of all trials in args_dict
+    """
+    store = _open(dataset_version)
+    if store is None:
+        return launch(args_dict)
+
+    try:
+        names = _arg_names(map_fun)
+        function_key = _function_key(map_fun)
+        num_trials = len(args_dict[names[0]])
+        trials = [[args_dict[name][i] for name in names] for i in range(num_trials)]
+        keys = [_trial_key(function_key, names, args, dataset_version)[0] for args in trials]
+        stored = store.get_many(keys)
+
+        todo = [i for i in range(num_trials) if keys[i] not in stored]
+        if len(todo) < num_trials:
+            print('Reusing the stored metric of ' + str(num_trials - len(todo)) + ' of ' + str(num_trials) + ' trials')
+
+        results = dict((_param_string(names, trials[i]), stored[keys[i]]) for i in range(num_trials) if keys[i] in stored)
+        if len(todo) > 0:
+            todo_dict = dict((name, [values[i] for i in todo]) for name, values in args_dict.items())
+            table = hopsmetrics.table
+            start = table.num_results() if table is not None else 0
+
+            def _finished():
+                # trials report their final metric through the metric server, so the table also has the trials that
+                # finished before a failure. Stopped trials are not in it.
+                if hopsmetrics.table is None:
+                    return {}
+                return hopsmetrics.table.results(start if hopsmetrics.table is table else 0)
+
+            results.update(_run_and_save(store, map_fun, lambda: launch(todo_dict), [trials[i] for i in todo], _finished,
+                                         dataset_version))
+
+        param_strings = [_param_string(names, args) for args in trials]
+        return [(param_string, results[param_string]) for param_string in param_strings if param_string in results]
+    finally:
+        store.close()
@@ -8,11 +8,13 @@ import os
 import signal
 from ctypes import cdll
 import itertools
+import math
 import socket
 import json
 import base64
 from datetime import datetime
 import time
+import traceback
 from hops import hdfs
 from hops import version
 from pyspark.sql import SparkSession
@@ -215,6 +217,33 @@ def _get_ip_address():
     s.connect(("8.8.8.8", 80))
     return s.getsockname()[0]
 
+def _reserve_port():
+    """
+    Reserves a free port for the TensorFlow server of the executor until TensorFlow binds it. The socket is bound with
+    SO_REUSEPORT and never listens, the gRPC server of TensorFlow binds with SO_REUSEPORT too and takes the port over,
+    while processes of other users can not bind it in the meantime. Close the socket when the task ends, or before
+    TensorFlow starts if the platform has no SO_REUSEPORT.
+
+    Returns:
+        the socket and the port
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    s.bind(('', 0))
+    return s, s.getsockname()[1]
+
+def _hand_off_port(s):
+    """
+    Hands the port reserved by _reserve_port over to TensorFlow.
+
+    Args:
+        :s: the socket from _reserve_port
+    """
+    # without SO_REUSEPORT TensorFlow can only bind the port once it is free, which leaves a race
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        s.close()
+
 def _time_diff(task_start, task_end):
     """
     Args:
@@ -309,12 +338,13 @@ def _populate_experiment(sc, model_name, module, function, logdir, hyperparamete
                        'versioned_resources': versioned_resources,
                        'description': description})
 
-def _finalize_experiment(experiment_json, hyperparameter, metric):
+def _finalize_experiment(experiment_json, hyperparameter, metric, telemetry=None):
     """
     Args:
         :experiment_json:
         :hyperparameter:
         :metric:
+        :telemetry: the GPU telemetry summaries the tasks published, None if not recorded
 
     Returns:
 
@@ -324,10 +354,47 @@ def _finalize_experiment(experiment_json, hyperparameter, metric):
     experiment_json['hyperparameter'] = hyperparameter
     experiment_json['finished'] = datetime.now().isoformat()
     experiment_json['status'] = "SUCCEEDED"
+    if telemetry:
+        experiment_json['gpu_telemetry'] = telemetry
     experiment_json = _add_version(experiment_json)
 
     return json.dumps(experiment_json)
 
+def _get_best(results):
+    """
+    Computes the best, worst and average metric of the trials of a search that did not fail
+
+    Args:
+        :results: list of (param_string, metric) of every trial, the metric of a failed trial is nan
+
+    Returns:
+        max metric and its param_string, min metric and its param_string, average metric
+    """
+    results = [(param_string, float(metric)) for param_string, metric in results if not math.isnan(metric)]
+    if len(results) == 0:
+        raise Exception('All trials failed, see the error file in the directory of each trial')
+    max_hp, max_val = max(results, key=lambda result: result[1])
+    min_hp, min_val = min(results, key=lambda result: result[1])
+    return max_val, max_hp, min_val, min_hp, sum([metric for _, metric in results]) / len(results)
+
+def _write_result(runid_dir, string):
+    """
+    Writes the summary of a search to its run directory
+
+    Args:
+        :runid_dir: HDFS directory of the run
+        :string: the summary
+    """
+    metric_file = runid_dir + '/summary'
+    fs_handle = hdfs.get_fs()
+    try:
+        fd = fs_handle.open_file(metric_file, mode='w')
+    except:
+        fd = fs_handle.open_file(metric_file, flags='w')
+    fd.write(string.encode())
+    fd.flush()
+    fd.close()
+
 def _add_version(experiment_json):
     experiment_json['spark'] = os.environ['SPARK_VERSION']
 
@@ -354,8 +421,44 @@ def _store_local_tensorboard(local_tb, hdfs_exec_logdir):
 
     """
     tb_contents = os.listdir(local_tb)
-    for entry in tb_contents:
-        pydoop.hdfs.put(local_tb + '/' + entry, hdfs_exec_logdir)
+    hdfs._upload([(local_tb + '/' + entry, hdfs_exec_logdir + '/' + entry) for entry in tb_contents])
+
+def _run_trial(map_fun, args, retries, param_string, hdfs_exec_logdir, no_retry=()):
+    """
+    Runs a trial, retrying it if it raises. A trial that fails on every attempt is recorded as failed with its traceback
+    in the file error of its directory, instead of failing the Spark task and with it the whole experiment.
+
+    Args:
+        :map_fun: the function of the trial
+        :args: list of arguments for map_fun
+        :retries: number of times the trial is run again after it raised
+        :param_string: the parameter string of the trial
+        :hdfs_exec_logdir: the directory of the trial
+        :no_retry: exception types that are raised instead of retried
+
+    Returns:
+        the return value of map_fun and None, or None and the traceback of the last attempt if the trial failed
+    """
+    attempt = 0
+    while True:
+        try:
+            return map_fun(*args), None
+        except no_retry:
+            raise
+        except Exception:
+            error = traceback.format_exc()
+        print(error)
+        hdfs.log(error, level='ERROR')
+        if attempt >= retries:
+            break
+        attempt += 1
+        print('Retrying task ' + param_string + ', attempt ' + str(attempt) + ' of ' + str(retries))
+        hdfs.log('Retrying task ' + param_string + ', attempt ' + str(attempt) + ' of ' + str(retries), level='WARNING')
+
+    print('Task ' + param_string + ' failed, the experiment continues without it')
+    hdfs.log('Task ' + param_string + ' failed, the experiment continues without it', level='ERROR')
+    hdfs.dump(error, hdfs_exec_logdir + '/error')
+    return None, error
 
 def _version_resources(versioned_resources, rundir):
     """
@@ -0,0 +1,129 @@
+"""
+Tests of the search space encoding, the Gaussian process and the proposals of the Bayesian optimization driver.
+"""
+
+import math
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('pydoop')
+
+from hops import bayesian_optimization
+
+
+@pytest.fixture
+def space():
+    boundary_dict = {'lr': [0.001, 0.1, 'log'], 'dropout': [0.0, 0.5], 'layers': [1, 4], 'units': [16, 1024, 'log'],
+                     'optimizer': ['adam', 'sgd', 'rmsprop']}
+    return bayesian_optimization._Space(boundary_dict, ['lr', 'dropout', 'layers', 'units', 'optimizer'])
+
+
+def test_space_dimensions(space):
+    assert space.dims == 7
+    assert [param['kind'] for param in space.params] == ['log', 'range', 'range', 'log', 'cat']
+
+
+@pytest.mark.parametrize('args', [[0.001, 0.0, 1, 16, 'adam'], [0.1, 0.5, 4, 1024, 'rmsprop'],
+                                  [0.01, 0.25, 2, 128, 'sgd'], [0.0042, 0.1, 3, 1000, 'adam']])
+def test_encode_decode_round_trip(space, args):
+    x = space.encode(args)
+    assert np.all(x >= 0) and np.all(x <= 1)
+    decoded = space.decode(x)
+    assert decoded[0] == pytest.approx(args[0])
+    assert decoded[1] == pytest.approx(args[1])
+    assert decoded[2:] == args[2:]
+    assert isinstance(decoded[2], int) and isinstance(decoded[3], int)
+
+
+def test_decode_clamps_to_the_bounds(space):
+    assert space.decode(np.full(space.dims, 2.0))[:4] == pytest.approx([0.1, 0.5, 4, 1024])
+    assert space.decode(np.full(space.dims, -1.0))[:4] == pytest.approx([0.001, 0.0, 1, 16])
+
+
+def test_integers_get_equal_shares_of_the_unit_interval():
+    space = bayesian_optimization._Space({'layers': [1, 4]}, ['layers'])
+    assert [space.decode(np.array([v]))[0] for v in (0.0, 0.24, 0.26, 0.49, 0.51, 0.74, 0.76, 1.0)] == \
+        [1, 1, 2, 2, 3, 3, 4, 4]
+
+
+def test_sample_is_within_the_bounds(space):
+    np.random.seed(0)
+    for lr, dropout, layers, units, optimizer in space.sample(200):
+        assert 0.001 <= lr <= 0.1
+        assert 0.0 <= dropout <= 0.5
+        assert 1 <= layers <= 4
+        assert 16 <= units <= 1024
+        assert optimizer in ('adam', 'sgd', 'rmsprop')
+
+
+@pytest.mark.parametrize('boundaries', [[0.1, 0.01], [0.0, 1.0, 'log'], ['adam']])
+def test_invalid_boundaries(boundaries):
+    with pytest.raises(ValueError):
+        bayesian_optimization._Space({'x': boundaries}, ['x'])
+
+
+def test_gaussian_process_interpolates_observations():
+    X = np.linspace(0, 1, 8)[:, np.newaxis]
+    y = np.sin(6 * X[:, 0])
+    gp = bayesian_optimization._GaussianProcess()
+    gp.fit(X, y)
+
+    mu, sigma = gp.predict(X)
+    assert mu == pytest.approx(y, abs=1e-2)
+    assert np.all(sigma < 0.05)
+
+    Xs = np.array([[0.5 / 7], [3.0]])
+    mu, sigma = gp.predict(Xs)
+    assert mu[0] == pytest.approx(math.sin(6 * 0.5 / 7), abs=0.1)
+    assert sigma[1] > 10 * sigma[0]
+
+
+def test_gaussian_process_ignores_irrelevant_dimensions():
+    np.random.seed(1)
+    X = np.random.rand(20, 2)
+    y = np.cos(4 * X[:, 0])
+    gp = bayesian_optimization._GaussianProcess()
+    gp.fit(X, y)
+    assert gp.lengthscale[1] > gp.lengthscale[0]
+
+
+def test_expected_improvement_prefers_uncertainty_and_mean():
+    ei = bayesian_optimization._expected_improvement(np.array([1.0, 1.0, 2.0]), np.array([0.1, 1.0, 0.1]), 1.5)
+    assert ei[1] > ei[0]
+    assert ei[2] > ei[1]
+
+
+@pytest.mark.parametrize('direction', ['max', 'min'])
+def test_server_converges_on_a_synthetic_objective(direction):
+    np.random.seed(2)
+    space = bayesian_optimization._Space({'x': [0.0, 1.0], 'y': [0.0, 1.0]}, ['x', 'y'])
+    server = bayesian_optimization._BayesianServer(space, 25, 5, direction, None)
+    sign = 1.0 if direction == 'max' else -1.0
+
+    def objective(x, y):
+        return sign * -((x - 0.3) ** 2 + (y - 0.7) ** 2)
+
+    while True:
+        trial = server._next_trial()
+        if trial is None:
+            break
+        server._on_trial_complete({'id': trial['id'], 'metric': objective(*trial['args'])})
+
+    assert len(server.observed) == 25
+    assert len(set(param_string for _, param_string, _ in server.observed)) == 25
+    best = max(server.observed, key=lambda observed: sign * observed[2])[0]
+    assert best[0] == pytest.approx(0.3, abs=0.1)
+    assert best[1] == pytest.approx(0.7, abs=0.1)
+
+
+def test_server_leaves_failed_trials_out():
+    np.random.seed(3)
+    space = bayesian_optimization._Space({'x': [0.0, 1.0]}, ['x'])
+    server = bayesian_optimization._BayesianServer(space, 6, 2, 'max', None)
+    for i in range(6):
+        trial = server._next_trial()
+        server._on_trial_complete({'id': trial['id'], 'metric': float('nan'), 'failed': i % 2 == 0})
+    assert server._next_trial() is None
+    assert len(server.failed) == 3
+    assert len(server.observed) == 3
@@ -0,0 +1,86 @@
+"""
+Tests of the wire format of the reservation, metric and trial servers.
+"""
+
+import json
+
+import pytest
+
+from hops.distribute import codec
+
+
+MESSAGES = [{'type': 'REG', 'data': {'index': 3, 'worker': '10.0.0.1:2222'}},
+            {'type': 'REG', 'data': {'task_type': 'ps', 'host_port': '10.0.0.1:2222', 'gpus_present': False}},
+            {'type': 'QUERY'}, 'OK', True, None,
+            {'cluster': {'worker': ['10.0.0.1:2222', '10.0.0.2:2222']}, 'task': {'type': 'worker', 'index': 1}},
+            {'type': 'METRIC', 'data': {'step': 10, 'metrics': {'accuracy': 0.5, 'name': u'åäö'}}}]
+
+
+@pytest.mark.parametrize('secret', [None, codec.new_secret()])
+@pytest.mark.parametrize('msg', MESSAGES)
+def test_round_trip(secret, msg):
+    msg_codec = codec.Codec(secret)
+    frame = msg_codec.frame(msg)
+    length = codec.HEADER.unpack_from(frame)[0]
+    assert length == len(frame) - codec.HEADER.size
+    assert msg_codec.decode(bytearray(frame[codec.HEADER.size:])) == msg
+
+
+def test_the_payload_is_compact_json():
+    body = codec.Codec().encode({'type': 'QUERY'})
+    assert body == b'\x01\x00{"type":"QUERY"}'
+    assert json.loads(body[2:].decode('utf-8')) == {'type': 'QUERY'}
+
+
+def test_numpy_values():
+    np = pytest.importorskip('numpy')
+    msg = {'metric': np.float32(0.5), 'step': np.int64(3), 'values': np.arange(3)}
+    assert codec.Codec().decode(codec.Codec().encode(msg)) == {'metric': 0.5, 'step': 3, 'values': [0, 1, 2]}
+
+
+def test_objects_are_not_sent():
+    with pytest.raises(TypeError):
+        codec.Codec().encode({'data': object()})
+
+
+def test_secrets_are_random():
+    assert codec.new_secret() != codec.new_secret()
+    assert len(codec.new_secret()) == 64
+
+
+def test_hmac_rejects_a_wrong_secret():
+    body = codec.Codec(codec.new_secret()).encode({'type': 'STOP'})
+    with pytest.raises(ValueError, match='not authenticated'):
+        codec.Codec(codec.new_secret()).decode(body)
+
+
+def test_hmac_rejects_unsigned_messages():
+    secret = codec.new_secret()
+    with pytest.raises(ValueError, match='not authenticated'):
+        codec.Codec(secret).decode(codec.Codec().encode({'type': 'STOP'}))
+
+
+def test_hmac_rejects_a_modified_payload():
+    secret = codec.new_secret()
+    body = bytearray(codec.Codec(secret).encode({'type': 'REG', 'data': {'index': 1}}))
+    body[-2:-1] = b'2'
+    with pytest.raises(ValueError, match='not authenticated'):
+        codec.Codec(secret).decode(body)
+
+
+def test_hmac_rejects_a_truncated_digest():
+    secret = codec.new_secret()
+    body = codec.Codec(secret).encode({'type': 'STOP'})
+    with pytest.raises(ValueError):
+        codec.Codec(secret).decode(body[:10])
+
+
+def test_signed_messages_decode_without_a_secret():
+    body = codec.Codec(codec.new_secret()).encode({'type': 'STOP'})
+    assert codec.Codec().decode(body) == {'type': 'STOP'}
+
+
+@pytest.mark.parametrize('body', [b'', b'\x01', b'\x02\x00{}'])
+def test_malformed_bodies(body):
+    with pytest.raises(ValueError):
+        codec.Codec().decode(body)
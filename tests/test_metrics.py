@@ -0,0 +1,71 @@
+"""
+Tests of the metric and trial servers on localhost.
+"""
+
+import pytest
+
+pytest.importorskip('pydoop')
+
+from hops import metrics
+from hops import trial_scheduler
+from hops.distribute import codec
+
+
+@pytest.fixture
+def secret():
+    return codec.new_secret()
+
+
+def test_reports_with_the_secret_reach_the_table(secret):
+    server, server_addr = metrics._start(secret=secret)
+    try:
+        client = metrics.Client(server_addr, secret=secret)
+        trial = {'id': 0, 'name': 'lr=0.1', 'param_string': 'lr=0.1'}
+        assert client.report(trial, 1, {'accuracy': 0.5}) == 'OK'
+        assert client.result(trial, 0.5) == 'OK'
+        client.close()
+    finally:
+        server.stop()
+    assert [(row['trial'], row['step'], row['accuracy']) for row in server.table.rows()] == [('lr=0.1', 1, 0.5)]
+    assert server.table.results() == {'lr=0.1': 0.5}
+
+
+@pytest.mark.parametrize('wrong', [None, 'wrong'])
+def test_clients_without_the_secret_are_rejected(secret, wrong):
+    server, server_addr = metrics._start(secret=secret)
+    try:
+        client = metrics.Client(server_addr, secret=codec.new_secret() if wrong else None)
+        client.sock.settimeout(5)
+        with pytest.raises(Exception, match='socket closed'):
+            client.result({'id': 0, 'param_string': 'lr=0.1'}, 99.0)
+        client.close()
+
+        client = metrics.Client(server_addr, secret=wrong)
+        client.sock.settimeout(5)
+        with pytest.raises(Exception, match='socket closed'):
+            client.request_stop()
+        client.close()
+        assert not server.done
+    finally:
+        server.stop()
+    assert server.table.results() == {}
+
+
+def test_trial_server_rejects_decisions_without_the_secret(secret):
+    trials = [{'id': 0, 'args': [0.1], 'param_string': 'lr=0.1'}]
+    server, server_addr = metrics._start(trial_scheduler.Server(trials, trial_scheduler.FIFOScheduler(), secret=secret))
+    try:
+        client = trial_scheduler.Client(server_addr)
+        client.sock.settimeout(5)
+        with pytest.raises(Exception, match='socket closed'):
+            client.finish(0, 0, 99.0, False)
+        client.close()
+
+        client = trial_scheduler.Client(server_addr, secret=secret)
+        assert client.next_trial(0)['param_string'] == 'lr=0.1'
+        assert client.finish(0, 0, 0.5, False) == 'OK'
+        assert client.next_trial(0) is None
+        client.close()
+    finally:
+        server.stop()
+    assert server.table.results() == {'lr=0.1': 0.5}
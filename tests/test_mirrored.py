@@ -0,0 +1,74 @@
+"""
+Tests of the multi executor mode of the mirrored strategy with CPU-only executors on one machine.
+"""
+
+import json
+import multiprocessing
+import os
+
+import pytest
+
+pytest.importorskip('pydoop')
+
+from hops.distribute import allreduce_reservation
+from hops.distribute import codec
+from hops.distribute import mirrored
+
+
+def _executor(server_addr, secret, executor_num):
+    task_index, heartbeat, tmp_socket = mirrored._join_cluster(server_addr, secret, executor_num)
+    tf_config = json.loads(os.environ['TF_CONFIG'])
+    heartbeat.stop()
+    tmp_socket.close()
+    return task_index, tf_config
+
+
+def _check_cluster(results, num_executors):
+    workers = results[0][1]['cluster']['worker']
+    assert len(workers) == num_executors
+    assert sorted(task_index for task_index, _ in results) == list(range(num_executors))
+    for task_index, tf_config in results:
+        assert tf_config['cluster'] == results[0][1]['cluster']
+        assert tf_config['task'] == {'type': 'worker', 'index': task_index}
+
+
+@pytest.fixture
+def reservation_server():
+    secret = codec.new_secret()
+    server = allreduce_reservation.Server(3, secret=secret)
+    yield server.start(), secret
+    server.stop()
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs the fork start method')
+def test_cpu_executors_form_a_cluster(reservation_server):
+    server_addr, secret = reservation_server
+    # every executor is a python process of its own, like the python workers of Spark
+    pool = multiprocessing.get_context('fork').Pool(3)
+    try:
+        results = pool.starmap(_executor, [(server_addr, secret, executor_num) for executor_num in range(3)])
+    finally:
+        pool.close()
+        pool.join()
+    _check_cluster(results, 3)
+
+
+def test_cpu_executors_on_local_spark(reservation_server, monkeypatch):
+    pyspark = pytest.importorskip('pyspark.context')
+    server_addr, secret = reservation_server
+    # the python workers of the local Spark import hops and this module from the source tree
+    tests = os.path.dirname(os.path.abspath(__file__))
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join([os.path.dirname(tests), tests, os.environ.get('PYTHONPATH', '')]))
+    sc = pyspark.SparkContext('local[3]', 'test_mirrored')
+    try:
+        results = sc.parallelize(range(3), 3).map(lambda executor_num: _executor(server_addr, secret, executor_num)).collect()
+    finally:
+        sc.stop()
+    _check_cluster(results, 3)
+
+
+def test_single_executor_uses_the_local_devices(monkeypatch):
+    pytest.importorskip('tensorflow')
+    monkeypatch.delenv('TF_CONFIG', raising=False)
+    assert 'MirroredStrategy' in type(mirrored.strategy()).__name__
+    assert 'MultiWorker' not in type(mirrored.strategy()).__name__
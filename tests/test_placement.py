@@ -0,0 +1,81 @@
+"""
+Tests of the cluster spec construction from synthetic reservations, no cluster is needed.
+"""
+
+import random
+
+from hops.distribute import placement
+
+
+def _reservations(hosts, per_host, **fields):
+    return [dict(fields, host_port='%s:%d' % (host, 2222 + i)) for host in hosts for i in range(per_host)]
+
+
+def test_ring_order_groups_executors_by_host():
+    reservations = _reservations(['10.0.0.10', '10.0.0.9', '10.0.1.2'], 2)
+    ring = placement.ring_order(reservations)
+    assert ring == ['10.0.0.9:2222', '10.0.0.9:2223', '10.0.0.10:2222', '10.0.0.10:2223',
+                    '10.0.1.2:2222', '10.0.1.2:2223']
+    assert placement.cross_host_hops(ring) == 3
+
+
+def test_ring_order_does_not_depend_on_arrival_order():
+    reservations = _reservations(['10.0.0.%d' % i for i in range(1, 6)], 4)
+    expected = placement.ring_order(reservations)
+    for seed in range(10):
+        shuffled = list(reservations)
+        random.Random(seed).shuffle(shuffled)
+        assert placement.ring_order(shuffled) == expected
+        assert placement.cross_host_hops(placement.ring_order(shuffled)) == 5
+
+
+def test_ring_crosses_every_rack_boundary_once():
+    reservations = _reservations(['10.0.0.1', '10.0.1.1', '10.0.0.2', '10.0.1.2'], 2)
+    ring = placement.ring_order(reservations)
+    racks = [placement.rack({'host_port': host_port}) for host_port in ring]
+    assert sum(1 for i in range(len(racks)) if racks[i] != racks[i - 1]) == 2
+
+
+def test_rack():
+    assert placement.rack({'host_port': '10.0.3.7:2222'}) == '10.0.3'
+    assert placement.rack({'host_port': '10.0.3.7:2222', 'rack': '/rack1'}) == '/rack1'
+    assert placement.rack({'host_port': 'worker-1:2222'}) == ''
+
+
+def test_cross_host_hops_of_small_rings():
+    assert placement.cross_host_hops([]) == 0
+    assert placement.cross_host_hops(['10.0.0.1:2222']) == 0
+    assert placement.cross_host_hops(['10.0.0.1:2222', '10.0.0.1:2223']) == 0
+    assert placement.cross_host_hops(['10.0.0.1:2222', '10.0.0.2:2222']) == 2
+
+
+def test_parameter_servers_are_spread_over_hosts_without_gpus():
+    hosts = ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+    reservations = _reservations(hosts, 2, task_type='worker', gpus_present=True)
+    reservations += [{'host_port': '10.0.0.%d:3333' % i, 'task_type': 'ps', 'gpus_present': False} for i in (1, 2)]
+    random.Random(0).shuffle(reservations)
+
+    spec = placement.parameter_server_spec(reservations)
+
+    assert sorted(spec['ps']) == ['10.0.0.1:3333', '10.0.0.2:3333']
+    assert spec['chief'] == ['10.0.0.1:2222']
+    roles = spec['chief'] + spec['ps'] + spec['worker']
+    assert sorted(roles) == sorted(reservation['host_port'] for reservation in reservations)
+
+
+def test_parameter_servers_take_turns_between_hosts_and_racks():
+    reservations = _reservations(['10.0.0.1', '10.0.0.2', '10.0.1.1'], 3, task_type='worker', gpus_present=False)
+    for reservation in reservations[:3]:
+        reservation['task_type'] = 'ps'
+
+    spec = placement.parameter_server_spec(reservations)
+
+    ps_hosts = [host_port.split(':')[0] for host_port in spec['ps']]
+    assert sorted(ps_hosts) == ['10.0.0.1', '10.0.0.2', '10.0.1.1']
+    assert len(spec['chief']) == 1
+    assert len(spec['worker']) == 5
+
+
+def test_parameter_server_spec_without_workers():
+    reservations = [{'host_port': '10.0.0.1:2222', 'task_type': 'ps', 'gpus_present': False}]
+    assert placement.parameter_server_spec(reservations) == {'chief': [], 'ps': ['10.0.0.1:2222'], 'worker': []}
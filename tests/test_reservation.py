@@ -0,0 +1,219 @@
+"""
+Tests of the reservation servers and clients on localhost.
+"""
+
+import socket
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('pydoop')
+
+from hops import util
+from hops.distribute import allreduce_reservation
+from hops.distribute import codec
+from hops.distribute import parameter_server_reservation
+from hops.distribute import reservation_benchmark
+
+
+def _in_threads(target, count):
+    results = [None] * count
+    errors = []
+
+    def run(index):
+        try:
+            results[index] = target(index)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    assert not errors, errors
+    return results
+
+
+@pytest.fixture
+def allreduce_server():
+    server = allreduce_reservation.Server(4)
+    yield server, server.start()
+    server.stop()
+
+
+def test_await_releases_all_workers_when_the_last_one_registers(allreduce_server):
+    server, server_addr = allreduce_server
+    clients = [allreduce_reservation.Client(server_addr) for _ in range(4)]
+    for index, client in enumerate(clients[:3]):
+        client.register({'index': index, 'worker': '127.0.0.1:%d' % (20000 + index)})
+    assert not clients[0]._request('QUERY')
+
+    def await_cluster(index):
+        cluster = clients[index].await_reservations()
+        return cluster, time.time()
+
+    waiters = threading.Thread(target=lambda: results.extend(_in_threads(await_cluster, 3)))
+    results = []
+    waiters.start()
+    time.sleep(0.5)
+    assert results == []
+
+    registered = time.time()
+    clients[3].register({'index': 3, 'worker': '127.0.0.1:20003'})
+    waiters.join(10)
+
+    assert len(results) == 3
+    for cluster, released in results:
+        assert cluster == clients[3].await_reservations()
+        assert len(cluster['cluster']['worker']) == 4
+        assert released - registered < 0.5
+    for client in clients:
+        client.close()
+
+
+def test_await_after_the_cluster_is_complete(allreduce_server):
+    server, server_addr = allreduce_server
+
+    def register(index):
+        client = allreduce_reservation.Client(server_addr)
+        client.register({'index': index, 'worker': '127.0.0.1:%d' % (20000 + index)})
+        return client
+
+    clients = _in_threads(register, 4)
+    assert clients[0]._request('QUERY')
+    assert server.await_reservations(None, timeout=5) == clients[1].await_reservations()
+    for client in clients:
+        client.close()
+
+
+def test_parameter_server_barriers(monkeypatch):
+    monkeypatch.setattr(util, 'num_executors', lambda: 3)
+    monkeypatch.setattr(util, 'num_param_servers', lambda: 1)
+    server = parameter_server_reservation.Server(3)
+    server_addr = server.start()
+    try:
+        def executor(index):
+            client = parameter_server_reservation.Client(server_addr)
+            task_type = 'ps' if index == 0 else 'worker'
+            client.register({'task_type': task_type, 'host_port': '127.0.0.1:%d' % (20000 + index),
+                             'gpus_present': False})
+            cluster = client.await_reservations()
+            if task_type == 'ps':
+                # the parameter server waits for the workers to finish
+                finished = client.await_all_workers_finished()
+            else:
+                time.sleep(0.2)
+                finished = client.register_worker_finished()
+            client.close()
+            return cluster, finished
+
+        results = _in_threads(executor, 3)
+    finally:
+        server.stop()
+
+    clusters = [cluster for cluster, _ in results]
+    assert all(cluster == clusters[0] for cluster in clusters)
+    assert clusters[0]['ps'] == ['127.0.0.1:20000']
+    assert len(clusters[0]['chief'] + clusters[0]['worker']) == 2
+    assert [finished for _, finished in results] == [True, 'OK', 'OK']
+
+
+@pytest.mark.parametrize('num_workers', [8, 64])
+def test_barrier_latency(num_workers):
+    latency, total = reservation_benchmark._run_barrier(num_workers)
+    assert latency < 1.0
+
+
+def _raw_connection(server_addr):
+    sock = socket.create_connection(server_addr)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def test_messages_split_over_many_sends(allreduce_server):
+    server, server_addr = allreduce_server
+    frames = [codec.Codec().frame({'type': 'REG', 'data': {'index': i, 'worker': '127.0.0.1:%d' % (20000 + i)}})
+              for i in range(2)]
+    socks = [_raw_connection(server_addr) for _ in frames]
+    # the two frames arrive interleaved, a byte at a time
+    for i in range(len(frames[0])):
+        for sock, frame in zip(socks, frames):
+            if i < len(frame):
+                sock.sendall(frame[i:i + 1])
+        if i % 8 == 0:
+            time.sleep(0.001)
+    for sock in socks:
+        assert allreduce_reservation.MessageSocket().receive(sock) == 'OK'
+        sock.close()
+    assert server.reservations.remaining() == 2
+
+
+def test_recv_exact_reads_large_messages():
+    left, right = socket.socketpair()
+    msg = {'type': 'QINFO', 'data': 'x' * (4 * 1024 * 1024)}
+    sender = threading.Thread(target=allreduce_reservation.MessageSocket().send, args=(left, msg))
+    sender.start()
+    assert allreduce_reservation.MessageSocket().receive(right) == msg
+    sender.join()
+    left.close()
+    right.close()
+
+
+@pytest.mark.parametrize('frame', [codec.HEADER.pack(codec.MAX_SIZE + 1), codec.HEADER.pack(3) + b'\x01\x00[',
+                                   codec.HEADER.pack(4) + b'\x09\x00{}', codec.Codec().frame(['REG'])])
+def test_bad_frames_close_only_their_connection(allreduce_server, frame):
+    server, server_addr = allreduce_server
+    sock = _raw_connection(server_addr)
+    sock.sendall(frame)
+    sock.settimeout(5)
+    assert sock.recv(1) == b''
+    sock.close()
+
+    client = allreduce_reservation.Client(server_addr)
+    assert client._request('QUERY') is False
+    client.close()
+
+
+def test_hundreds_of_connected_executors():
+    num_clients = 300
+    server = allreduce_reservation.Server(num_clients)
+    server_addr = server.start()
+    try:
+        clients = [allreduce_reservation.Client(server_addr) for _ in range(num_clients)]
+
+        def executor(index):
+            clients[index].register({'index': index, 'worker': '127.0.0.1:%d' % (20000 + index)})
+            for _ in range(5):
+                assert clients[index]._request('QUERY') in (True, False)
+            return clients[index].await_reservations()
+
+        clusters = _in_threads(executor, num_clients)
+    finally:
+        for client in clients:
+            client.close()
+        server.stop()
+    assert all(len(cluster['cluster']['worker']) == num_clients for cluster in clusters)
+
+
+def test_clients_without_the_secret_are_rejected():
+    secret = codec.new_secret()
+    server = allreduce_reservation.Server(1, secret=secret)
+    server_addr = server.start()
+    try:
+        for wrong in (None, codec.new_secret()):
+            client = allreduce_reservation.Client(server_addr, secret=wrong)
+            client.sock.settimeout(5)
+            with pytest.raises(Exception, match='socket closed'):
+                client.request_stop()
+            client.close()
+        assert not server.done
+
+        client = allreduce_reservation.Client(server_addr, secret=secret)
+        client.register({'index': 0, 'worker': '127.0.0.1:20000'})
+        assert client.await_reservations()['cluster']['worker'] == ['127.0.0.1:20000']
+        assert client.request_stop() == 'OK'
+        client.close()
+    finally:
+        server.stop()
@@ -0,0 +1,78 @@
+"""
+Tests of the GPU telemetry on a fake NVML, no GPU is needed.
+"""
+
+import itertools
+import time
+
+import pytest
+
+from hops import telemetry
+
+
+@pytest.fixture
+def gpus():
+    utilization = itertools.cycle([20, 60])
+    fake = telemetry.FakeNvml([{'name': 'Tesla P100', 'memory_total': 16280, 'memory_used': 1024,
+                                'utilization': lambda: next(utilization)},
+                               {'name': 'Tesla P100', 'memory_total': 16280, 'pci_bus_id': '00000000:81:00.0'}])
+    telemetry.set_backend(telemetry.NvmlBackend(fake))
+    yield fake
+    telemetry.set_backend(None)
+
+
+def test_devices(gpus):
+    assert telemetry.num_gpus() == 2
+    assert telemetry.devices() == [
+        {'index': 0, 'name': 'Tesla P100', 'memory_total': 16280, 'minor_number': 0,
+         'pci_bus_id': '00000000:00:00.0'},
+        {'index': 1, 'name': 'Tesla P100', 'memory_total': 16280, 'minor_number': 1,
+         'pci_bus_id': '00000000:81:00.0'}]
+
+
+def test_sample(gpus):
+    assert telemetry.sample() == [{'utilization': 20, 'memory_used': 1024}, {'utilization': 0, 'memory_used': 0}]
+
+
+def test_sampler_summarizes_all_samples(gpus):
+    sampler = telemetry.Sampler(interval=0.01, capacity=3).start()
+    deadline = time.time() + 5
+    while sampler.count < 6 and time.time() < deadline:
+        time.sleep(0.01)
+    summary = sampler.stop()
+    count = summary['samples']
+
+    assert count >= 6
+    assert len(sampler.samples()) == 3
+    first, second = summary['devices']
+    assert first['utilization_max'] == 60
+    assert first['utilization_mean'] == round((20 * ((count + 1) // 2) + 60 * (count // 2)) / float(count), 1)
+    assert first['memory_used_mean'] == 1024
+    assert first['memory_used_max'] == 1024
+    assert second['utilization_max'] == 0
+    assert second['name'] == 'Tesla P100'
+
+
+def test_sampler_without_gpus_does_not_sample():
+    telemetry.set_backend(telemetry.NvmlBackend(telemetry.FakeNvml([])))
+    try:
+        sampler = telemetry.Sampler(interval=0.01).start()
+        time.sleep(0.05)
+        summary = sampler.stop()
+    finally:
+        telemetry.set_backend(None)
+    assert summary['samples'] == 0
+    assert summary['devices'] == []
+
+
+def test_sample_of_unreadable_gpus_is_empty(gpus):
+    def fail(handle):
+        raise RuntimeError('NVML_ERROR_GPU_IS_LOST')
+    gpus.nvmlDeviceGetUtilizationRates = fail
+    assert telemetry.sample() == []
+    assert telemetry.num_gpus() == 2
+
+
+def test_format_utilization(gpus):
+    text = telemetry._format_utilization(telemetry.sample())
+    assert 'Type: Tesla P100, Memory Usage: 1024 /16280 (MB), Current utilization: 20%' in text
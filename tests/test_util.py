@@ -0,0 +1,22 @@
+"""
+Tests of the driver side helpers of the searches.
+"""
+
+import pytest
+
+pytest.importorskip('pydoop')
+
+from hops import util
+
+
+def test_get_best_leaves_failed_trials_out():
+    results = [('lr=0.1', 0.5), ('lr=0.2', float('nan')), ('lr=0.3', 0.9), ('lr=0.4', 0.1), ('lr=0.5', 0.9)]
+    max_val, max_hp, min_val, min_hp, avg = util._get_best(results)
+    assert (max_val, max_hp) == (0.9, 'lr=0.3')
+    assert (min_val, min_hp) == (0.1, 'lr=0.4')
+    assert avg == pytest.approx(0.6)
+
+
+def test_get_best_of_failed_trials():
+    with pytest.raises(Exception, match='All trials failed'):
+        util._get_best([('lr=0.1', float('nan'))])